@@ -116,6 +116,7 @@ export async function POST(request: Request) {
     const backendUrl = process.env.BACKEND_URL;
     if (wantsStream) {
       if (backendUrl) {
+        const lastEventId = request.headers.get("last-event-id");
         const response = await fetch(
           `${backendUrl.replace(/\/$/, "")}/chat/stream`,
           {
@@ -123,6 +124,7 @@ export async function POST(request: Request) {
             headers: {
               "Content-Type": "application/json",
               Accept: "text/event-stream",
+              ...(lastEventId ? { "Last-Event-ID": lastEventId } : {}),
             },
             body: JSON.stringify({
               messages,
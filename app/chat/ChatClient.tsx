@@ -18,6 +18,10 @@ type ChatMessage = {
   content: string;
 };
 
+// Reconnects to a dropped chat stream before giving up.
+const STREAM_RECONNECT_MAX = 3;
+const STREAM_RECONNECT_DELAY_MS = 1000;
+
 export default function ChatClient() {
   const searchParams = useSearchParams();
   const prompt = searchParams.get("prompt") ?? "";
@@ -127,86 +131,127 @@ export default function ChatClient() {
   async function streamReply(nextMessages: ChatMessage[]) {
     let reply = "";
     let inserted = false;
+    // "<run_id>:<seq>" of the last event seen; sent back on reconnect so the
+    // backend resumes the run instead of starting it again.
+    let lastEventId = "";
+    let reconnects = 0;
+    let streamDone = false;
 
     try {
-      const response = await fetch("/api/chat?stream=1", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          Accept: "text/event-stream",
-        },
-        body: JSON.stringify({
-          messages: nextMessages,
-          session_id: sessionId || undefined,
-        }),
-      });
-
-      if (!response.ok || !response.body) {
-        const payload = (await response
-          .json()
-          .catch(() => ({}))) as { error?: string };
-        throw new Error(payload.error || t("chatErrorUnexpected"));
-      }
-
-      setMessages((prev) => [
-        ...prev,
-        { role: "assistant", content: "" },
-      ]);
-      inserted = true;
+      while (!streamDone) {
+        const response = await fetch("/api/chat?stream=1", {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            Accept: "text/event-stream",
+            ...(lastEventId ? { "Last-Event-ID": lastEventId } : {}),
+          },
+          body: JSON.stringify({
+            messages: nextMessages,
+            session_id: sessionId || undefined,
+          }),
+        });
 
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-      let buffer = "";
-      let streamDone = false;
+        if (!response.ok || !response.body) {
+          const payload = (await response
+            .json()
+            .catch(() => ({}))) as { error?: string };
+          throw new Error(payload.error || t("chatErrorUnexpected"));
+        }
 
-      while (!streamDone) {
-        const { value, done } = await reader.read();
-        if (done) {
-          break;
+        if (!inserted) {
+          setMessages((prev) => [
+            ...prev,
+            { role: "assistant", content: "" },
+          ]);
+          inserted = true;
         }
-        buffer += decoder.decode(value, { stream: true });
-        const events = buffer.split("\n\n");
-        buffer = events.pop() ?? "";
 
-        for (const event of events) {
-          if (!event.trim()) {
-            continue;
-          }
-          const lines = event.split("\n");
-          let data = "";
-          for (const line of lines) {
-            if (line.startsWith("data:")) {
-              data += line.slice(5).trim();
-            }
-          }
-          if (!data) {
-            continue;
-          }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
 
-          let payload: { type?: string; value?: string[] | string; message?: string };
+        while (!streamDone) {
+          let chunk: ReadableStreamReadResult<Uint8Array>;
           try {
-            payload = JSON.parse(data) as {
-              type?: string;
-              value?: string[] | string;
-              message?: string;
-            };
+            chunk = await reader.read();
           } catch {
-            continue;
+            // Connection dropped; reconnect below.
+            break;
+          }
+          if (chunk.done) {
+            break;
           }
+          buffer += decoder.decode(chunk.value, { stream: true });
+          const events = buffer.split("\n\n");
+          buffer = events.pop() ?? "";
 
-          if (payload.type === "token" && typeof payload.value === "string") {
-            reply += payload.value;
-            updateAssistantMessage(reply);
-          } else if (payload.type === "images") {
-            if (Array.isArray(payload.value)) {
-              setImages(payload.value);
+          for (const event of events) {
+            if (!event.trim()) {
+              continue;
             }
-          } else if (payload.type === "error") {
-            throw new Error(payload.message || t("chatErrorStream"));
-          } else if (payload.type === "done") {
-            streamDone = true;
-            break;
+            const lines = event.split("\n");
+            let data = "";
+            let eventId = "";
+            for (const line of lines) {
+              if (line.startsWith("data:")) {
+                data += line.slice(5).trim();
+              } else if (line.startsWith("id:")) {
+                eventId = line.slice(3).trim();
+              }
+            }
+            if (eventId) {
+              // The run expired and the backend started a new one.
+              const runId = eventId.split(":")[0];
+              if (lastEventId && lastEventId.split(":")[0] !== runId) {
+                reply = "";
+                updateAssistantMessage(reply);
+              }
+              lastEventId = eventId;
+            }
+            if (!data) {
+              continue;
+            }
+
+            let payload: { type?: string; value?: string[] | string; message?: string };
+            try {
+              payload = JSON.parse(data) as {
+                type?: string;
+                value?: string[] | string;
+                message?: string;
+              };
+            } catch {
+              continue;
+            }
+
+            if (payload.type === "token" && typeof payload.value === "string") {
+              reply += payload.value;
+              updateAssistantMessage(reply);
+            } else if (payload.type === "reset") {
+              // The backend retried a failed run; drop the partial answer.
+              reply = "";
+              updateAssistantMessage(reply);
+            } else if (payload.type === "images") {
+              if (Array.isArray(payload.value)) {
+                setImages(payload.value);
+              }
+            } else if (payload.type === "error") {
+              throw new Error(payload.message || t("chatErrorStream"));
+            } else if (payload.type === "done") {
+              streamDone = true;
+              break;
+            }
+          }
+        }
+
+        if (!streamDone) {
+          if (!lastEventId || reconnects >= STREAM_RECONNECT_MAX) {
+            throw new Error(t("chatErrorStream"));
           }
+          reconnects += 1;
+          await new Promise((resolve) =>
+            setTimeout(resolve, STREAM_RECONNECT_DELAY_MS * reconnects)
+          );
         }
       }
 
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import time
+import uuid
+from typing import Optional
+
+# Content-addressed store for uploads: one file per SHA-256 under the blob
+# dir, hardlinked into each session's files/ tree. The link count doubles as
+# the refcount, so a blob with st_nlink == 1 is garbage.
+
+SESSION_DEDUP = os.getenv("SESSION_DEDUP", "1").lower() not in {"0", "false", "no"}
+BLOB_GC_GRACE_S = int(os.getenv("BLOB_GC_GRACE_S", "60"))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_path(blob_dir: str, digest: str) -> str:
+    return os.path.join(blob_dir, digest[:2], digest)
+
+
+def stage_blob(
+    blob_dir: str, temp_path: str, target_path: str, digest: Optional[str] = None
+) -> str:
+    # Returns a path next to target_path that hardlinks the blob for temp_path's
+    # content, ready to be os.replace()d into place. temp_path is consumed.
+    # Falls back to temp_path itself if hardlinks are not possible.
+    if not SESSION_DEDUP:
+        return temp_path
+    digest = digest or file_sha256(temp_path)
+    path = blob_path(blob_dir, digest)
+    link_path = f"{target_path}.{uuid.uuid4().hex[:8]}.link"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(path, link_path)
+        except FileNotFoundError:
+            os.replace(temp_path, path)
+            os.link(path, link_path)
+    except OSError:
+        # e.g. EXDEV when the blob dir is on another filesystem.
+        if os.path.exists(link_path):
+            os.remove(link_path)
+        return temp_path
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return link_path
+
+
+def collect_garbage(blob_dir: str, now: Optional[float] = None) -> int:
+    now = now or time.time()
+    removed = 0
+    if not os.path.isdir(blob_dir):
+        return removed
+    for base, _, files in os.walk(blob_dir):
+        for name in files:
+            path = os.path.join(base, name)
+            try:
+                stats = os.stat(path)
+            except OSError:
+                continue
+            # The grace period covers a blob that was just stored but not yet linked.
+            if stats.st_nlink <= 1 and now - stats.st_ctime > BLOB_GC_GRACE_S:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    continue
+    return removed
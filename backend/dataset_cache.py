@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+from typing import Optional
+
+CACHE_DIRNAME = ".cache"
+TABULAR_SEPARATORS = {".csv": ",", ".tsv": "\t"}
+
+PROFILE_MAX_COLUMNS = int(os.getenv("PROFILE_MAX_COLUMNS", "40"))
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "3"))
+UPLOAD_INGEST = os.getenv("UPLOAD_INGEST", "1").lower() not in {"0", "false", "no"}
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def is_tabular(filename: str) -> bool:
+    _, ext = os.path.splitext(filename)
+    return ext.lower() in TABULAR_SEPARATORS
+
+
+def cache_paths(files_dir: str, rel_name: str) -> tuple[str, str]:
+    base = os.path.join(files_dir, CACHE_DIRNAME, rel_name)
+    return f"{base}.feather", f"{base}.json"
+
+
+def remove_cache(files_dir: str, rel_name: str) -> None:
+    for path in cache_paths(files_dir, rel_name):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def ingest_file(files_dir: str, rel_name: str) -> Optional[dict]:
+    # Parse a tabular upload once into an uncompressed Feather file that the
+    # sandbox_data helper can load instead of re-parsing the CSV.
+    remove_cache(files_dir, rel_name)
+    if not UPLOAD_INGEST or not is_tabular(rel_name):
+        return None
+    source_path = os.path.join(files_dir, rel_name)
+    try:
+        stats = os.stat(source_path)
+    except OSError:
+        return None
+    if stats.st_size > INGEST_MAX_BYTES:
+        return None
+    try:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        return None
+
+    _, ext = os.path.splitext(rel_name)
+    feather_path, meta_path = cache_paths(files_dir, rel_name)
+    os.makedirs(os.path.dirname(feather_path), exist_ok=True)
+    temp_path = f"{feather_path}.tmp"
+    try:
+        frame = pd.read_csv(source_path, sep=TABULAR_SEPARATORS[ext.lower()])
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        feather.write_feather(table, temp_path, compression="uncompressed")
+        os.replace(temp_path, feather_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    meta = {
+        "source": rel_name,
+        "size": stats.st_size,
+        "mtime_ns": stats.st_mtime_ns,
+        "rows": int(table.num_rows),
+        "columns": list(table.column_names),
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def _count_rows(path: str) -> int:
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n":
+        lines += 1
+    return max(0, lines - 1)
+
+
+def _cached_frame_head(files_dir: str, rel_name: str, stats: os.stat_result):
+    feather_path, meta_path = cache_paths(files_dir, rel_name)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("size") != stats.st_size or meta.get("mtime_ns") != stats.st_mtime_ns:
+        return None
+    try:
+        import pyarrow.feather as feather
+
+        table = feather.read_table(feather_path, memory_map=True)
+    except Exception:
+        return None
+    return table.slice(0, max(1, PROFILE_SAMPLE_ROWS)).to_pandas(), int(table.num_rows)
+
+
+def profile_file(files_dir: str, rel_name: str) -> Optional[dict]:
+    # Columns, dtypes, row count and a few sample rows, so the agent can skip
+    # the usual "print head/dtypes" round-trip.
+    if not is_tabular(rel_name):
+        return None
+    source_path = os.path.join(files_dir, rel_name)
+    try:
+        stats = os.stat(source_path)
+        import pandas as pd
+    except (OSError, ImportError):
+        return None
+
+    cached = _cached_frame_head(files_dir, rel_name, stats)
+    try:
+        if cached is not None:
+            head, rows = cached
+        else:
+            _, ext = os.path.splitext(rel_name)
+            head = pd.read_csv(
+                source_path, sep=TABULAR_SEPARATORS[ext.lower()], nrows=1000
+            )
+            rows = _count_rows(source_path)
+    except Exception:
+        return None
+
+    columns = [
+        {"name": str(name), "dtype": str(dtype)}
+        for name, dtype in list(head.dtypes.items())[:PROFILE_MAX_COLUMNS]
+    ]
+    sample = (
+        head.iloc[: max(0, PROFILE_SAMPLE_ROWS), :PROFILE_MAX_COLUMNS]
+        .astype(str)
+        .values.tolist()
+    )
+    return {
+        "size": stats.st_size,
+        "mtime_ns": stats.st_mtime_ns,
+        "rows": rows,
+        "column_count": int(head.shape[1]),
+        "columns": columns,
+        "sample": sample,
+    }
+
+
+def clear_cache(files_dir: str) -> None:
+    shutil.rmtree(os.path.join(files_dir, CACHE_DIRNAME), ignore_errors=True)
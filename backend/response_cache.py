@@ -0,0 +1,274 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Optional
+
+from backend.blob_store import file_sha256
+from sandbox_session import get_session_files_dir
+from sandbox_trace import set_span_attribute
+
+# Opt-in cache of final agent answers. Keys are the normalized prompt plus a
+# fingerprint of the session's files, so an answer is only reused against the
+# same data. Exact matches (after case and whitespace normalization) always
+# hit. RESPONSE_CACHE_SIMILARITY > 0 also accepts a paraphrase whose local
+# embedding is at least that similar, but only if both prompts have the same
+# signature: numbers, operators, and the words that flip an answer (negations,
+# directions, statistics, chart kinds). Without that guard "mean" answers
+# "median" and "2**100" answers "2*100".
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0").lower() in {"1", "true", "yes"}
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "512"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+# "ngram" (built in, no model) or "sentence-transformers:<model name>".
+RESPONSE_CACHE_EMBEDDER = os.getenv("RESPONSE_CACHE_EMBEDDER", "ngram")
+
+_WS_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"\S+\s*")
+_WORD_RE = re.compile(r"[a-z0-9_']+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_OPERATOR_RE = re.compile(r"\*\*|//|<=|>=|==|!=|[-+*/%^<>=&|~]")
+_GUARD_WORDS = frozenset(
+    # Negation and exclusion.
+    "no not never none without except exclude excluding isn't aren't doesn't don't "
+    # Direction and comparison.
+    "ascending descending increasing decreasing asc desc more less fewer greater "
+    "smaller larger higher lower above below before after over under top bottom "
+    "first last largest smallest highest lowest most least between "
+    # Statistics.
+    "mean average median mode sum total count min max minimum maximum std stdev "
+    "variance deviation percentile quantile quartile correlation correlated "
+    "covariance regression distinct unique null nulls missing duplicate duplicates "
+    # Output kinds.
+    "plot chart graph histogram bar line scatter pie box heatmap table csv "
+    "rows columns row column".split()
+)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WS_RE.sub(" ", prompt.strip().lower()).rstrip(" ?.!")
+
+
+def prompt_signature(text: str) -> tuple:
+    # Parts of a normalized prompt that must match exactly for a similar hit.
+    words = set(_WORD_RE.findall(text))
+    return (
+        tuple(_NUMBER_RE.findall(text)),
+        tuple(_OPERATOR_RE.findall(text)),
+        frozenset(words & _GUARD_WORDS),
+    )
+
+
+def ngram_embedding(text: str) -> dict:
+    # Unit-length bag of words, word bigrams and character trigrams.
+    words = _WORD_RE.findall(text)
+    features: dict = {}
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    grams += [f"#{text[i:i + 3]}" for i in range(max(0, len(text) - 2))]
+    for gram in grams:
+        features[gram] = features.get(gram, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in features.values())) or 1.0
+    return {gram: value / norm for gram, value in features.items()}
+
+
+def _cosine(left: dict, right: dict) -> float:
+    if len(left) > len(right):
+        left, right = right, left
+    return sum(value * right.get(key, 0.0) for key, value in left.items())
+
+
+def load_embedder(name: str) -> Callable[[str], dict]:
+    if name in {"", "ngram"}:
+        return ngram_embedding
+    if name.startswith("sentence-transformers:"):
+        try:
+            # Optional and slow to import: only load it when configured.
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise RuntimeError(
+                "sentence-transformers is required for RESPONSE_CACHE_EMBEDDER="
+                "sentence-transformers:<model>."
+            ) from exc
+        model = SentenceTransformer(name.split(":", 1)[1])
+
+        def embed(text: str) -> dict:
+            vector = model.encode(text, normalize_embeddings=True)
+            return {index: float(value) for index, value in enumerate(vector)}
+
+        return embed
+    raise RuntimeError(f"Unknown RESPONSE_CACHE_EMBEDDER: {name!r}.")
+
+
+_digest_cache: dict[tuple[str, int, int], str] = {}
+_digest_guard = threading.Lock()
+
+
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    key = (path, size, mtime_ns)
+    with _digest_guard:
+        cached = _digest_cache.get(key)
+    if cached is not None:
+        return cached
+    value = file_sha256(path)
+    with _digest_guard:
+        if len(_digest_cache) > 4096:
+            _digest_cache.clear()
+        _digest_cache[key] = value
+    return value
+
+
+def files_fingerprint(files_dir: Optional[str]) -> str:
+    # Content hashes (memoized per size/mtime), so two sessions holding the
+    # same upload share cache entries.
+    if not files_dir or not os.path.isdir(files_dir):
+        return ""
+    entries = []
+    for base, dirs, files in os.walk(files_dir):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for name in sorted(files):
+            path = os.path.join(base, name)
+            try:
+                stats = os.stat(path)
+                digest = _file_digest(path, stats.st_size, stats.st_mtime_ns)
+            except OSError:
+                continue
+            entries.append(f"{os.path.relpath(path, files_dir)}:{digest}")
+    return hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_s: float,
+        similarity: float = 0.0,
+        embed: Optional[Callable[[str], dict]] = None,
+    ) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.similarity = similarity
+        self.embed = embed or ngram_embedding
+        self._entries: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0}
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return self.ttl_s > 0 and now - entry["created"] > self.ttl_s
+
+    def get(self, prompt: str, fingerprint: str) -> Optional[str]:
+        text = normalize_prompt(prompt)
+        key = (fingerprint, text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry["answer"]
+            if entry is not None:
+                del self._entries[key]
+            if self.similarity <= 0:
+                self._stats["misses"] += 1
+                return None
+            candidates = [
+                (other_key, other)
+                for other_key, other in self._entries.items()
+                if other_key[0] == fingerprint and not self._expired(other, now)
+            ]
+        # Embedding may run a model; do it outside the lock.
+        signature = prompt_signature(text)
+        candidates = [item for item in candidates if item[1]["signature"] == signature]
+        vector = self.embed(text) if candidates else {}
+        best_key, best_score = None, self.similarity
+        for other_key, other in candidates:
+            score = _cosine(vector, other["vector"])
+            if score >= best_score:
+                best_key, best_score = other_key, score
+        with self._lock:
+            entry = self._entries.get(best_key) if best_key is not None else None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self._stats["similar_hits"] += 1
+            return entry["answer"]
+
+    def put(self, prompt: str, fingerprint: str, answer: str) -> None:
+        if not answer:
+            return
+        text = normalize_prompt(prompt)
+        entry = {"answer": answer, "created": time.time()}
+        if self.similarity > 0:
+            entry["signature"] = prompt_signature(text)
+            entry["vector"] = self.embed(text)
+        with self._lock:
+            self._entries[(fingerprint, text)] = entry
+            self._entries.move_to_end((fingerprint, text))
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+
+_cache: Optional[ResponseCache] = None
+_cache_guard = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _cache_guard:
+        if _cache is None:
+            embed = None
+            if RESPONSE_CACHE_SIMILARITY > 0:
+                embed = load_embedder(RESPONSE_CACHE_EMBEDDER)
+            _cache = ResponseCache(
+                RESPONSE_CACHE_MAX, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_SIMILARITY, embed
+            )
+        return _cache
+
+
+def cached_agent(run: Callable[[str], str]) -> Callable[[str], str]:
+    # Answers that changed the session's files (plots, outputs) are not cached:
+    # replaying them would skip the side effects.
+    def cached(prompt: str) -> str:
+        files_dir = get_session_files_dir()
+        fingerprint = files_fingerprint(files_dir)
+        answer = get_cache().get(prompt, fingerprint)
+        set_span_attribute("response_cache.hit", answer is not None)
+        if answer is not None:
+            return answer
+        answer = run(prompt)
+        if files_fingerprint(files_dir) == fingerprint:
+            get_cache().put(prompt, fingerprint, answer)
+        return answer
+
+    return cached
+
+
+def cached_streamer(stream: Callable[..., AsyncIterator[str]]) -> Callable[..., AsyncIterator[str]]:
+    # Cache hits are replayed as a token stream so SSE clients see no difference.
+    async def cached(prompt: str, *args, **kwargs) -> AsyncIterator[str]:
+        files_dir = get_session_files_dir()
+        fingerprint = await asyncio.to_thread(files_fingerprint, files_dir)
+        answer = get_cache().get(prompt, fingerprint)
+        set_span_attribute("response_cache.hit", answer is not None)
+        if answer is not None:
+            for token in _TOKEN_RE.findall(answer):
+                yield token
+            return
+        tokens = []
+        async for token in stream(prompt, *args, **kwargs):
+            tokens.append(token)
+            yield token
+        if await asyncio.to_thread(files_fingerprint, files_dir) == fingerprint:
+            get_cache().put(prompt, fingerprint, "".join(tokens))
+
+    return cached
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from sandbox_session import ToolCheckpoint
+
+# Streaming chat runs execute independently of the SSE connection that started
+# them. Every event is kept (numbered from 1) until the run has been finished
+# for RUN_BUFFER_TTL_S, so a client can reconnect with Last-Event-ID and pick
+# up where it left off. Runs are per process; multi-node setups rely on
+# session routing to send the reconnect to the same node. A run only resumes
+# for the session that started it, and a run nobody has followed for
+# RUN_DETACH_GRACE_S is cancelled (it fails, so a later reconnect retries it).
+
+RUN_BUFFER_TTL_S = int(os.getenv("RUN_BUFFER_TTL_S", "300"))
+RUN_BUFFER_MAX = int(os.getenv("RUN_BUFFER_MAX", "256"))
+RUN_RETRY_MAX = int(os.getenv("RUN_RETRY_MAX", "2"))
+RUN_DETACH_GRACE_S = float(os.getenv("RUN_DETACH_GRACE_S", "30"))
+
+
+class RunBuffer:
+    def __init__(self, run_id: str, session_id: Optional[str] = None) -> None:
+        self.run_id = run_id
+        self.session_id = session_id
+        # Superseded events (the error/done of a failed attempt) become None.
+        self.events: list[Optional[str]] = []
+        self.checkpoint = ToolCheckpoint()
+        self.done = False
+        self.failed = False
+        self.retries = 0
+        self.finished_at: Optional[float] = None
+        # Coroutine factory for one attempt of the run; called again on retry.
+        self.attempt: Optional[Callable[[], Awaitable[None]]] = None
+        self.task: Optional[asyncio.Task] = None
+        # Set when the run is cancelled; sandbox runs of the attempt poll it
+        # (see sandbox_session) and kill their child process.
+        self.cancel_event = threading.Event()
+        self.followers = 0
+        self._detach_timer: Optional[asyncio.TimerHandle] = None
+        self._cond = asyncio.Condition()
+        self._failure_start = 0
+
+    async def publish(self, event: dict) -> None:
+        async with self._cond:
+            self.events.append(json.dumps(event, ensure_ascii=True))
+            self._cond.notify_all()
+
+    async def fail(self, message: str) -> None:
+        async with self._cond:
+            self._failure_start = len(self.events)
+            self.failed = True
+        await self.publish({"type": "error", "message": message})
+
+    async def finish(self) -> None:
+        await self.publish({"type": "done"})
+        async with self._cond:
+            self.done = True
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    async def begin_retry(self) -> bool:
+        # Reopens a failed run for another attempt. The checkpoint rewinds so
+        # tool calls that already completed are replayed, not re-executed.
+        async with self._cond:
+            if not (self.done and self.failed) or self.retries >= RUN_RETRY_MAX:
+                return False
+            for index in range(self._failure_start, len(self.events)):
+                self.events[index] = None
+            self.retries += 1
+            self.done = False
+            self.failed = False
+            self.finished_at = None
+            self.cancel_event = threading.Event()
+            self.checkpoint.rewind()
+            self._cond.notify_all()
+        await self.publish({"type": "reset"})
+        return True
+
+    def arm_detach(self) -> None:
+        # Starts the grace period once the last follower has gone.
+        if self.followers or self.done or self._detach_timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._detach_timer = loop.call_later(RUN_DETACH_GRACE_S, self._cancel_detached)
+
+    def _cancel_detached(self) -> None:
+        self._detach_timer = None
+        if self.followers or self.done:
+            return
+        self.cancel_event.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def follow(self, after: int = 0) -> AsyncIterator[tuple[int, str]]:
+        self.followers += 1
+        if self._detach_timer is not None:
+            self._detach_timer.cancel()
+            self._detach_timer = None
+        index = max(0, after)
+        try:
+            while True:
+                async with self._cond:
+                    while index >= len(self.events) and not self.done:
+                        await self._cond.wait()
+                    batch = self.events[index:]
+                    finished = self.done
+                for offset, event in enumerate(batch):
+                    if event is not None:
+                        yield index + offset + 1, event
+                index += len(batch)
+                if finished and index >= len(self.events):
+                    return
+        finally:
+            self.followers -= 1
+            self.arm_detach()
+
+
+_runs: "OrderedDict[str, RunBuffer]" = OrderedDict()
+
+
+def _evict(now: float) -> None:
+    for run_id, run in list(_runs.items()):
+        if run.done and run.finished_at is not None and now - run.finished_at > RUN_BUFFER_TTL_S:
+            del _runs[run_id]
+    while len(_runs) > RUN_BUFFER_MAX:
+        finished = [run_id for run_id, run in _runs.items() if run.done]
+        if not finished:
+            break
+        del _runs[finished[0]]
+
+
+def create_run(session_id: Optional[str] = None) -> RunBuffer:
+    _evict(time.time())
+    run = RunBuffer(uuid.uuid4().hex, session_id)
+    _runs[run.run_id] = run
+    return run
+
+
+def start_attempt(run: RunBuffer) -> None:
+    if run.attempt is not None:
+        run.task = asyncio.create_task(run.attempt())
+        # Covers a client that disconnects before it starts following.
+        run.arm_detach()
+
+
+def get_run(run_id: str, session_id: Optional[str] = None) -> Optional[RunBuffer]:
+    # Runs of another session look the same as unknown ones.
+    _evict(time.time())
+    run = _runs.get(run_id)
+    if run is None or run.session_id != session_id:
+        return None
+    return run
+
+
+def parse_event_id(value: Optional[str]) -> tuple[Optional[str], int]:
+    # Event ids are "<run_id>:<seq>".
+    if not value:
+        return None, 0
+    run_id, _, seq = value.strip().partition(":")
+    try:
+        return run_id or None, int(seq or "0")
+    except ValueError:
+        return run_id or None, 0
+
+
+def format_event(run_id: str, seq: int, event: str) -> str:
+    return f"id: {run_id}:{seq}\ndata: {event}\n\n"
@@ -1,37 +1,167 @@
+import asyncio
+import contextlib
+import hashlib
 import json
 import os
+import threading
 import time
-from typing import Literal
+import uuid
+from typing import Callable, Literal, Optional
 
 from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from sandbox_scheduler import get_scheduler, scheduler_enabled
 from main import build_agent, build_agent_streamer
-from sandbox_session import reset_session_files_dir, set_session_files_dir
+from sandbox_session import (
+    reset_session_files_dir,
+    reset_trace_span,
+    set_cancel_event,
+    set_session_files_dir,
+    set_trace_span,
+)
+from sandbox_trace import span, start_span
+from backend.dataset_cache import CACHE_DIRNAME, ingest_file
+from backend.response_cache import RESPONSE_CACHE, cached_agent, cached_streamer, get_cache
+from backend.run_buffer import (
+    RunBuffer,
+    create_run,
+    format_event,
+    get_run,
+    parse_event_id,
+    start_attempt,
+)
+from backend.session_routing import local_node_id, route_hint, routing_enabled
 from backend.session_store import (
-    SESSION_MAX_BYTES,
+    UPLOAD_CHUNK_MAX_BYTES,
+    QuotaExceededError,
+    UploadBusyError,
+    abort_upload,
     clear_session,
+    commit_file,
+    commit_upload,
+    create_upload,
     ensure_session,
+    get_file_profiles,
     get_session_files_dir,
+    get_upload,
     maybe_cleanup_sessions,
+    release_space,
     reserve_space,
+    restore_session,
     safe_filename,
+    session_active,
+    sync_session,
     update_session_access,
     validate_session_id,
+    write_upload_chunk,
 )
 
-app = FastAPI()
-agent = build_agent()
-agent_streamer = build_agent_streamer()
-
 RATE_LIMIT_WINDOW_MS = int(os.getenv("RATE_LIMIT_WINDOW_MS", "60000"))
 RATE_LIMIT_MAX = int(os.getenv("RATE_LIMIT_MAX", "20"))
 MAX_INPUT_CHARS = int(os.getenv("MAX_INPUT_CHARS", "4000"))
+AGENT_STARTUP_WAIT_S = float(os.getenv("AGENT_STARTUP_WAIT_S", "30"))
+BATCH_MAX_SNIPPETS = int(os.getenv("BATCH_MAX_SNIPPETS", "32"))
+BATCH_MAX_CODE_CHARS = int(os.getenv("BATCH_MAX_CODE_CHARS", "20000"))
+
+# Agents are built after the worker starts (see _lifespan) so importing this
+# module stays fast; requests that arrive earlier wait for them.
+_agents: dict[str, Callable] = {}
+_agents_ready = threading.Event()
+_agents_error: str | None = None
+
+
+def _load_agents() -> None:
+    global _agents_error
+    try:
+        _agents["invoke"] = build_agent()
+        _agents["stream"] = build_agent_streamer()
+        if RESPONSE_CACHE:
+            _agents["invoke"] = cached_agent(_agents["invoke"])
+            _agents["stream"] = cached_streamer(_agents["stream"])
+    except Exception as exc:
+        _agents_error = f"{type(exc).__name__}: {exc}"
+    finally:
+        _agents_ready.set()
+
+
+def _get_agent(kind: str) -> Callable:
+    if not _agents_ready.wait(AGENT_STARTUP_WAIT_S):
+        raise HTTPException(status_code=503, detail="Agent is still starting.")
+    if kind not in _agents:
+        raise HTTPException(status_code=503, detail="Agent failed to start.")
+    return _agents[kind]
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # Build in the background so the worker starts serving /health at once;
+    # /ready flips once the agents exist.
+    threading.Thread(target=_load_agents, name="agent-loader", daemon=True).start()
+    yield
+
+
+app = FastAPI(lifespan=_lifespan)
 
 _ip_buckets: dict[str, dict[str, float]] = {}
 
 
+@app.middleware("http")
+async def session_route_header(request: Request, call_next):
+    # Routing hint for load balancers and clients: the node that owns the
+    # session on the consistent-hash ring (see SESSION_NODES).
+    response = await call_next(request)
+    session_id = request.headers.get("x-session-id") or request.query_params.get("session_id")
+    if session_id and routing_enabled():
+        node = route_hint(session_id.strip())["node"]
+        if node:
+            response.headers["X-Session-Node"] = str(node)
+    return response
+
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    # Root span per request; an incoming W3C traceparent continues the caller's
+    # trace. It ends once the body has been sent, so SSE streams are covered.
+    current = start_span(
+        "http.request",
+        request.headers.get("traceparent"),
+        method=request.method,
+        path=request.url.path,
+    )
+    if current is None:
+        return await call_next(request)
+    token = set_trace_span(current)
+    try:
+        response = await call_next(request)
+    except BaseException as exc:
+        current.record_error(exc)
+        current.end()
+        raise
+    finally:
+        reset_trace_span(token)
+    route = request.scope.get("route")
+    if route is not None:
+        current.set_attribute("route", getattr(route, "path", ""))
+    current.set_attribute("status_code", response.status_code)
+    response.headers["traceparent"] = current.traceparent()
+    body = response.body_iterator
+
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        except BaseException as exc:
+            current.record_error(exc)
+            raise
+        finally:
+            current.end()
+
+    response.body_iterator = traced_body()
+    return response
+
+
 class Message(BaseModel):
     role: Literal["user", "assistant"]
     content: str
@@ -46,6 +176,30 @@ class SessionRequest(BaseModel):
     session_id: str
 
 
+class UploadInitBody(BaseModel):
+    session_id: str
+    filename: str
+    size: int
+    sha256: str | None = None
+
+
+class UploadCommitBody(BaseModel):
+    session_id: str
+    sha256: str | None = None
+
+
+class BatchSnippet(BaseModel):
+    code: str
+    timeout_s: Optional[int] = Field(None, ge=1, le=60)
+    profile: bool = False
+
+
+class BatchBody(BaseModel):
+    snippets: list[BatchSnippet]
+    session_id: str | None = None
+    stream: bool = False
+
+
 def _get_client_ip(request: Request) -> str:
     forwarded = request.headers.get("x-forwarded-for")
     if forwarded:
@@ -56,17 +210,18 @@ def _get_client_ip(request: Request) -> str:
 
 
 def _check_rate_limit(ip: str) -> None:
-    now = time.time() * 1000
-    entry = _ip_buckets.get(ip)
-    if not entry or entry["reset_at"] <= now:
-        _ip_buckets[ip] = {"count": 1, "reset_at": now + RATE_LIMIT_WINDOW_MS}
-        return
-    if entry["count"] >= RATE_LIMIT_MAX:
-        raise HTTPException(
-            status_code=429,
-            detail="Rate limit exceeded. Please wait and try again.",
-        )
-    entry["count"] += 1
+    with span("rate_limit"):
+        now = time.time() * 1000
+        entry = _ip_buckets.get(ip)
+        if not entry or entry["reset_at"] <= now:
+            _ip_buckets[ip] = {"count": 1, "reset_at": now + RATE_LIMIT_WINDOW_MS}
+            return
+        if entry["count"] >= RATE_LIMIT_MAX:
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded. Please wait and try again.",
+            )
+        entry["count"] += 1
 
 
 def _format_messages(messages: list[Message]) -> str:
@@ -82,7 +237,9 @@ def _format_messages(messages: list[Message]) -> str:
 def _list_session_files(session_dir: str) -> tuple[list[str], bool]:
     items: list[str] = []
     try:
-        for root, _, files in os.walk(session_dir):
+        for root, dirs, files in os.walk(session_dir):
+            if root == session_dir and CACHE_DIRNAME in dirs:
+                dirs.remove(CACHE_DIRNAME)
             for name in files:
                 rel = os.path.relpath(os.path.join(root, name), session_dir)
                 items.append(rel)
@@ -116,31 +273,61 @@ def _resolve_session_file(session_id: str, rel_path: str) -> str:
     return abs_path
 
 
-def _append_session_context(prompt: str, session_files: list[str], truncated: bool) -> str:
+def _describe_profile(profile: dict) -> str:
+    columns = ", ".join(f"{col['name']} ({col['dtype']})" for col in profile["columns"])
+    if profile.get("column_count", 0) > len(profile["columns"]):
+        columns += ", ..."
+    lines = [f"  rows: {profile['rows']}; columns: {columns}"]
+    for row in profile.get("sample", []):
+        values = ", ".join(value[:40] for value in row)
+        lines.append(f"  sample: {values}")
+    return "\n".join(lines)
+
+
+def _append_session_context(
+    prompt: str,
+    session_files: list[str],
+    truncated: bool,
+    profiles: dict[str, dict] | None = None,
+) -> str:
     if not session_files:
         return prompt
-    listing = "\n".join(f"- {name}" for name in session_files)
+    profiles = profiles or {}
+    entries = []
+    for name in session_files:
+        entry = f"- {name}"
+        if name in profiles:
+            entry += "\n" + _describe_profile(profiles[name])
+        entries.append(entry)
+    listing = "\n".join(entries)
     suffix = (
         "Session files available in /data:\n"
         f"{listing}\n"
         "Use absolute paths under /data when opening files."
     )
+    if profiles:
+        suffix += (
+            "\nTabular files include their schema and sample rows above; "
+            "no need to inspect head/dtypes before working with them."
+        )
     if truncated:
         suffix += "\n(Additional files omitted from this list.)"
     return f"{prompt}\n\n{suffix}"
 
 
 def _resolve_session_dir(session_id: str | None) -> str | None:
+    # May unpack an archived session; async handlers call it via to_thread.
     if not session_id:
         return None
-    maybe_cleanup_sessions()
-    try:
-        cleaned = validate_session_id(session_id)
-    except ValueError as exc:
-        raise HTTPException(status_code=400, detail=str(exc)) from exc
-    ensure_session(cleaned)
-    update_session_access(cleaned)
-    return get_session_files_dir(cleaned)
+    with span("session.resolve"):
+        maybe_cleanup_sessions()
+        try:
+            cleaned = validate_session_id(session_id)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        ensure_session(cleaned)
+        update_session_access(cleaned)
+        return get_session_files_dir(cleaned)
 
 
 @app.post("/files/upload")
@@ -152,10 +339,10 @@ async def upload_files(
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    maybe_cleanup_sessions()
-    meta = ensure_session(cleaned)
+    # Cleanup and unpacking an archived session hit the disk; keep them off the loop.
+    await asyncio.to_thread(maybe_cleanup_sessions)
+    await asyncio.to_thread(ensure_session, cleaned)
     files_dir = get_session_files_dir(cleaned)
-    session_total = int(meta.get("total_bytes", 0))
     saved: list[dict[str, object]] = []
 
     for upload in files:
@@ -165,46 +352,136 @@ async def upload_files(
             raise HTTPException(status_code=400, detail=str(exc)) from exc
 
         target_path = os.path.join(files_dir, filename)
-        existing_size = os.path.getsize(target_path) if os.path.exists(target_path) else 0
-        temp_path = f"{target_path}.uploading"
+        temp_path = f"{target_path}.{uuid.uuid4().hex[:8]}.uploading"
 
+        # Each chunk is reserved against the live session total, so concurrent
+        # uploads to the same session cannot overshoot SESSION_MAX_BYTES.
         size = 0
+        digest = hashlib.sha256()
+        committed = False
         try:
             with open(temp_path, "wb") as f:
                 while True:
                     chunk = await upload.read(1024 * 1024)
                     if not chunk:
                         break
+                    await asyncio.to_thread(reserve_space, cleaned, len(chunk))
                     size += len(chunk)
-                    new_total = session_total - existing_size + size
-                    if new_total > SESSION_MAX_BYTES:
-                        raise HTTPException(
-                            status_code=413,
-                            detail="Session storage limit exceeded.",
-                        )
+                    digest.update(chunk)
                     f.write(chunk)
-        except HTTPException:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise
-        finally:
-            await upload.close()
-
-        try:
-            reserve_space(cleaned, size, existing_size=existing_size)
+            # Hashed while streaming, so the blob store does not re-read the file;
+            # the commit still touches the filesystem, so keep it off the loop.
+            await asyncio.to_thread(
+                commit_file,
+                cleaned,
+                temp_path,
+                target_path,
+                size,
+                reserved=size,
+                sha256=digest.hexdigest(),
+            )
+            committed = True
         except ValueError as exc:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
             raise HTTPException(status_code=413, detail=str(exc)) from exc
+        finally:
+            await upload.close()
+            if not committed:
+                await asyncio.to_thread(release_space, cleaned, size)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
 
-        os.replace(temp_path, target_path)
-        saved.append({"name": filename, "size": size})
-        session_total = session_total - existing_size + size
+        cached = await asyncio.to_thread(ingest_file, files_dir, filename)
+        await asyncio.to_thread(get_file_profiles, cleaned, [filename])
+        saved.append({"name": filename, "size": size, "cached": cached is not None})
 
-    update_session_access(cleaned)
+    await asyncio.to_thread(update_session_access, cleaned)
+    await asyncio.to_thread(sync_session, cleaned)
     return {"status": "ok", "files": saved}
 
 
+def _validate_or_400(session_id: str) -> str:
+    try:
+        return validate_session_id(session_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+def _upload_error(exc: Exception) -> HTTPException:
+    if isinstance(exc, FileNotFoundError):
+        return HTTPException(status_code=404, detail=str(exc))
+    if isinstance(exc, QuotaExceededError):
+        return HTTPException(status_code=413, detail=str(exc))
+    if isinstance(exc, UploadBusyError):
+        return HTTPException(status_code=409, detail=str(exc))
+    return HTTPException(status_code=400, detail=str(exc))
+
+
+@app.post("/files/upload/init")
+def init_upload(body: UploadInitBody) -> dict[str, object]:
+    cleaned = _validate_or_400(body.session_id)
+    maybe_cleanup_sessions()
+    ensure_session(cleaned)
+    try:
+        return create_upload(cleaned, body.filename, body.size, body.sha256)
+    except (ValueError, OSError) as exc:
+        raise _upload_error(exc) from exc
+
+
+@app.get("/files/upload/{upload_id}")
+def upload_status(upload_id: str, session_id: str) -> dict[str, object]:
+    cleaned = _validate_or_400(session_id)
+    try:
+        return get_upload(cleaned, upload_id)
+    except (ValueError, OSError) as exc:
+        raise _upload_error(exc) from exc
+
+
+@app.put("/files/upload/{upload_id}/chunk")
+async def put_upload_chunk(
+    upload_id: str, session_id: str, offset: int, request: Request
+) -> dict[str, object]:
+    cleaned = _validate_or_400(session_id)
+    data = bytearray()
+    async for block in request.stream():
+        data.extend(block)
+        if len(data) > UPLOAD_CHUNK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Chunk is too large.")
+    try:
+        status = await asyncio.to_thread(
+            write_upload_chunk, cleaned, upload_id, offset, bytes(data)
+        )
+    except (ValueError, OSError) as exc:
+        raise _upload_error(exc) from exc
+    await asyncio.to_thread(update_session_access, cleaned)
+    return status
+
+
+@app.post("/files/upload/{upload_id}/commit")
+async def commit_chunked_upload(upload_id: str, body: UploadCommitBody) -> dict[str, object]:
+    cleaned = _validate_or_400(body.session_id)
+    try:
+        saved = await asyncio.to_thread(commit_upload, cleaned, upload_id, body.sha256)
+    except (ValueError, OSError) as exc:
+        raise _upload_error(exc) from exc
+    files_dir = get_session_files_dir(cleaned)
+    cached = await asyncio.to_thread(ingest_file, files_dir, str(saved["name"]))
+    await asyncio.to_thread(get_file_profiles, cleaned, [str(saved["name"])])
+    saved["cached"] = cached is not None
+    await asyncio.to_thread(update_session_access, cleaned)
+    await asyncio.to_thread(sync_session, cleaned)
+    return {"status": "ok", "files": [saved]}
+
+
+@app.delete("/files/upload/{upload_id}")
+def delete_upload(upload_id: str, session_id: str) -> dict[str, str]:
+    cleaned = _validate_or_400(session_id)
+    try:
+        abort_upload(cleaned, upload_id)
+    except (ValueError, OSError) as exc:
+        raise _upload_error(exc) from exc
+    return {"status": "ok"}
+
+
 @app.post("/files/clear")
 def clear_files(payload: SessionRequest) -> dict[str, str]:
     try:
@@ -221,6 +498,7 @@ def download_file(session_id: str, path: str):
         cleaned = validate_session_id(session_id)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    restore_session(cleaned)
     file_path = _resolve_session_file(cleaned, path)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found.")
@@ -234,14 +512,148 @@ def list_files(session_id: str):
         cleaned = validate_session_id(session_id)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    restore_session(cleaned)
     session_dir = get_session_files_dir(cleaned)
     images = _list_session_images(session_dir) if os.path.isdir(session_dir) else []
     update_session_access(cleaned)
     return {"images": images}
 
 
+@app.get("/sessions/{session_id}/route")
+def session_route(session_id: str) -> dict[str, object]:
+    cleaned = _validate_or_400(session_id)
+    return route_hint(cleaned)
+
+
+_batch_tool = None
+
+
+def _get_batch_tool():
+    global _batch_tool
+    if _batch_tool is None:
+        from cpython_tool import CpythonSandboxTool
+
+        _batch_tool = CpythonSandboxTool()
+    return _batch_tool
+
+
+@app.post("/execute/batch")
+async def execute_batch(body: BatchBody, request: Request):
+    # Runs many independent CPython snippets with one staging of the session
+    # files; results come back in input order, or as SSE events as they finish.
+    _check_rate_limit(_get_client_ip(request))
+    if not body.snippets:
+        raise HTTPException(status_code=400, detail="Please provide at least one snippet.")
+    if len(body.snippets) > BATCH_MAX_SNIPPETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many snippets (max {BATCH_MAX_SNIPPETS}).",
+        )
+    if any(len(snippet.code) > BATCH_MAX_CODE_CHARS for snippet in body.snippets):
+        raise HTTPException(status_code=400, detail="Snippet too long.")
+
+    session_dir = await asyncio.to_thread(_resolve_session_dir, body.session_id)
+    snippets = [snippet.model_dump() for snippet in body.snippets]
+    tool = await asyncio.to_thread(_get_batch_tool)
+
+    def _run_batch(on_result=None) -> list[dict]:
+        token = set_session_files_dir(session_dir)
+        try:
+            with session_active(validate_session_id(body.session_id) if session_dir else None):
+                return tool.run_batch(snippets, on_result=on_result)
+        finally:
+            reset_session_files_dir(token)
+            if session_dir:
+                try:
+                    with span("session.sync"):
+                        sync_session(validate_session_id(body.session_id))
+                except Exception:
+                    # Keep the results; the next sync pushes these changes too.
+                    pass
+
+    if not body.stream:
+        try:
+            results = await asyncio.to_thread(_run_batch)
+        except Exception as exc:
+            raise HTTPException(
+                status_code=500,
+                detail="Something went wrong while running the batch.",
+            ) from exc
+        images = _list_session_images(session_dir) if session_dir else []
+        return {"results": results, "images": images}
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def _push(index: int, result: dict) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, (index, result))
+
+    def _run_and_close() -> None:
+        try:
+            _run_batch(_push)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    async def event_stream():
+        task = asyncio.create_task(asyncio.to_thread(_run_and_close))
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            index, result = item
+            payload = json.dumps(
+                {"type": "result", "index": index, "value": result}, ensure_ascii=True
+            )
+            yield f"data: {payload}\n\n"
+        try:
+            await task
+            session_images = _list_session_images(session_dir) if session_dir else []
+            images_payload = json.dumps(
+                {"type": "images", "value": session_images}, ensure_ascii=True
+            )
+            yield f"data: {images_payload}\n\n"
+        except Exception:
+            payload = json.dumps(
+                {"type": "error", "message": "Something went wrong while running the batch."},
+                ensure_ascii=True,
+            )
+            yield f"data: {payload}\n\n"
+        yield 'data: {"type":"done"}\n\n'
+
+    headers = {"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+
+@app.get("/health")
+def health() -> dict[str, str]:
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready() -> dict[str, str]:
+    if not _agents_ready.is_set():
+        raise HTTPException(status_code=503, detail="Agent is still starting.")
+    if _agents_error is not None:
+        raise HTTPException(status_code=503, detail=_agents_error)
+    return {"status": "ready"}
+
+
+@app.get("/stats")
+def stats() -> dict[str, object]:
+    from cpython_tool import get_lock_stats
+
+    payload: dict[str, object] = {"cpython_lock": get_lock_stats()}
+    if local_node_id():
+        payload["node"] = local_node_id()
+    if scheduler_enabled():
+        payload["scheduler"] = get_scheduler().stats()
+    if RESPONSE_CACHE:
+        payload["response_cache"] = get_cache().stats()
+    return payload
+
+
 @app.post("/chat")
-def chat(body: ChatBody, request: Request) -> dict[str, str]:
+def chat(body: ChatBody, request: Request) -> dict[str, object]:
     _check_rate_limit(_get_client_ip(request))
 
     messages = [message for message in body.messages if message.content.strip()]
@@ -258,20 +670,29 @@ def chat(body: ChatBody, request: Request) -> dict[str, str]:
             detail="Message too long. Please shorten your request and try again.",
         )
 
+    agent = _get_agent("invoke")
     try:
         session_dir = _resolve_session_dir(body.session_id)
         session_files = []
         truncated = False
+        profiles = {}
         if session_dir:
             session_files, truncated = _list_session_files(session_dir)
+            with span("session.profiles", files=len(session_files)):
+                profiles = get_file_profiles(validate_session_id(body.session_id), session_files)
         token = set_session_files_dir(session_dir)
         try:
             prompt = _append_session_context(
-                _format_messages(messages), session_files, truncated
+                _format_messages(messages), session_files, truncated, profiles
             )
-            reply = agent(prompt)
+            active_id = validate_session_id(body.session_id) if session_dir else None
+            with span("chat.run"), session_active(active_id):
+                reply = agent(prompt)
         finally:
             reset_session_files_dir(token)
+        if session_dir:
+            with span("session.sync"):
+                sync_session(validate_session_id(body.session_id))
         session_images = _list_session_images(session_dir) if session_dir else []
     except Exception as exc:
         raise HTTPException(
@@ -282,10 +703,40 @@ def chat(body: ChatBody, request: Request) -> dict[str, str]:
     return {"reply": reply, "images": session_images}
 
 
+def _run_stream_response(run: RunBuffer, after: int) -> StreamingResponse:
+    async def event_stream():
+        async for seq, event in run.follow(after):
+            yield format_event(run.run_id, seq, event)
+
+    headers = {"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Run-Id": run.run_id}
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+
+
+def _run_owner(session_id: str | None) -> str | None:
+    return _validate_or_400(session_id) if session_id else None
+
+
+async def _resume_run(
+    run_id: str | None, after: int, session_id: str | None
+) -> StreamingResponse | None:
+    run = get_run(run_id, _run_owner(session_id)) if run_id else None
+    if run is None:
+        return None
+    # A failed run is retried with its tool results replayed from the checkpoint.
+    if await run.begin_retry():
+        start_attempt(run)
+    return _run_stream_response(run, after)
+
+
 @app.post("/chat/stream")
 async def chat_stream(body: ChatBody, request: Request):
     _check_rate_limit(_get_client_ip(request))
 
+    run_id, after = parse_event_id(request.headers.get("last-event-id"))
+    resumed = await _resume_run(run_id, after, body.session_id)
+    if resumed is not None:
+        return resumed
+
     messages = [message for message in body.messages if message.content.strip()]
     if not messages:
         raise HTTPException(
@@ -300,39 +751,65 @@ async def chat_stream(body: ChatBody, request: Request):
             detail="Message too long. Please shorten your request and try again.",
         )
 
-    session_dir = _resolve_session_dir(body.session_id)
+    agent_streamer = await asyncio.to_thread(_get_agent, "stream")
+    session_dir = await asyncio.to_thread(_resolve_session_dir, body.session_id)
     session_files = []
     truncated = False
+    profiles = {}
     if session_dir:
         session_files, truncated = _list_session_files(session_dir)
+        with span("session.profiles", files=len(session_files)):
+            profiles = await asyncio.to_thread(
+                get_file_profiles, validate_session_id(body.session_id), session_files
+            )
     prompt = _append_session_context(
-        _format_messages(messages), session_files, truncated
+        _format_messages(messages), session_files, truncated, profiles
     )
 
-    async def event_stream():
-        try:
-            token_ctx = set_session_files_dir(session_dir)
+    run = create_run(_run_owner(body.session_id))
+
+    async def attempt() -> None:
+        # Runs detached from the SSE connection; clients follow run.events.
+        # The span outlives the request span that started (or resumed) it.
+        with span("chat.run", run_id=run.run_id, retry=run.retries) as current:
             try:
-                async for token in agent_streamer(prompt):
-                    payload = json.dumps(
-                        {"type": "token", "value": token}, ensure_ascii=True
-                    )
-                    yield f"data: {payload}\n\n"
+                set_session_files_dir(session_dir)
+                set_cancel_event(run.cancel_event)
+                with session_active(validate_session_id(body.session_id) if session_dir else None):
+                    async for token in agent_streamer(prompt, run.checkpoint):
+                        await run.publish({"type": "token", "value": token})
+                if session_dir:
+                    with span("session.sync"):
+                        await asyncio.to_thread(
+                            sync_session, validate_session_id(body.session_id)
+                        )
                 session_images = _list_session_images(session_dir) if session_dir else []
-                images_payload = json.dumps(
-                    {"type": "images", "value": session_images}, ensure_ascii=True
-                )
-                yield f"data: {images_payload}\n\n"
-                yield 'data: {"type":"done"}\n\n'
+                await run.publish({"type": "images", "value": session_images})
+            except asyncio.CancelledError:
+                # No client followed the run for RUN_DETACH_GRACE_S.
+                await run.fail("The run was cancelled after the client disconnected.")
+                raise
+            except Exception as exc:
+                if current is not None:
+                    current.record_error(exc)
+                await run.fail("Something went wrong while running the agent.")
             finally:
-                reset_session_files_dir(token_ctx)
-        except Exception:
-            payload = json.dumps(
-                {"type": "error", "message": "Something went wrong while running the agent."},
-                ensure_ascii=True,
-            )
-            yield f"data: {payload}\n\n"
-            yield 'data: {"type":"done"}\n\n'
-
-    headers = {"Cache-Control": "no-cache", "Connection": "keep-alive"}
-    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
+                await run.finish()
+
+    run.attempt = attempt
+    start_attempt(run)
+    return _run_stream_response(run, 0)
+
+
+@app.get("/chat/stream/{run_id}")
+async def chat_stream_resume(
+    run_id: str, request: Request, after: int = 0, session_id: str | None = None
+):
+    # EventSource-style reconnect; Last-Event-ID takes precedence over ?after=.
+    header_run, header_seq = parse_event_id(request.headers.get("last-event-id"))
+    if header_run == run_id:
+        after = header_seq
+    resumed = await _resume_run(run_id, after, session_id)
+    if resumed is None:
+        raise HTTPException(status_code=404, detail="Run not found.")
+    return resumed
@@ -0,0 +1,90 @@
+import json
+import os
+import tarfile
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # optional: falls back to gzip
+    zstandard = None
+
+ARCHIVE_BASENAME = "files.tar"
+MANIFEST_FILENAME = "files.manifest.json"
+
+
+def archive_name() -> str:
+    return f"{ARCHIVE_BASENAME}.zst" if zstandard is not None else f"{ARCHIVE_BASENAME}.gz"
+
+
+def _mtimes(files_dir: str) -> dict[str, int]:
+    # tar keeps mtimes at sub-second float precision at best; the dataset cache
+    # and profiles compare st_mtime_ns, so exact values are restored separately.
+    mtimes: dict[str, int] = {}
+    for base, _, files in os.walk(files_dir):
+        for name in files:
+            path = os.path.join(base, name)
+            try:
+                mtimes[os.path.relpath(path, files_dir)] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+    return mtimes
+
+
+def pack(files_dir: str, session_root: str) -> str:
+    # Writes the archive next to files_dir and returns its name. files_dir is
+    # left in place: the caller removes it once session.json references the
+    # archive, so a crash in between never loses the files.
+    name = archive_name()
+    archive_path = os.path.join(session_root, name)
+    temp_path = f"{archive_path}.tmp"
+    with open(temp_path, "wb") as raw:
+        if zstandard is not None:
+            level = int(os.getenv("SESSION_ARCHIVE_ZSTD_LEVEL", "3"))
+            with zstandard.ZstdCompressor(level=level).stream_writer(raw) as writer:
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    tar.add(files_dir, arcname=".")
+        else:
+            with tarfile.open(fileobj=raw, mode="w:gz", compresslevel=6) as tar:
+                tar.add(files_dir, arcname=".")
+    with open(os.path.join(session_root, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(_mtimes(files_dir), f)
+    os.replace(temp_path, archive_path)
+    return name
+
+
+def _extract(tar: tarfile.TarFile, files_dir: str) -> None:
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(files_dir, filter="data")
+    else:
+        tar.extractall(files_dir)
+
+
+def unpack(session_root: str, files_dir: str, name: str) -> None:
+    archive_path = os.path.join(session_root, name)
+    os.makedirs(files_dir, exist_ok=True)
+    with open(archive_path, "rb") as raw:
+        if name.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to restore this session.")
+            with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                with tarfile.open(fileobj=reader, mode="r|") as tar:
+                    _extract(tar, files_dir)
+        else:
+            with tarfile.open(fileobj=raw, mode="r:gz") as tar:
+                _extract(tar, files_dir)
+    manifest: Optional[dict] = None
+    manifest_path = os.path.join(session_root, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = None
+    for rel, mtime_ns in (manifest or {}).items():
+        path = os.path.join(files_dir, rel)
+        try:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        except OSError:
+            continue
+    for path in (archive_path, manifest_path):
+        if os.path.exists(path):
+            os.remove(path)
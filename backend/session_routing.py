@@ -0,0 +1,72 @@
+import bisect
+import hashlib
+import os
+import threading
+from typing import Optional
+
+# Consistent-hash ring over SESSION_NODES. Every node computes the same owner
+# for a session, so a load balancer (or the frontend proxy) can pin a session
+# to one node; adding a node only moves ~1/N of the sessions.
+
+DEFAULT_VNODES = 160
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: list[str], vnodes: int = DEFAULT_VNODES) -> None:
+        self.nodes = sorted(set(nodes))
+        points = []
+        for node in self.nodes:
+            for index in range(max(1, vnodes)):
+                points.append((_hash(f"{node}#{index}"), node))
+        points.sort()
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> Optional[str]:
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+_ring: Optional[HashRing] = None
+_ring_guard = threading.Lock()
+
+
+def get_ring() -> HashRing:
+    global _ring
+    with _ring_guard:
+        if _ring is None:
+            nodes = [n.strip() for n in os.getenv("SESSION_NODES", "").split(",") if n.strip()]
+            try:
+                vnodes = int(os.getenv("SESSION_HASH_VNODES", str(DEFAULT_VNODES)))
+            except ValueError:
+                vnodes = DEFAULT_VNODES
+            _ring = HashRing(nodes, vnodes)
+        return _ring
+
+
+def routing_enabled() -> bool:
+    return bool(get_ring().nodes)
+
+
+def local_node_id() -> Optional[str]:
+    return os.getenv("SESSION_NODE_ID", "").strip() or None
+
+
+def session_node(session_id: str) -> Optional[str]:
+    return get_ring().node_for(session_id)
+
+
+def route_hint(session_id: str) -> dict[str, object]:
+    node = session_node(session_id)
+    local = local_node_id()
+    return {
+        "session_id": session_id,
+        "node": node,
+        "local": node is None or local is None or node == local,
+    }
@@ -1,16 +1,50 @@
+import contextlib
+import functools
 import json
 import os
 import re
 import shutil
+import threading
 import time
-from typing import Optional
+import uuid
+from typing import Iterator, Optional
+
+from backend.blob_store import collect_garbage, file_sha256, stage_blob
+from backend.dataset_cache import CACHE_DIRNAME, is_tabular, profile_file
+from backend.session_archive import pack, unpack
+from sandbox_session import reset_output_quota, set_output_quota
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 SESSION_ID_RE = re.compile(r"^[a-zA-Z0-9_-]{6,80}$")
 
 SESSION_BASE_DIR = os.getenv("SESSION_BASE_DIR", "/tmp/sandbox-sessions")
 SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", "600"))
 SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(5 * 1024 * 1024)))
+SESSION_BLOB_DIR = os.getenv("SESSION_BLOB_DIR", os.path.join(SESSION_BASE_DIR, ".blobs"))
 SESSION_META_FILENAME = "session.json"
+SESSION_LOCK_FILENAME = ".lock"
+SESSION_ARCHIVE_IDLE_S = int(os.getenv("SESSION_ARCHIVE_IDLE_S", "0"))
+UPLOAD_ID_RE = re.compile(r"^[a-f0-9]{32}$")
+UPLOAD_TTL_S = int(os.getenv("UPLOAD_TTL_S", str(SESSION_TTL_S)))
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_BYTES", str(8 * 1024 * 1024)))
+SESSION_STORAGE = os.getenv("SESSION_STORAGE", "local").lower()
+SYNC_STATE_FILENAME = ".sync.json"
+# A working copy synced this recently is used without asking S3 again.
+SESSION_S3_PULL_TTL_S = float(os.getenv("SESSION_S3_PULL_TTL_S", "10"))
+# Transient names written next to session files; never synced.
+_UNSYNCED_SUFFIXES = (".uploading", ".link", ".tmp", ".download")
+
+# One lock per session root, created on demand and dropped when unused.
+_SESSION_LOCKS: dict[str, list] = {}
+_SESSION_LOCKS_GUARD = threading.Lock()
+
+# Sessions with a run in progress in this process; cleanup and archiving skip them.
+_ACTIVE_RUNS: dict[str, int] = {}
+_ACTIVE_RUNS_GUARD = threading.Lock()
 
 _last_cleanup_ts = 0.0
 _cleanup_interval_s = 60.0
@@ -31,10 +65,235 @@ def get_session_files_dir(session_id: str) -> str:
     return os.path.join(get_session_root(session_id), "files")
 
 
+class QuotaExceededError(ValueError):
+    pass
+
+
+class UploadBusyError(ValueError):
+    pass
+
+
+class LocalSessionStorage:
+    # Sessions live only under SESSION_BASE_DIR. Pointing it at a shared mount
+    # (NFS, EFS, CephFS) gives every node the same sessions; the flock in
+    # _session_lock then serializes writers across nodes as well.
+    remote = False
+
+    def pull(self, session_id: str) -> None:
+        return None
+
+    def push(self, session_id: str) -> None:
+        return None
+
+    def delete(self, session_id: str, expired_before: Optional[float] = None) -> None:
+        return None
+
+
+class S3SessionStorage(LocalSessionStorage):
+    # SESSION_BASE_DIR becomes a per-node working copy; the durable copy of
+    # files/ and session.json lives under s3://bucket/prefix/<session_id>/.
+    # .sync.json in the session root records what was last pulled or pushed,
+    # so a sync only transfers changed files.
+    remote = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None) -> None:
+        try:
+            import boto3  # optional, and slow to import: only load it when used
+        except ImportError as exc:
+            raise RuntimeError("boto3 is required for SESSION_STORAGE=s3.") from exc
+        if not bucket:
+            raise RuntimeError("SESSION_S3_BUCKET is required for SESSION_STORAGE=s3.")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def _key(self, session_id: str, rel: str = "") -> str:
+        return "/".join(part for part in (self.prefix, session_id, rel) if part)
+
+    def _remote_objects(self, session_id: str) -> dict[str, str]:
+        base = self._key(session_id) + "/"
+        objects: dict[str, str] = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=base):
+            for item in page.get("Contents", []):
+                objects[item["Key"][len(base):]] = item["ETag"].strip('"')
+        return objects
+
+    def pull(self, session_id: str) -> None:
+        session_root = get_session_root(session_id)
+        if _sync_age(session_root) < SESSION_S3_PULL_TTL_S:
+            return
+        state = _read_sync_state(session_root)
+        remote = self._remote_objects(session_id)
+        for rel, etag in remote.items():
+            if state.get(rel, {}).get("etag") == etag or not _is_synced(rel):
+                continue
+            path = os.path.join(session_root, *rel.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex[:8]}.download"
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(session_id, rel))
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(response["Body"], f)
+            # Keep the writer's mtime so cached profiles and Feather files stay valid.
+            mtime_ns = response.get("Metadata", {}).get("mtime-ns")
+            if mtime_ns and mtime_ns.isdigit():
+                os.utime(temp_path, ns=(int(mtime_ns), int(mtime_ns)))
+            os.replace(temp_path, path)
+            stats = os.stat(path)
+            state[rel] = {"etag": etag, "size": stats.st_size, "mtime_ns": stats.st_mtime_ns}
+        for rel in [rel for rel in state if rel not in remote]:
+            # Removed on another node since the last sync.
+            path = os.path.join(session_root, *rel.split("/"))
+            if os.path.exists(path):
+                os.remove(path)
+            del state[rel]
+        _write_sync_state(session_root, state)
+
+    def push(self, session_id: str) -> None:
+        session_root = get_session_root(session_id)
+        state = _read_sync_state(session_root)
+        local = _synced_files(session_root)
+        for rel, path in local.items():
+            stats = os.stat(path)
+            previous = state.get(rel) or {}
+            if previous.get("size") == stats.st_size and previous.get("mtime_ns") == stats.st_mtime_ns:
+                continue
+            with open(path, "rb") as f:
+                response = self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=self._key(session_id, rel),
+                    Body=f,
+                    Metadata={"mtime-ns": str(stats.st_mtime_ns)},
+                )
+            state[rel] = {
+                "etag": response["ETag"].strip('"'),
+                "size": stats.st_size,
+                "mtime_ns": stats.st_mtime_ns,
+            }
+        for rel in [rel for rel in state if rel not in local]:
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(session_id, rel))
+            del state[rel]
+        _write_sync_state(session_root, state)
+
+    def delete(self, session_id: str, expired_before: Optional[float] = None) -> None:
+        if expired_before is not None:
+            # Another node may have kept the session alive since our last sync.
+            try:
+                response = self.client.get_object(
+                    Bucket=self.bucket, Key=self._key(session_id, SESSION_META_FILENAME)
+                )
+                meta = json.loads(response["Body"].read())
+                if float(meta.get("last_access", 0)) > expired_before:
+                    return
+            except Exception:
+                pass
+        keys = [self._key(session_id, rel) for rel in self._remote_objects(session_id)]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[start : start + 1000]]},
+            )
+
+
+_storage: Optional[LocalSessionStorage] = None
+_storage_guard = threading.Lock()
+
+
+def get_storage() -> LocalSessionStorage:
+    global _storage
+    with _storage_guard:
+        if _storage is None:
+            if SESSION_STORAGE == "s3":
+                _storage = S3SessionStorage(
+                    os.getenv("SESSION_S3_BUCKET", ""),
+                    os.getenv("SESSION_S3_PREFIX", "sessions"),
+                    os.getenv("SESSION_S3_ENDPOINT"),
+                )
+            else:
+                _storage = LocalSessionStorage()
+        return _storage
+
+
+def _is_synced(rel: str) -> bool:
+    if rel == SESSION_META_FILENAME:
+        return True
+    parts = rel.split("/")
+    if len(parts) < 2 or parts[0] != "files" or parts[1] == CACHE_DIRNAME:
+        return False
+    return not rel.endswith(_UNSYNCED_SUFFIXES)
+
+
+def _synced_files(session_root: str) -> dict[str, str]:
+    files: dict[str, str] = {}
+    meta_path = _meta_path(session_root)
+    if os.path.exists(meta_path):
+        files[SESSION_META_FILENAME] = meta_path
+    for base, _, names in os.walk(os.path.join(session_root, "files")):
+        for name in names:
+            path = os.path.join(base, name)
+            rel = os.path.relpath(path, session_root).replace(os.sep, "/")
+            if _is_synced(rel):
+                files[rel] = path
+    return files
+
+
+def _read_sync_state(session_root: str) -> dict[str, dict]:
+    try:
+        with open(os.path.join(session_root, SYNC_STATE_FILENAME), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _sync_age(session_root: str) -> float:
+    # Seconds since the last pull or push of this working copy.
+    try:
+        return time.time() - os.path.getmtime(os.path.join(session_root, SYNC_STATE_FILENAME))
+    except OSError:
+        return float("inf")
+
+
+def _write_sync_state(session_root: str, state: dict[str, dict]) -> None:
+    path = os.path.join(session_root, SYNC_STATE_FILENAME)
+    os.makedirs(session_root, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
 def _meta_path(session_root: str) -> str:
     return os.path.join(session_root, SESSION_META_FILENAME)
 
 
+@contextlib.contextmanager
+def _session_lock(session_root: str) -> Iterator[None]:
+    # Serializes read-modify-write of one session's metadata across threads
+    # and, via flock, across uvicorn worker processes sharing SESSION_BASE_DIR.
+    # Different sessions do not wait for each other.
+    with _SESSION_LOCKS_GUARD:
+        entry = _SESSION_LOCKS.setdefault(session_root, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(session_root, exist_ok=True)
+            with open(os.path.join(session_root, SESSION_LOCK_FILENAME), "a") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+    finally:
+        with _SESSION_LOCKS_GUARD:
+            entry[1] -= 1
+            if not entry[1]:
+                del _SESSION_LOCKS[session_root]
+
+
 def _read_meta(session_root: str) -> Optional[dict]:
     meta_path = _meta_path(session_root)
     if not os.path.exists(meta_path):
@@ -49,17 +308,26 @@ def _read_meta(session_root: str) -> Optional[dict]:
     return None
 
 
-def _write_meta(session_root: str, total_bytes: int, last_access: float) -> None:
+def _write_meta(session_root: str, total_bytes: int, last_access: float, **fields) -> None:
     meta_path = _meta_path(session_root)
-    payload = {"total_bytes": int(total_bytes), "last_access": float(last_access)}
+    # Keep extra keys (e.g. file profiles) written by other callers.
+    payload = _read_meta(session_root) or {}
+    payload.update(fields)
+    payload["total_bytes"] = int(total_bytes)
+    payload["last_access"] = float(last_access)
     os.makedirs(session_root, exist_ok=True)
-    with open(meta_path, "w", encoding="utf-8") as f:
+    temp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
         json.dump(payload, f)
+    os.replace(temp_path, meta_path)
 
 
 def _calculate_dir_size(root: str) -> int:
     total = 0
-    for base, _, files in os.walk(root):
+    for base, dirs, files in os.walk(root):
+        # Derived dataset caches do not count against the session quota.
+        if base == root and CACHE_DIRNAME in dirs:
+            dirs.remove(CACHE_DIRNAME)
         for name in files:
             try:
                 total += os.path.getsize(os.path.join(base, name))
@@ -68,33 +336,136 @@ def _calculate_dir_size(root: str) -> int:
     return total
 
 
-def ensure_session(session_id: str) -> dict:
-    session_root = get_session_root(session_id)
-    files_dir = get_session_files_dir(session_id)
-    os.makedirs(files_dir, exist_ok=True)
+def _restore_locked(session_root: str, files_dir: str) -> None:
     meta = _read_meta(session_root)
-    now = time.time()
-    if meta is None:
-        total_bytes = _calculate_dir_size(files_dir)
-        _write_meta(session_root, total_bytes, now)
-        return {"total_bytes": total_bytes, "last_access": now}
+    if not meta or not meta.get("archived"):
+        return
+    unpack(session_root, files_dir, str(meta["archived"]))
     _write_meta(
         session_root,
         int(meta.get("total_bytes", 0)),
-        now,
+        float(meta.get("last_access", time.time())),
+        archived=None,
     )
-    return {"total_bytes": int(meta.get("total_bytes", 0)), "last_access": now}
 
 
-def update_session_access(session_id: str) -> None:
+def restore_session(session_id: str) -> None:
+    # Idle sessions may be packed into a compressed archive; unpack on access.
+    # With remote storage, also pick up changes made on other nodes.
     session_root = get_session_root(session_id)
+    storage = get_storage()
     meta = _read_meta(session_root)
-    now = time.time()
-    if meta is None:
-        total_bytes = _calculate_dir_size(get_session_files_dir(session_id))
-        _write_meta(session_root, total_bytes, now)
+    if not storage.remote and (not meta or not meta.get("archived")):
+        return
+    with _session_lock(session_root):
+        _restore_locked(session_root, get_session_files_dir(session_id))
+        storage.pull(session_id)
+
+
+def sync_session(session_id: str) -> None:
+    # Publish local changes (uploads, sandbox outputs, metadata) to the
+    # shared store so the next request can land on any node.
+    storage = get_storage()
+    if not storage.remote:
+        return
+    session_root = get_session_root(session_id)
+    with _session_lock(session_root):
+        storage.push(session_id)
+
+
+@contextlib.contextmanager
+def session_active(session_id: Optional[str]) -> Iterator[None]:
+    # Marks the session as in use for the duration of a run (agent or batch).
+    # Cleanup does not expire or archive it meanwhile, and the TTL restarts
+    # when the run ends. Output spills of the run are charged to the quota.
+    if not session_id:
+        yield
         return
-    _write_meta(session_root, int(meta.get("total_bytes", 0)), now)
+    with _ACTIVE_RUNS_GUARD:
+        _ACTIVE_RUNS[session_id] = _ACTIVE_RUNS.get(session_id, 0) + 1
+    token = set_output_quota(functools.partial(charge_output, session_id))
+    try:
+        yield
+    finally:
+        reset_output_quota(token)
+        with _ACTIVE_RUNS_GUARD:
+            _ACTIVE_RUNS[session_id] -= 1
+            if not _ACTIVE_RUNS[session_id]:
+                del _ACTIVE_RUNS[session_id]
+        if os.path.isdir(get_session_root(session_id)):
+            update_session_access(session_id)
+
+
+def _session_busy(session_id: str) -> bool:
+    with _ACTIVE_RUNS_GUARD:
+        return session_id in _ACTIVE_RUNS
+
+
+def _archive_session(session_id: str, now: float) -> None:
+    session_root = get_session_root(session_id)
+    files_dir = get_session_files_dir(session_id)
+    with _session_lock(session_root):
+        if _session_busy(session_id):
+            return
+        meta = _read_meta(session_root)
+        if not meta or meta.get("archived") or not os.path.isdir(files_dir):
+            return
+        if now - float(meta.get("last_access", now)) <= SESSION_ARCHIVE_IDLE_S:
+            return
+        uploads_dir = _uploads_dir(session_id)
+        if os.path.isdir(uploads_dir) and os.listdir(uploads_dir):
+            return
+        storage = get_storage()
+        if storage.remote:
+            # The bucket already holds the durable copy; drop the working copy.
+            storage.push(session_id)
+            shutil.rmtree(session_root, ignore_errors=True)
+            return
+        try:
+            name = pack(files_dir, session_root)
+        except OSError:
+            return
+        # Reference the archive before deleting the files it replaces.
+        _write_meta(
+            session_root,
+            int(meta.get("total_bytes", 0)),
+            float(meta.get("last_access", now)),
+            archived=name,
+        )
+        shutil.rmtree(files_dir, ignore_errors=True)
+
+
+def ensure_session(session_id: str) -> dict:
+    session_root = get_session_root(session_id)
+    files_dir = get_session_files_dir(session_id)
+    os.makedirs(files_dir, exist_ok=True)
+    with _session_lock(session_root):
+        _restore_locked(session_root, files_dir)
+        get_storage().pull(session_id)
+        meta = _read_meta(session_root)
+        now = time.time()
+        if meta is None:
+            total_bytes = _calculate_dir_size(files_dir)
+            _write_meta(session_root, total_bytes, now)
+            return {"total_bytes": total_bytes, "last_access": now}
+        _write_meta(
+            session_root,
+            int(meta.get("total_bytes", 0)),
+            now,
+        )
+    return {"total_bytes": int(meta.get("total_bytes", 0)), "last_access": now}
+
+
+def update_session_access(session_id: str) -> None:
+    session_root = get_session_root(session_id)
+    with _session_lock(session_root):
+        meta = _read_meta(session_root)
+        now = time.time()
+        if meta is None:
+            total_bytes = _calculate_dir_size(get_session_files_dir(session_id))
+            _write_meta(session_root, total_bytes, now)
+            return
+        _write_meta(session_root, int(meta.get("total_bytes", 0)), now)
 
 
 def maybe_cleanup_sessions() -> None:
@@ -107,7 +478,7 @@ def maybe_cleanup_sessions() -> None:
         return
     for entry in os.listdir(SESSION_BASE_DIR):
         session_root = os.path.join(SESSION_BASE_DIR, entry)
-        if not os.path.isdir(session_root):
+        if not SESSION_ID_RE.match(entry) or not os.path.isdir(session_root):
             continue
         meta = _read_meta(session_root)
         last_access = None
@@ -119,7 +490,21 @@ def maybe_cleanup_sessions() -> None:
             except OSError:
                 last_access = now
         if now - float(last_access) > SESSION_TTL_S:
-            shutil.rmtree(session_root, ignore_errors=True)
+            # Checked under the guard so a run cannot start on a session
+            # while its directory is being removed.
+            with _ACTIVE_RUNS_GUARD:
+                if entry in _ACTIVE_RUNS:
+                    continue
+                shutil.rmtree(session_root, ignore_errors=True)
+            try:
+                get_storage().delete(entry, expired_before=now - SESSION_TTL_S)
+            except Exception:
+                pass
+        else:
+            _cleanup_stale_uploads(entry, now)
+            if SESSION_ARCHIVE_IDLE_S > 0 and now - float(last_access) > SESSION_ARCHIVE_IDLE_S:
+                _archive_session(entry, now)
+    collect_garbage(SESSION_BLOB_DIR, now)
 
 
 def safe_filename(filename: str) -> str:
@@ -133,14 +518,299 @@ def clear_session(session_id: str) -> None:
     session_root = get_session_root(session_id)
     if os.path.isdir(session_root):
         shutil.rmtree(session_root, ignore_errors=True)
+    get_storage().delete(session_id)
 
 
 def reserve_space(session_id: str, file_size: int, existing_size: int = 0) -> int:
     session_root = get_session_root(session_id)
-    meta = _read_meta(session_root)
-    total_bytes = int(meta.get("total_bytes", 0)) if meta else 0
-    new_total = total_bytes - existing_size + file_size
-    if new_total > SESSION_MAX_BYTES:
-        raise ValueError("Session storage limit exceeded.")
-    _write_meta(session_root, new_total, time.time())
+    with _session_lock(session_root):
+        meta = _read_meta(session_root)
+        total_bytes = int(meta.get("total_bytes", 0)) if meta else 0
+        new_total = total_bytes - existing_size + file_size
+        if file_size > existing_size and new_total > SESSION_MAX_BYTES:
+            raise QuotaExceededError("Session storage limit exceeded.")
+        _write_meta(session_root, max(0, new_total), time.time())
     return new_total
+
+
+def release_space(session_id: str, size: int) -> None:
+    if size > 0:
+        reserve_space(session_id, 0, existing_size=size)
+
+
+def charge_output(session_id: str, size: int) -> int:
+    # Charges a file the sandbox already wrote; returns how much of it fits.
+    session_root = get_session_root(session_id)
+    with _session_lock(session_root):
+        meta = _read_meta(session_root)
+        total_bytes = int(meta.get("total_bytes", 0)) if meta else 0
+        granted = max(0, min(size, SESSION_MAX_BYTES - total_bytes))
+        _write_meta(session_root, total_bytes + granted, time.time())
+    return granted
+
+
+def commit_file(
+    session_id: str,
+    temp_path: str,
+    target_path: str,
+    size: int,
+    reserved: int = 0,
+    sha256: Optional[str] = None,
+) -> None:
+    # Swap the upload into place and settle the quota in one locked step, so
+    # concurrent uploads to the same session cannot overshoot SESSION_MAX_BYTES.
+    # The content goes through the blob store first, so identical uploads across
+    # sessions share one inode while each session is still charged for it.
+    staged_path = stage_blob(SESSION_BLOB_DIR, temp_path, target_path, sha256)
+    session_root = get_session_root(session_id)
+    try:
+        with _session_lock(session_root):
+            existing_size = os.path.getsize(target_path) if os.path.exists(target_path) else 0
+            meta = _read_meta(session_root)
+            total_bytes = int(meta.get("total_bytes", 0)) if meta else 0
+            new_total = total_bytes - reserved - existing_size + size
+            if size > reserved + existing_size and new_total > SESSION_MAX_BYTES:
+                raise QuotaExceededError("Session storage limit exceeded.")
+            os.replace(staged_path, target_path)
+            _write_meta(session_root, max(0, new_total), time.time())
+    finally:
+        if staged_path != temp_path and os.path.exists(staged_path):
+            os.remove(staged_path)
+
+
+def _uploads_dir(session_id: str) -> str:
+    return os.path.join(get_session_root(session_id), "uploads")
+
+
+def _upload_paths(session_id: str, upload_id: str) -> tuple[str, str]:
+    if not UPLOAD_ID_RE.match(upload_id or ""):
+        raise ValueError("Invalid upload_id.")
+    base = os.path.join(_uploads_dir(session_id), upload_id)
+    return f"{base}.json", f"{base}.part"
+
+
+def _read_upload(state_path: str) -> dict:
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as exc:
+        raise FileNotFoundError("Upload not found.") from exc
+
+
+def _write_upload(state_path: str, state: dict) -> None:
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+
+
+def _committing(state: dict, now: float) -> bool:
+    # A commit that has run longer than UPLOAD_TTL_S died with its worker.
+    started = state.get("committing")
+    return bool(started) and now - float(started) < UPLOAD_TTL_S
+
+
+def _merge_range(ranges: list[list[int]], start: int, end: int) -> list[list[int]]:
+    merged: list[list[int]] = []
+    for current in sorted(ranges + [[start, end]]):
+        if merged and current[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], current[1])
+        else:
+            merged.append(list(current))
+    return merged
+
+
+def _upload_status(upload_id: str, state: dict) -> dict:
+    received = sum(end - start for start, end in state["received"])
+    return {
+        "upload_id": upload_id,
+        "filename": state["filename"],
+        "size": state["size"],
+        "received": state["received"],
+        "received_bytes": received,
+        "complete": received == state["size"],
+        "chunk_max_bytes": UPLOAD_CHUNK_MAX_BYTES,
+    }
+
+
+def create_upload(
+    session_id: str, filename: str, size: int, sha256: Optional[str] = None
+) -> dict:
+    filename = safe_filename(filename)
+    if size < 0:
+        raise ValueError("Invalid upload size.")
+    # Reserve the full size up front; commit_file settles the difference.
+    reserve_space(session_id, size)
+    upload_id = uuid.uuid4().hex
+    state_path, part_path = _upload_paths(session_id, upload_id)
+    try:
+        os.makedirs(_uploads_dir(session_id), exist_ok=True)
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # Preallocate so chunks can be written in parallel at their offsets.
+            if size > 0:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except (AttributeError, OSError):
+                    os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+        state = {
+            "filename": filename,
+            "size": int(size),
+            "sha256": (sha256 or "").lower() or None,
+            "received": [],
+            "created": time.time(),
+        }
+        _write_upload(state_path, state)
+    except OSError:
+        release_space(session_id, size)
+        for path in (state_path, part_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return _upload_status(upload_id, state)
+
+
+def get_upload(session_id: str, upload_id: str) -> dict:
+    state_path, _ = _upload_paths(session_id, upload_id)
+    return _upload_status(upload_id, _read_upload(state_path))
+
+
+def write_upload_chunk(session_id: str, upload_id: str, offset: int, data: bytes) -> dict:
+    state_path, part_path = _upload_paths(session_id, upload_id)
+    state = _read_upload(state_path)
+    if _committing(state, time.time()):
+        raise UploadBusyError("Upload is being committed.")
+    end = offset + len(data)
+    if offset < 0 or end > state["size"]:
+        raise ValueError("Chunk is outside the declared upload size.")
+    if len(data) > UPLOAD_CHUNK_MAX_BYTES:
+        raise ValueError("Chunk is too large.")
+    fd = os.open(part_path, os.O_WRONLY)
+    try:
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], offset + written)
+    finally:
+        os.close(fd)
+    with _session_lock(get_session_root(session_id)):
+        state = _read_upload(state_path)
+        if data:
+            state["received"] = _merge_range(state["received"], offset, end)
+        _write_upload(state_path, state)
+    return _upload_status(upload_id, state)
+
+
+def commit_upload(session_id: str, upload_id: str, sha256: Optional[str] = None) -> dict:
+    state_path, part_path = _upload_paths(session_id, upload_id)
+    session_root = get_session_root(session_id)
+    # Claim the upload under the session lock, so a concurrent commit, abort
+    # or chunk write fails cleanly instead of racing the hash and the swap.
+    with _session_lock(session_root):
+        state = _read_upload(state_path)
+        if _committing(state, time.time()):
+            raise UploadBusyError("Upload is already being committed.")
+        if not _upload_status(upload_id, state)["complete"]:
+            raise ValueError("Upload is incomplete.")
+        state["committing"] = time.time()
+        _write_upload(state_path, state)
+    try:
+        expected = (sha256 or state.get("sha256") or "").lower()
+        actual = file_sha256(part_path)
+        if expected and actual != expected:
+            raise ValueError("Checksum mismatch.")
+        target_path = os.path.join(get_session_files_dir(session_id), state["filename"])
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        commit_file(
+            session_id,
+            part_path,
+            target_path,
+            state["size"],
+            reserved=state["size"],
+            sha256=actual,
+        )
+    except BaseException:
+        # Leave the upload resumable, e.g. to resend chunks after a mismatch.
+        with _session_lock(session_root):
+            state["committing"] = None
+            _write_upload(state_path, state)
+        raise
+    os.remove(state_path)
+    return {"name": state["filename"], "size": state["size"]}
+
+
+def abort_upload(session_id: str, upload_id: str) -> None:
+    state_path, part_path = _upload_paths(session_id, upload_id)
+    with _session_lock(get_session_root(session_id)):
+        state = _read_upload(state_path)
+        if _committing(state, time.time()):
+            raise UploadBusyError("Upload is being committed.")
+        for path in (state_path, part_path):
+            if os.path.exists(path):
+                os.remove(path)
+    release_space(session_id, int(state.get("size", 0)))
+
+
+def _cleanup_stale_uploads(session_id: str, now: float) -> None:
+    uploads_dir = _uploads_dir(session_id)
+    if not os.path.isdir(uploads_dir):
+        return
+    for name in os.listdir(uploads_dir):
+        upload_id, ext = os.path.splitext(name)
+        if ext != ".json":
+            continue
+        try:
+            state = _read_upload(os.path.join(uploads_dir, name))
+        except FileNotFoundError:
+            continue
+        if now - float(state.get("created", now)) > UPLOAD_TTL_S:
+            try:
+                abort_upload(session_id, upload_id)
+            except (OSError, ValueError):
+                continue
+
+
+def _profile_is_fresh(profile: dict, path: str) -> bool:
+    try:
+        stats = os.stat(path)
+    except OSError:
+        return False
+    return profile.get("size") == stats.st_size and profile.get("mtime_ns") == stats.st_mtime_ns
+
+
+def get_file_profiles(session_id: str, filenames: list[str]) -> dict[str, dict]:
+    # Profiles live in session.json keyed by relative path and are recomputed
+    # whenever the file's size or mtime no longer matches.
+    session_root = get_session_root(session_id)
+    files_dir = get_session_files_dir(session_id)
+    meta = _read_meta(session_root) or {}
+    stored = meta.get("profiles") or {}
+    profiles: dict[str, dict] = {}
+    changed = False
+    for name in filenames:
+        if not is_tabular(name):
+            continue
+        profile = stored.get(name)
+        if profile is None or not _profile_is_fresh(profile, os.path.join(files_dir, name)):
+            profile = profile_file(files_dir, name)
+            changed = True
+        if profile is not None:
+            profiles[name] = profile
+    merged = {
+        name: profile
+        for name, profile in stored.items()
+        if name not in filenames and os.path.exists(os.path.join(files_dir, name))
+    }
+    merged.update(profiles)
+    if changed or set(stored) != set(merged):
+        with _session_lock(session_root):
+            current = _read_meta(session_root) or {}
+            _write_meta(
+                session_root,
+                int(current.get("total_bytes", 0)),
+                float(current.get("last_access", time.time())),
+                profiles=merged,
+            )
+    return profiles
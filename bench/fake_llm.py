@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+DEFAULT_CODE = "print(sum(i * i for i in range(10000)))"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class FakeChatModel(BaseChatModel):
+    # Scripted stand-in for ChatOpenAI: `tool_calls` tool invocations, then a
+    # streamed answer, with simulated first-token and inter-token latency.
+
+    streaming: bool = False
+    tool_name: str = Field(default_factory=lambda: os.getenv("FAKE_LLM_TOOL", ""))
+    code: str = Field(default_factory=lambda: os.getenv("FAKE_LLM_CODE", DEFAULT_CODE))
+    tool_calls: int = Field(default_factory=lambda: _env_int("FAKE_LLM_TOOL_CALLS", 1))
+    answer_tokens: int = Field(
+        default_factory=lambda: _env_int("FAKE_LLM_ANSWER_TOKENS", 50)
+    )
+    ttft_ms: float = Field(default_factory=lambda: _env_float("FAKE_LLM_TTFT_MS", 200))
+    token_ms: float = Field(default_factory=lambda: _env_float("FAKE_LLM_TOKEN_MS", 10))
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-sandbox-chat"
+
+    def bind_tools(self, tools: Any, *, tool_choice: Optional[str] = None, **kwargs: Any):
+        names = [getattr(tool, "name", None) for tool in tools]
+        return self.bind(
+            tool_names=[name for name in names if name],
+            tool_choice=tool_choice,
+            **kwargs,
+        )
+
+    def _pick_tool(self, tool_choice: Any, tool_names: list[str]) -> str:
+        if isinstance(tool_choice, str) and tool_choice not in {"auto", "any", "none", "required"}:
+            return tool_choice
+        if self.tool_name:
+            return self.tool_name
+        if tool_names:
+            return tool_names[0]
+        return "sandboxed_python"
+
+    def _plan(self, messages: list[BaseMessage], **kwargs: Any) -> AIMessage:
+        made = sum(1 for message in messages if getattr(message, "tool_calls", None))
+        last = messages[-1] if messages else None
+        if made < self.tool_calls and getattr(last, "type", "") in {"human", "tool"}:
+            name = self._pick_tool(kwargs.get("tool_choice"), kwargs.get("tool_names") or [])
+            call = {
+                "name": name,
+                "args": {"code": self.code},
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "tool_call",
+            }
+            return AIMessage(content="", tool_calls=[call])
+        return AIMessage(content="".join(self._answer_tokens()))
+
+    def _answer_tokens(self) -> list[str]:
+        return [f"tok{index} " for index in range(max(1, self.answer_tokens))]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._plan(messages, **kwargs)
+        delay_ms = self.ttft_ms
+        if not message.tool_calls:
+            delay_ms += self.token_ms * max(0, self.answer_tokens - 1)
+        time.sleep(delay_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> list[ChatGenerationChunk]:
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            chunk = AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {
+                        "name": call["name"],
+                        "args": json.dumps(call["args"]),
+                        "id": call["id"],
+                        "index": 0,
+                        "type": "tool_call_chunk",
+                    }
+                ],
+            )
+            return [ChatGenerationChunk(message=chunk)]
+        return [
+            ChatGenerationChunk(message=AIMessageChunk(content=token))
+            for token in self._answer_tokens()
+        ]
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        chunks = self._chunks(self._plan(messages, **kwargs))
+        for index, chunk in enumerate(chunks):
+            time.sleep((self.ttft_ms if index == 0 else self.token_ms) / 1000)
+            if run_manager and chunk.text:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = self._chunks(self._plan(messages, **kwargs))
+        for index, chunk in enumerate(chunks):
+            await asyncio.sleep((self.ttft_ms if index == 0 else self.token_ms) / 1000)
+            if run_manager and chunk.text:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
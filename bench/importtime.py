@@ -0,0 +1,99 @@
+import argparse
+import os
+import subprocess
+import sys
+from typing import Optional
+
+# Modules that must stay out of the server's import graph: they are loaded
+# when the agents are built, after the worker is already serving.
+DEFAULT_FORBIDDEN = (
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "pandas",
+    "numpy",
+    "pyarrow",
+    "boto3",
+)
+# Imported before the module under test. The framework's own import time
+# (fastapi alone is 400ms+) varies too much between machines to budget.
+DEFAULT_BASELINE = "fastapi"
+DEFAULT_BUDGET_MS = 250.0
+
+
+def measure(
+    module: str, baseline: Optional[str] = None
+) -> tuple[int, dict[str, tuple[int, int]]]:
+    # Returns (cumulative us for `module`, {name: (self us, cumulative us)}).
+    # With baseline, that module is imported first in the same process, so the
+    # time covers only what `module` adds on top of it.
+    statement = f"import {baseline}; import {module}" if baseline else f"import {module}"
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    modules: dict[str, tuple[int, int]] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3:
+            continue
+        modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return modules.get(module, (0, 0))[1], modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import-time budget check for the backend")
+    parser.add_argument("--module", default="backend.server")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help="Module imported first and excluded from the budget ('' for none)",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Best of N runs is compared")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--forbid",
+        default=",".join(DEFAULT_FORBIDDEN),
+        help="Comma-separated modules that must not be imported",
+    )
+    args = parser.parse_args()
+
+    best_us = None
+    best_modules: dict[str, tuple[int, int]] = {}
+    for _ in range(max(1, args.runs)):
+        total_us, modules = measure(args.module, args.baseline or None)
+        if best_us is None or total_us < best_us:
+            best_us, best_modules = total_us, modules
+
+    after = f" after {args.baseline}" if args.baseline else ""
+    print(f"import {args.module}{after}: {best_us / 1000:.1f}ms (budget {args.budget_ms:.0f}ms)")
+    print("slowest modules (self time):")
+    ranked = sorted(best_modules.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_us, cumulative_us) in ranked[: args.top]:
+        print(f"  {self_us / 1000:8.1f}ms  {cumulative_us / 1000:8.1f}ms  {name}")
+
+    failures = []
+    if best_us / 1000 > args.budget_ms:
+        failures.append(f"over budget by {best_us / 1000 - args.budget_ms:.1f}ms")
+    forbidden = {name.strip() for name in args.forbid.split(",") if name.strip()}
+    leaked = sorted(name for name in best_modules if name.split(".")[0] in forbidden)
+    if leaked:
+        roots = sorted({name.split(".")[0] for name in leaked})
+        failures.append(f"eagerly imports {', '.join(roots)}")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
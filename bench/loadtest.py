@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Optional
+
+try:
+    import httpx
+except ImportError:  # dev-only dependency
+    httpx = None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _summary(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "p99": _percentile(values, 99),
+        "max": max(values),
+    }
+
+
+class Results:
+    def __init__(self) -> None:
+        self.ttft_s: list[float] = []
+        self.stream_s: list[float] = []
+        self.tokens_per_s: list[float] = []
+        self.tokens = 0
+        self.ops: dict[str, dict[str, int]] = {}
+
+    def record(self, op: str, ok: bool) -> None:
+        entry = self.ops.setdefault(op, {"ok": 0, "error": 0})
+        entry["ok" if ok else "error"] += 1
+
+
+def _csv_payload(size: int) -> bytes:
+    rows = ["id,value,label"]
+    index = 0
+    while sum(len(row) + 1 for row in rows) < size:
+        rows.append(f"{index},{index * 0.5},label{index % 7}")
+        index += 1
+    return ("\n".join(rows) + "\n").encode("utf-8")
+
+
+async def _stream_chat(
+    client: Any, session_id: str, prompt: str, headers: dict, results: Results
+) -> bool:
+    body = {
+        "messages": [{"role": "user", "content": prompt}],
+        "session_id": session_id,
+    }
+    started = time.monotonic()
+    first_token: Optional[float] = None
+    tokens = 0
+    ok = False
+    async with client.stream("POST", "/chat/stream", json=body, headers=headers) as response:
+        if response.status_code != 200:
+            return False
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event.get("type") == "token":
+                if first_token is None:
+                    first_token = time.monotonic()
+                tokens += 1
+            elif event.get("type") == "error":
+                ok = False
+                break
+            elif event.get("type") == "done":
+                ok = tokens > 0
+                break
+    finished = time.monotonic()
+    if first_token is not None:
+        results.ttft_s.append(first_token - started)
+        if finished > first_token and tokens > 1:
+            results.tokens_per_s.append((tokens - 1) / (finished - first_token))
+    results.stream_s.append(finished - started)
+    results.tokens += tokens
+    return ok
+
+
+async def _client_loop(
+    client: Any, index: int, args: argparse.Namespace, results: Results
+) -> None:
+    session_id = f"load-{index}-{uuid.uuid4().hex[:8]}"
+    headers = {}
+    if args.spoof_ips:
+        # Spread clients over distinct IPs so the per-IP rate limiter measures capacity.
+        headers["x-forwarded-for"] = (
+            f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+        )
+
+    if args.upload_bytes > 0:
+        try:
+            response = await client.post(
+                "/files/upload",
+                data={"session_id": session_id},
+                files={"files": ("data.csv", _csv_payload(args.upload_bytes), "text/csv")},
+            )
+            results.record("upload", response.status_code == 200)
+        except httpx.HTTPError:
+            results.record("upload", False)
+
+    for _ in range(args.requests):
+        try:
+            ok = await _stream_chat(client, session_id, args.prompt, headers, results)
+            results.record("chat_stream", ok)
+        except (httpx.HTTPError, ValueError):
+            results.record("chat_stream", False)
+
+    if args.upload_bytes > 0:
+        try:
+            response = await client.get(
+                "/files/download", params={"session_id": session_id, "path": "data.csv"}
+            )
+            results.record("download", response.status_code == 200)
+        except httpx.HTTPError:
+            results.record("download", False)
+    try:
+        response = await client.get("/files/list", params={"session_id": session_id})
+        results.record("list", response.status_code == 200)
+    except httpx.HTTPError:
+        results.record("list", False)
+
+
+async def _fetch_stats(client: Any) -> dict[str, Any]:
+    try:
+        response = await client.get("/stats")
+        if response.status_code == 200:
+            return response.json()
+    except httpx.HTTPError:
+        pass
+    return {}
+
+
+def _queue_wait(
+    before: dict[str, Any], after: dict[str, Any], key: str = "cpython_lock"
+) -> dict[str, float]:
+    start = before.get(key) or {}
+    end = after.get(key) or {}
+    count_key = "acquired" if key == "cpython_lock" else "admitted"
+    acquired = end.get(count_key, 0) - start.get(count_key, 0)
+    total = end.get("wait_s_total", 0.0) - start.get("wait_s_total", 0.0)
+    return {
+        "acquired": acquired,
+        "mean_s": total / acquired if acquired else 0.0,
+        "max_s": end.get("wait_s_max", 0.0),
+        "rejected": end.get("rejected", 0) - start.get("rejected", 0),
+    }
+
+
+async def _run(args: argparse.Namespace) -> dict[str, Any]:
+    results = Results()
+    limits = httpx.Limits(
+        max_connections=args.clients + 10, max_keepalive_connections=args.clients
+    )
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+        before = await _fetch_stats(client)
+        started = time.monotonic()
+        await asyncio.gather(
+            *(_client_loop(client, index, args, results) for index in range(args.clients))
+        )
+        elapsed = time.monotonic() - started
+        after = await _fetch_stats(client)
+
+    total_ops = sum(entry["ok"] + entry["error"] for entry in results.ops.values())
+    total_errors = sum(entry["error"] for entry in results.ops.values())
+    return {
+        "clients": args.clients,
+        "elapsed_s": elapsed,
+        "ttft_s": _summary(results.ttft_s),
+        "stream_s": _summary(results.stream_s),
+        "tokens_per_s_per_stream": _summary(results.tokens_per_s),
+        "tokens_per_s_aggregate": results.tokens / elapsed if elapsed else 0.0,
+        "sandbox_queue_wait": _queue_wait(before, after),
+        "scheduler_queue_wait": _queue_wait(before, after, "scheduler"),
+        "ops": results.ops,
+        "error_rate": total_errors / total_ops if total_ops else 0.0,
+    }
+
+
+def _print_report(report: dict[str, Any]) -> None:
+    print(f"clients={report['clients']} elapsed={report['elapsed_s']:.2f}s")
+    for key in ("ttft_s", "stream_s", "tokens_per_s_per_stream"):
+        stats = report[key]
+        if not stats.get("count"):
+            print(f"{key}: no samples")
+            continue
+        print(
+            f"{key}: mean={stats['mean']:.3f} p50={stats['p50']:.3f} "
+            f"p95={stats['p95']:.3f} p99={stats['p99']:.3f} max={stats['max']:.3f}"
+        )
+    print(f"tokens_per_s_aggregate: {report['tokens_per_s_aggregate']:.1f}")
+    for key in ("sandbox_queue_wait", "scheduler_queue_wait"):
+        wait = report[key]
+        print(
+            f"{key}: runs={wait['acquired']} mean={wait['mean_s']:.3f}s "
+            f"max={wait['max_s']:.3f}s rejected={wait['rejected']}"
+        )
+    for op, entry in sorted(report["ops"].items()):
+        print(f"{op}: ok={entry['ok']} error={entry['error']}")
+    print(f"error_rate: {report['error_rate']:.2%}")
+
+
+def _spawn_server(port: int) -> subprocess.Popen:
+    env = os.environ.copy()
+    env.setdefault("AGENT_LLM", "fake")
+    env.setdefault("RATE_LIMIT_MAX", "1000000")
+    cmd = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "backend.server:app",
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=ROOT_DIR, env=env)
+
+
+async def _wait_ready(url: str, timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient(base_url=url, timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get("/stats")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Backend at {url} did not become ready.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test /chat/stream and file endpoints")
+    parser.add_argument("--url", default=None, help="Backend URL (default: spawn a local server)")
+    parser.add_argument("--port", type=int, default=10099, help="Port for the spawned server")
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=1, help="Chat requests per client")
+    parser.add_argument(
+        "--upload-bytes", type=int, default=4096, help="CSV upload size per client (0 disables)"
+    )
+    parser.add_argument(
+        "--prompt",
+        default="Use pandas to compute the mean of the value column in /data/data.csv",
+        help="Chat prompt sent by every client",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout")
+    parser.add_argument(
+        "--no-spoof-ips",
+        dest="spoof_ips",
+        action="store_false",
+        help="Send all requests from one client IP",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    if httpx is None:
+        parser.error("httpx is required: pip install httpx")
+
+    server = None
+    if args.url is None:
+        args.url = f"http://127.0.0.1:{args.port}"
+        server = _spawn_server(args.port)
+    try:
+        if server is not None:
+            asyncio.run(_wait_ready(args.url, 60.0))
+        report = asyncio.run(_run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from backend.dataset_cache import ingest_file
+from cpython_tool import CpythonSandboxTool
+from sandbox_hints import analyze, rewrite
+from sandbox_session import reset_session_files_dir, set_session_files_dir
+
+# Typical agent-generated snippets with known slow patterns. Each is run as
+# written, with CPYTHON_REWRITE=1 (when a safe rewrite applies), and as the
+# hand-vectorized version the hints point towards.
+
+SETUP = """import pandas as pd
+df = pd.read_csv("{root}/sales.csv")
+"""
+
+CASES = [
+    {
+        "name": "iterrows_sum",
+        "code": SETUP
+        + """total = 0
+for _, row in df.iterrows():
+    total += row["price"] * row["qty"]
+print(total)
+""",
+        "vectorized": SETUP + 'print((df["price"] * df["qty"]).sum())\n',
+    },
+    {
+        "name": "apply_axis1",
+        "code": SETUP
+        + """df["revenue"] = df.apply(lambda r: r["price"] * r["qty"], axis=1)
+print(df["revenue"].sum())
+""",
+        "vectorized": SETUP
+        + """df["revenue"] = df["price"] * df["qty"]
+print(df["revenue"].sum())
+""",
+    },
+    {
+        "name": "row_index_loop",
+        "code": SETUP
+        + """flags = []
+for i in range(len(df)):
+    flags.append(df.iloc[i]["qty"] > 5)
+print(sum(flags))
+""",
+        "vectorized": SETUP + 'print(int((df["qty"] > 5).sum()))\n',
+    },
+    {
+        "name": "append_loop",
+        "code": SETUP
+        + """out = pd.DataFrame()
+for region, group in df.groupby("region"):
+    out = out.append({"region": region, "total": group["qty"].sum()}, ignore_index=True)
+print(out)
+""",
+        "vectorized": SETUP
+        + """out = df.groupby("region", as_index=False).agg(total=("qty", "sum"))
+print(out)
+""",
+    },
+    {
+        "name": "concat_loop",
+        "code": SETUP
+        + """out = pd.DataFrame()
+for start in range(0, len(df), 500):
+    out = pd.concat([out, df.iloc[start:start + 500]])
+print(len(out))
+""",
+        "vectorized": SETUP
+        + """pieces = [df.iloc[start:start + 500] for start in range(0, len(df), 500)]
+print(len(pd.concat(pieces)))
+""",
+    },
+    {
+        "name": "read_csv",
+        "code": SETUP + 'print(df.groupby("region")["qty"].sum())\n',
+        "vectorized": None,
+    },
+]
+
+
+def _write_dataset(files_dir: str, rows: int) -> None:
+    regions = ["north", "south", "east", "west"]
+    with open(os.path.join(files_dir, "sales.csv"), "w", encoding="utf-8") as f:
+        f.write("order_id,region,price,qty,note\n")
+        for index in range(rows):
+            f.write(f"{index},{regions[index % 4]},{(index % 97) * 1.25:.2f},{index % 11},n{index}\n")
+    ingest_file(files_dir, "sales.csv")
+
+
+def _run(tool: CpythonSandboxTool, code: str, rewrite_on: bool, repeat: int) -> tuple[float, str]:
+    # Best-of-N wall time of one tool execution (staging, interpreter start, run).
+    os.environ["CPYTHON_REWRITE"] = "1" if rewrite_on else "0"
+    best = None
+    status = ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = tool.run_batch([{"code": code, "timeout_s": 60}], workers=1)[0]
+        elapsed = (time.perf_counter() - started) * 1000
+        status = str(payload.get("status"))
+        best = elapsed if best is None else min(best, elapsed)
+    return best or 0.0, status
+
+
+def _cell(result: tuple[float, str] | None) -> str:
+    if result is None:
+        return "-"
+    elapsed, status = result
+    return f"{elapsed:8.0f}ms" if status in {"ok", "warning"} else f"{status:>10}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Before/after runtimes of snippet rewrites")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N runs is reported")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    tool = CpythonSandboxTool()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-files-") as files_dir, tempfile.TemporaryDirectory(
+        prefix="bench-data-"
+    ) as data_root:
+        os.environ["CPYTHON_DATA_ROOT"] = data_root
+        _write_dataset(files_dir, args.rows)
+        token = set_session_files_dir(files_dir)
+        try:
+            for case in CASES:
+                # Snippets address files under the data root, like /data in production.
+                code = case["code"].replace("{root}", data_root)
+                vectorized = (case["vectorized"] or "").replace("{root}", data_root)
+                _, applied = rewrite(code, data_root)
+                results.append(
+                    {
+                        "name": case["name"],
+                        "hints": [hint["rule"] for hint in analyze(code, data_root)],
+                        "original": _run(tool, code, False, args.repeat),
+                        "rewritten": _run(tool, code, True, args.repeat) if applied else None,
+                        "vectorized": _run(tool, vectorized, False, args.repeat)
+                        if vectorized
+                        else None,
+                    }
+                )
+        finally:
+            reset_session_files_dir(token)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.rows} rows, best of {args.repeat}; times include interpreter start")
+    print(f"{'case':<16}{'original':>12}{'rewritten':>12}{'vectorized':>12}  hints")
+    for result in results:
+        print(
+            f"{result['name']:<16}{_cell(result['original']):>12}"
+            f"{_cell(result['rewritten']):>12}{_cell(result['vectorized']):>12}  "
+            + ",".join(result["hints"])
+        )
+
+
+if __name__ == "__main__":
+    main()
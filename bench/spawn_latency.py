@@ -0,0 +1,69 @@
+import argparse
+import os
+import statistics
+import subprocess
+import time
+
+import sandbox_spawn
+
+LIMITS = {"cpu": 5, "fsize": 10 * 1024 * 1024, "nofile": 64}
+
+
+def _inflate_rss(megabytes: int) -> bytearray:
+    # Touch every page so the parent's page tables are as large as a busy server's.
+    ballast = bytearray(megabytes * 1024 * 1024)
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+    return ballast
+
+
+def _spawn_legacy(cmd: list[str]) -> None:
+    subprocess.run(
+        cmd,
+        capture_output=True,
+        text=True,
+        check=False,
+        preexec_fn=lambda: sandbox_spawn._set_limits(LIMITS),
+    )
+
+
+def _spawn_helper(cmd: list[str], mode: str) -> None:
+    os.environ["SANDBOX_SPAWN_MODE"] = mode
+    sandbox_spawn.run_limited(
+        cmd, cwd=os.getcwd(), env=dict(os.environ), timeout=10, limits=LIMITS
+    )
+
+
+def _measure(label: str, spawn, iterations: int) -> None:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        spawn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"{label:<22} mean={statistics.fmean(samples):7.2f}ms "
+        f"p50={samples[len(samples) // 2]:7.2f}ms p95={p95:7.2f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sandbox spawn latency microbenchmark")
+    parser.add_argument("--rss-mb", type=int, default=1024, help="Parent RSS ballast in MB")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--cmd", default="true", help="Command to spawn")
+    args = parser.parse_args()
+
+    ballast = _inflate_rss(args.rss_mb)
+    cmd = [args.cmd]
+    print(f"parent rss ballast: {len(ballast) >> 20} MB, {args.iterations} spawns each")
+    _measure("preexec_fn (fork)", lambda: _spawn_legacy(cmd), args.iterations)
+    if sandbox_spawn._prlimit_bin():
+        _measure("prlimit wrapper", lambda: _spawn_helper(cmd, "prlimit"), args.iterations)
+    if hasattr(sandbox_spawn.resource, "prlimit"):
+        _measure("prlimit after spawn", lambda: _spawn_helper(cmd, "post"), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
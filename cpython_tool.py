@@ -1,26 +1,108 @@
+import asyncio
+import contextlib
+import contextvars
 import json
 import os
 import shutil
+import signal
 import subprocess
 import tempfile
 import threading
-
-try:
-    import resource
-except ImportError:  # Windows
-    resource = None
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, Optional
 
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 
-from sandbox_session import get_session_files_dir
+from sandbox_cgroup import sandbox_cgroup
+from sandbox_hints import analyze, rewrite
+from sandbox_scheduler import SchedulerBusy, admit_sandbox
+from sandbox_profile import profile_deadline, profiling_requested, read_summary
+from sandbox_session import checkpointed, get_session_files_dir
+from sandbox_spawn import output_fields, run_limited
+from sandbox_speculate import speculate
+from sandbox_timeouts import forced_timeout, record_run, resolve_timeout, timeout_cap
+from sandbox_trace import span
 
 _CPYTHON_LOCK = threading.Lock()
+_SANDBOX_DATA_HELPER = os.path.join(os.path.dirname(__file__), "sandbox_data.py")
+_SANDBOX_PROFILE_HELPER = os.path.join(os.path.dirname(__file__), "sandbox_profile.py")
+_LOCK_STATS = {"acquired": 0, "waiting": 0, "wait_s_total": 0.0, "wait_s_max": 0.0}
+_LOCK_STATS_GUARD = threading.Lock()
+
+
+def get_lock_stats() -> dict[str, float]:
+    with _LOCK_STATS_GUARD:
+        return dict(_LOCK_STATS)
+
+
+@contextlib.contextmanager
+def _timed_cpython_lock() -> Iterator[None]:
+    with _LOCK_STATS_GUARD:
+        _LOCK_STATS["waiting"] += 1
+    started = time.monotonic()
+    with span("cpython.lock_wait"):
+        _CPYTHON_LOCK.acquire()
+    try:
+        waited = time.monotonic() - started
+        with _LOCK_STATS_GUARD:
+            _LOCK_STATS["waiting"] -= 1
+            _LOCK_STATS["acquired"] += 1
+            _LOCK_STATS["wait_s_total"] += waited
+            _LOCK_STATS["wait_s_max"] = max(_LOCK_STATS["wait_s_max"], waited)
+        yield
+    finally:
+        _CPYTHON_LOCK.release()
+
+
+def _reserve_mb() -> int:
+    # Memory the scheduler books per run: CPYTHON_RESERVE_MB, else the AS cap.
+    try:
+        reserve_mb = int(os.environ.get("CPYTHON_RESERVE_MB", "0"))
+        if reserve_mb <= 0:
+            reserve_mb = int(os.environ.get("CPYTHON_AS_MB", "0"))
+    except ValueError:
+        reserve_mb = 0
+    return reserve_mb if reserve_mb > 0 else 1024
+
+
+def _cgroup_cpus() -> float:
+    try:
+        return float(os.environ.get("CPYTHON_CGROUP_CPUS", "1"))
+    except ValueError:
+        return 1.0
+
+
+def _hints_enabled() -> bool:
+    return os.environ.get("CPYTHON_HINTS", "1").lower() not in {"0", "false", "no"}
+
+
+def _rewrite_enabled() -> bool:
+    return os.environ.get("CPYTHON_REWRITE", "0").lower() in {"1", "true", "yes"}
+
+
+def _batch_workers() -> int:
+    try:
+        workers = int(os.environ.get("CPYTHON_BATCH_WORKERS", "0"))
+    except ValueError:
+        workers = 0
+    return workers if workers > 0 else min(4, os.cpu_count() or 1)
 
 
 class CpythonSandboxInput(BaseModel):
     code: str = Field(..., description="Python code to execute")
-    timeout_s: int = Field(15, ge=1, le=60, description="Wall-clock timeout in seconds")
+    timeout_s: Optional[int] = Field(
+        None,
+        ge=1,
+        le=60,
+        description="Wall-clock timeout in seconds; omit to use the session's adaptive timeout",
+    )
+    profile: bool = Field(
+        False,
+        description="Profile the run and return the top hotspots; use when code is slow or timed out",
+    )
 
 
 class CpythonSandboxTool(BaseTool):
@@ -41,131 +123,316 @@ class CpythonSandboxTool(BaseTool):
             return text, False
         return "...<truncated>...\n" + text[-limit:], True
 
-    def _run(self, code: str, timeout_s: int = 15) -> str:
-        timeout_s = int(os.environ.get("CPYTHON_TIMEOUT_S", str(timeout_s)))
+    def _limits(self, timeout_s: int, cgroup_active: bool) -> dict[str, int]:
+        # CPU seconds
+        limits = {"cpu": timeout_s}
+        # Limit file size
+        try:
+            fsize_mb = int(os.environ.get("CPYTHON_FSIZE_MB", "50"))
+            if fsize_mb > 0:
+                limits["fsize"] = fsize_mb * 1024 * 1024
+        except ValueError:
+            pass
+        # Limit number of open files
+        try:
+            limits["nofile"] = int(os.environ.get("CPYTHON_NOFILE", "64"))
+        except ValueError:
+            pass
+        # memory.max already bounds the run precisely; RLIMIT_AS overcounts.
+        if cgroup_active:
+            return limits
+        # Address space limit (best-effort)
+        try:
+            as_mb = int(os.environ.get("CPYTHON_AS_MB", "0"))
+            if as_mb > 0:
+                limits["as"] = max(256, as_mb) * 1024 * 1024
+        except ValueError:
+            pass
+        return limits
+
+    def _execute(
+        self,
+        tmpdir: str,
+        script_name: str,
+        code: str,
+        timeout_s: Optional[int],
+        python_bin: str,
+        env: dict[str, str],
+        data_root: Optional[str] = None,
+        profile: bool = False,
+    ) -> dict[str, object]:
+        # One snippet against the already staged /data; returns the result payload.
+        # With data_root, oversized output is spilled to /data/outputs. With
+        # profile, the snippet runs under sandbox_profile (copied into tmpdir).
+        # CPYTHON_TIMEOUT_S forces the timeout; otherwise CPYTHON_TIMEOUT_CAP_S
+        # caps it and, without a requested one, it adapts to the session.
+        timeout_s, timeout_source = resolve_timeout(
+            self.name,
+            timeout_s,
+            15,
+            timeout_cap("CPYTHON_TIMEOUT_CAP_S", 60),
+            forced_timeout("CPYTHON_TIMEOUT_S"),
+        )
+        # Static hints for slow pandas/numpy patterns, returned with the result;
+        # CPYTHON_REWRITE=1 also applies the semantics-preserving rewrites.
+        snippet_root = os.environ.get("CPYTHON_DATA_ROOT", "/data")
+        hints = analyze(code, snippet_root) if _hints_enabled() else []
+        source, rewrites = rewrite(code, snippet_root) if _rewrite_enabled() else (code, [])
+        script_path = os.path.join(tmpdir, script_name)
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(source)
+        cmd = [python_bin, script_path]
+        profile_path = None
+        if profile:
+            profile_path = f"{script_path}.profile.json"
+            cmd = [python_bin, os.path.join(tmpdir, "sandbox_profile.py"), script_path, profile_path]
+            env = {**env, "SANDBOX_PROFILE_DEADLINE_S": str(profile_deadline(timeout_s))}
+
+        echo_code = os.environ.get("SANDBOX_ECHO_CODE", "").lower() in {
+            "1",
+            "true",
+            "yes",
+        }
+
+        resources = None
+        completed = None
+        error_payload = None
+        try:
+            # Admission happened in run_batch, before taking the /data lock.
+            with sandbox_cgroup(_reserve_mb(), _cgroup_cpus()) as cgroup:
+                started = time.monotonic()
+                try:
+                    completed = run_limited(
+                        cmd,
+                        cwd=tmpdir,
+                        env=env,
+                        timeout=timeout_s,
+                        limits=self._limits(timeout_s, cgroup is not None),
+                        cgroup_procs=cgroup.procs_path if cgroup is not None else None,
+                        spill_prefix=(
+                            os.path.join(data_root, "outputs", f"run-{uuid.uuid4().hex[:8]}")
+                            if data_root
+                            else None
+                        ),
+                    )
+                except subprocess.TimeoutExpired:
+                    record_run(self.name, time.monotonic() - started, True, timeout_s)
+                    raise
+                finally:
+                    if cgroup is not None:
+                        resources = cgroup.usage()
+                # RLIMIT_CPU (SIGXCPU) is the same timeout, hit on CPU time first.
+                record_run(
+                    self.name,
+                    time.monotonic() - started,
+                    completed.returncode == -signal.SIGXCPU,
+                    timeout_s,
+                )
+        except FileNotFoundError:
+            error_payload = {
+                "status": "error",
+                "exit_code": None,
+                "timed_out": False,
+                "stdout": "",
+                "stderr": "Python runtime not found. Install Python or set CPYTHON_BIN.",
+                "stdout_truncated": False,
+                "stderr_truncated": False,
+            }
+        except subprocess.TimeoutExpired:
+            error_payload = {
+                "status": "timeout",
+                "exit_code": None,
+                "timed_out": True,
+                "stdout": "",
+                "stderr": (
+                    f"Timed out after {timeout_s}s. Pass a larger timeout_s, or omit it "
+                    "to let the session's adaptive timeout grow."
+                ),
+                "stdout_truncated": False,
+                "stderr_truncated": False,
+            }
+
+        summary = read_summary(profile_path) if profile_path else None
+        if error_payload is not None:
+            error_payload["timeout_s"] = timeout_s
+            error_payload["timeout_source"] = timeout_source
+            if hints:
+                error_payload["hints"] = hints
+            if rewrites:
+                error_payload["rewrites"] = rewrites
+            if summary:
+                error_payload["profile"] = summary
+            if resources:
+                error_payload["resources"] = resources
+            if echo_code:
+                error_payload["code"] = code
+            return error_payload
+
+        output = completed.output
+        stdout = completed.stdout.strip()
+        stderr = completed.stderr.strip()
+        if output["killed"]:
+            stderr = f"{stderr}\nOutput limit exceeded; process killed.".strip()
+        stdout, stdout_truncated = self._truncate_head(stdout, 4000)
+        stderr, stderr_truncated = self._truncate_tail(stderr, 4000)
+        status = "ok"
+        if completed.returncode != 0 or output["killed"]:
+            status = "error"
+        elif stderr:
+            status = "warning"
+
+        payload = {
+            "status": status,
+            "exit_code": completed.returncode,
+            "timed_out": False,
+            "stdout": stdout,
+            "stderr": stderr,
+            "stdout_truncated": stdout_truncated or output["stdout_truncated"],
+            "stderr_truncated": stderr_truncated or output["stderr_truncated"],
+        }
+        payload.update(output_fields(output, data_root))
+        payload["timeout_s"] = timeout_s
+        payload["timeout_source"] = timeout_source
+        if hints:
+            payload["hints"] = hints
+        if rewrites:
+            payload["rewrites"] = rewrites
+        if summary:
+            payload["profile"] = summary
+        if resources:
+            payload["resources"] = resources
+        if echo_code:
+            payload["code"] = code
+        if not stdout and not stderr and completed.returncode == 0:
+            payload["stdout"] = "(no output)"
+        return payload
+
+    def run_batch(
+        self,
+        snippets: list[dict],
+        workers: Optional[int] = None,
+        on_result: Optional[Callable[[int, dict], None]] = None,
+    ) -> list[dict]:
+        # Runs [{"code": ..., "timeout_s": ...}, ...] against the session files
+        # staged into /data, up to `workers` sandbox processes at a time. on_result
+        # is called as each snippet finishes; the return value is in input order.
         python_bin = os.environ.get("CPYTHON_BIN", os.environ.get("PYTHON_BIN", "python"))
         session_dir = get_session_files_dir()
         data_root = os.environ.get("CPYTHON_DATA_ROOT", "/data")
+        if workers is None:
+            workers = _batch_workers()
+        workers = max(1, min(workers, len(snippets)))
+        results: list[Optional[dict]] = [None] * len(snippets)
 
         with tempfile.TemporaryDirectory(prefix="cpython-sandbox-") as tmpdir:
-            script_path = os.path.join(tmpdir, "snippet.py")
-            with open(script_path, "w", encoding="utf-8") as f:
-                f.write(code)
-
-            echo_code = os.environ.get("SANDBOX_ECHO_CODE", "").lower() in {
-                "1",
-                "true",
-                "yes",
-            }
+            # Make `from sandbox_data import read_csv` importable next to the snippet.
+            if os.path.exists(_SANDBOX_DATA_HELPER):
+                shutil.copy(_SANDBOX_DATA_HELPER, tmpdir)
+            profiled = [profiling_requested(bool(snippet.get("profile"))) for snippet in snippets]
+            if any(profiled):
+                shutil.copy(_SANDBOX_PROFILE_HELPER, tmpdir)
 
             env = os.environ.copy()
             env["PYTHONUNBUFFERED"] = "1"
 
-            def _limit_resources() -> None:
-                if resource is None:
-                    return
-                # CPU seconds
-                resource.setrlimit(resource.RLIMIT_CPU, (timeout_s, timeout_s))
-                # Limit file size
-                try:
-                    fsize_mb = int(os.environ.get("CPYTHON_FSIZE_MB", "50"))
-                    if fsize_mb > 0:
-                        fsize = fsize_mb * 1024 * 1024
-                        resource.setrlimit(resource.RLIMIT_FSIZE, (fsize, fsize))
-                except Exception:
-                    pass
-                # Limit number of open files
-                try:
-                    nofile = int(os.environ.get("CPYTHON_NOFILE", "64"))
-                    resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, nofile))
-                except Exception:
-                    pass
-                # Address space limit (best-effort)
-                try:
-                    as_mb = int(os.environ.get("CPYTHON_AS_MB", "0"))
-                    if as_mb > 0:
-                        as_bytes = max(256, as_mb) * 1024 * 1024
-                        resource.setrlimit(resource.RLIMIT_AS, (as_bytes, as_bytes))
-                except Exception:
-                    pass
-
-            completed = None
-            error_payload = None
-            with _CPYTHON_LOCK:
-                try:
+            def _job(index: int) -> dict:
+                snippet = snippets[index]
+                script_name = "snippet.py" if len(snippets) == 1 else f"snippet_{index}.py"
+                with span("cpython.snippet", index=index) as current:
+                    payload = self._execute(
+                        tmpdir,
+                        script_name,
+                        str(snippet["code"]),
+                        snippet.get("timeout_s"),
+                        python_bin,
+                        env,
+                        # Spill files only survive when /data is copied back to a session.
+                        data_root if session_dir and os.path.isdir(session_dir) else None,
+                        profiled[index],
+                    )
+                    if current is not None:
+                        current.set_attribute("status", str(payload["status"]))
+                    return payload
+
+            def _finish(index: int, payload: dict) -> None:
+                results[index] = payload
+                if on_result is not None:
+                    on_result(index, payload)
+
+            def _wave(indices: list[int]) -> None:
+                with span("cpython.stage_files"):
                     os.makedirs(data_root, exist_ok=True)
                     self._clear_dir_contents(data_root)
                     if session_dir and os.path.isdir(session_dir):
                         self._copy_tree(session_dir, data_root)
                     os.makedirs(os.path.join(data_root, "outputs"), exist_ok=True)
-
-                    completed = subprocess.run(
-                        [python_bin, script_path],
-                        cwd=tmpdir,
-                        env=env,
-                        text=True,
-                        capture_output=True,
-                        timeout=timeout_s,
-                        check=False,
-                        preexec_fn=_limit_resources if resource is not None else None,
-                    )
-                except FileNotFoundError:
-                    error_payload = {
-                        "status": "error",
-                        "exit_code": None,
-                        "timed_out": False,
-                        "stdout": "",
-                        "stderr": "Python runtime not found. Install Python or set CPYTHON_BIN.",
-                        "stdout_truncated": False,
-                        "stderr_truncated": False,
-                    }
-                except subprocess.TimeoutExpired:
-                    error_payload = {
-                        "status": "timeout",
-                        "exit_code": None,
-                        "timed_out": True,
-                        "stdout": "",
-                        "stderr": "Timed out while executing code.",
-                        "stdout_truncated": False,
-                        "stderr_truncated": False,
-                    }
+                try:
+                    if len(indices) == 1:
+                        _finish(indices[0], _job(indices[0]))
+                        return
+                    with ThreadPoolExecutor(
+                        max_workers=len(indices), thread_name_prefix="cpython-batch"
+                    ) as pool:
+                        # Pool threads do not inherit contextvars (session, trace span).
+                        futures = {
+                            pool.submit(contextvars.copy_context().run, _job, index): index
+                            for index in indices
+                        }
+                        for future in as_completed(futures):
+                            _finish(futures[future], future.result())
                 finally:
-                    if session_dir and os.path.isdir(session_dir):
-                        self._copy_tree(data_root, session_dir)
-                    self._clear_dir_contents(data_root)
+                    with span("cpython.copy_back"):
+                        if session_dir and os.path.isdir(session_dir):
+                            self._copy_tree(data_root, session_dir)
+                        self._clear_dir_contents(data_root)
 
-            if error_payload is not None:
-                if echo_code:
-                    error_payload["code"] = code
-                return json.dumps(error_payload, ensure_ascii=True)
-
-            stdout = completed.stdout.strip()
-            stderr = completed.stderr.strip()
-            stdout, stdout_truncated = self._truncate_head(stdout, 4000)
-            stderr, stderr_truncated = self._truncate_tail(stderr, 4000)
-            status = "ok"
-            if completed.returncode != 0:
-                status = "error"
-            elif stderr:
-                status = "warning"
-
-            payload = {
-                "status": status,
-                "exit_code": completed.returncode,
-                "timed_out": False,
-                "stdout": stdout,
-                "stderr": stderr,
-                "stdout_truncated": stdout_truncated,
-                "stderr_truncated": stderr_truncated,
-            }
-            if echo_code:
-                payload["code"] = code
-            if not stdout and not stderr and completed.returncode == 0:
-                payload["stdout"] = "(no output)"
-            return json.dumps(payload, ensure_ascii=True)
+            # Snippets run in waves of `workers`, each with its own staging of
+            # /data, so the lock is released between waves and other CPython
+            # runs (agent calls, other batches) are not held up by a whole
+            # batch. Capacity is queued for before taking the lock, so a wave
+            # waiting for admission does not block other runs either.
+            for start in range(0, len(snippets), workers):
+                indices = list(range(start, min(start + workers, len(snippets))))
+                try:
+                    with admit_sandbox(_reserve_mb() * len(indices), float(len(indices))):
+                        with _timed_cpython_lock():
+                            _wave(indices)
+                except SchedulerBusy as exc:
+                    for index in indices:
+                        _finish(
+                            index,
+                            {
+                                "status": "error",
+                                "exit_code": None,
+                                "timed_out": False,
+                                "stdout": "",
+                                "stderr": str(exc),
+                                "stdout_truncated": False,
+                                "stderr_truncated": False,
+                            },
+                        )
+
+        return [result or {} for result in results]
+
+    def _run_snippet(self, snippet: dict) -> str:
+        return json.dumps(self.run_batch([snippet], workers=1)[0], ensure_ascii=True)
+
+    def _run(self, code: str, timeout_s: Optional[int] = None, profile: bool = False) -> str:
+        snippet = {"code": code, "timeout_s": timeout_s, "profile": profile}
+
+        def _execute() -> str:
+            if profiling_requested(profile):
+                return self._run_snippet(snippet)
+            # SANDBOX_SPECULATIVE=1 may race the snippet against Pyodide.
+            return speculate(self.name, code, timeout_s, lambda: self._run_snippet(snippet))
+
+        # Replays the recorded result when the agent run is being retried.
+        return checkpointed(self.name, snippet, _execute)
 
-    async def _arun(self, code: str, timeout_s: int = 15) -> str:
-        raise NotImplementedError("CpythonSandboxTool does not support async")
+    async def _arun(
+        self, code: str, timeout_s: Optional[int] = None, profile: bool = False
+    ) -> str:
+        return await asyncio.to_thread(self._run, code, timeout_s, profile)
 
     def _clear_dir_contents(self, root: str) -> None:
         if not os.path.isdir(root):
@@ -189,6 +456,21 @@ class CpythonSandboxTool(BaseTool):
                 src_path = os.path.join(base, name)
                 dest_path = os.path.join(target_dir, name)
                 try:
+                    src_stat = os.stat(src_path)
+                    try:
+                        dest_stat = os.stat(dest_path)
+                    except FileNotFoundError:
+                        dest_stat = None
+                    if dest_stat is not None:
+                        if (
+                            dest_stat.st_size == src_stat.st_size
+                            and dest_stat.st_mtime_ns == src_stat.st_mtime_ns
+                        ):
+                            continue
+                        # Session uploads may be hardlinks into the shared blob
+                        # store; replace the link instead of writing through it.
+                        if dest_stat.st_nlink > 1:
+                            os.remove(dest_path)
                     shutil.copy2(src_path, dest_path)
                 except OSError:
                     continue
@@ -1,11 +1,12 @@
 import argparse
 import asyncio
+import contextlib
 import os
 import re
 from typing import Any, AsyncIterator, Callable, Optional
 
-from sandbox_tool import SandboxedPythonTool
-from cpython_tool import CpythonSandboxTool
+from sandbox_session import ToolCheckpoint, reset_tool_checkpoint, set_tool_checkpoint
+from sandbox_trace import span
 
 SYSTEM_PROMPT = (
     "You are a careful assistant. When the user asks to calculate or to use code, "
@@ -18,8 +19,17 @@ SYSTEM_PROMPT = (
     "with explicit print statements. Keep responses concise and explain results. "
     "If a filename is mentioned, assume it lives in /data and use absolute paths. "
     "If a file is missing, run os.listdir('/data') and retry. "
+    "In cpython_python, load CSV/TSV files from /data with "
+    "`from sandbox_data import read_csv` (pandas-compatible, uses a fast "
+    "columnar cache of uploads). "
     "If you generate plots or images, save them under /data/outputs and mention "
-    "the filenames in your response."
+    "the filenames in your response. "
+    "cpython_python results may include `hints` about slow pandas/numpy patterns; "
+    "apply them when the code is slow. If code is slow or times out, rerun it "
+    "once with profile=true and use the returned hotspots to rewrite the slow part "
+    "(e.g. vectorize row loops) instead of retrying the same code. "
+    "Omit timeout_s unless a job is known to be long; the timeout adapts to past "
+    "runs and grows after a timeout."
 )
 
 
@@ -104,39 +114,83 @@ def _choose_tool_name(text: str) -> str:
     return "sandboxed_python"
 
 
+def _create_llm(streaming: bool):
+    # AGENT_LLM=fake swaps in the scripted local model used for load testing.
+    if os.getenv("AGENT_LLM", "openai").lower() == "fake":
+        from bench.fake_llm import FakeChatModel
+
+        return FakeChatModel(streaming=streaming)
+
+    from langchain_openai import ChatOpenAI
+
+    model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    return ChatOpenAI(model=model_name, temperature=0, streaming=streaming)
+
+
 def _create_agent(streaming: bool):
+    # Tools pull in LangChain; import them here so `import main` stays cheap.
+    from cpython_tool import CpythonSandboxTool
+    from sandbox_tool import SandboxedPythonTool
+
     tools = [SandboxedPythonTool(), CpythonSandboxTool()]
-    model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
     try:
         from langchain.agents import create_agent
-        from langchain_openai import ChatOpenAI
     except Exception:
         create_agent = None
-        ChatOpenAI = None
 
-    if create_agent is not None and ChatOpenAI is not None:
+    if create_agent is not None:
         middleware = []
         try:
-            from langchain.agents.middleware import wrap_model_call
+            from langchain.agents.middleware import AgentMiddleware
 
-            @wrap_model_call
-            def enforce_tool_choice(request, handler):
+            def _forced_request(request):
                 if request.messages:
                     role = _message_role(request.messages[-1])
                     if role in {"human", "user"}:
                         text = _message_text(request.messages[-1])
                         if _should_force_tool(text):
-                            return handler(
-                                request.override(tool_choice=_choose_tool_name(text))
-                            )
-                return handler(request)
+                            return request.override(tool_choice=_choose_tool_name(text))
+                return request
+
+            # Both hooks are needed: the streaming path runs the agent via ainvoke.
+            class EnforceToolChoice(AgentMiddleware):
+                def wrap_model_call(self, request, handler):
+                    return handler(_forced_request(request))
+
+                async def awrap_model_call(self, request, handler):
+                    return await handler(_forced_request(request))
 
-            middleware = [enforce_tool_choice]
+            def _model_name(request) -> str:
+                model = request.model
+                return str(getattr(model, "model_name", None) or type(model).__name__)
+
+            def _tool_name(request) -> str:
+                return str(request.tool_call.get("name", ""))
+
+            # One span per model call and per tool call (tool phases nest below).
+            class TraceCalls(AgentMiddleware):
+                def wrap_model_call(self, request, handler):
+                    with span("llm.call", model=_model_name(request), messages=len(request.messages)):
+                        return handler(request)
+
+                async def awrap_model_call(self, request, handler):
+                    with span("llm.call", model=_model_name(request), messages=len(request.messages)):
+                        return await handler(request)
+
+                def wrap_tool_call(self, request, handler):
+                    with span("tool.call", tool=_tool_name(request)):
+                        return handler(request)
+
+                async def awrap_tool_call(self, request, handler):
+                    with span("tool.call", tool=_tool_name(request)):
+                        return await handler(request)
+
+            middleware = [EnforceToolChoice(), TraceCalls()]
         except Exception:
             middleware = []
 
-        llm = ChatOpenAI(model=model_name, temperature=0, streaming=streaming)
+        llm = _create_llm(streaming)
         agent = create_agent(
             model=llm,
             tools=tools,
@@ -148,9 +202,8 @@ def _create_agent(streaming: bool):
 
     from langchain.agents import AgentExecutor, create_openai_tools_agent
     from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-    from langchain_openai import ChatOpenAI
 
-    llm = ChatOpenAI(model=model_name, temperature=0, streaming=streaming)
+    llm = _create_llm(streaming)
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", SYSTEM_PROMPT),
@@ -218,7 +271,20 @@ def build_agent() -> Callable[[str], str]:
     return run
 
 
-def build_agent_streamer() -> Callable[[str], AsyncIterator[str]]:
+def _replay(run: Callable[[str], str], prompt: str, checkpoint: ToolCheckpoint) -> str:
+    # Re-run the agent with tool calls answered from the checkpoint where possible.
+    checkpoint.rewind()
+    token = set_tool_checkpoint(checkpoint)
+    try:
+        return run(prompt)
+    finally:
+        reset_tool_checkpoint(token)
+
+
+def build_agent_streamer() -> Callable[..., AsyncIterator[str]]:
+    # The returned stream(prompt, checkpoint=None) records every tool result in
+    # the checkpoint; pass the same checkpoint again to retry a run without
+    # re-executing the sandboxes.
     fallback = build_agent()
     try:
         agent, mode = _create_agent(streaming=True)
@@ -228,12 +294,18 @@ def build_agent_streamer() -> Callable[[str], AsyncIterator[str]]:
 
     if agent is None or not hasattr(agent, "ainvoke"):
 
-        async def stream(prompt: str) -> AsyncIterator[str]:
-            yield await asyncio.to_thread(fallback, prompt)
+        async def stream(
+            prompt: str, checkpoint: Optional[ToolCheckpoint] = None
+        ) -> AsyncIterator[str]:
+            checkpoint = checkpoint or ToolCheckpoint()
+            yield await asyncio.to_thread(_replay, fallback, prompt, checkpoint)
 
         return stream
 
-    async def stream(prompt: str) -> AsyncIterator[str]:
+    async def stream(
+        prompt: str, checkpoint: Optional[ToolCheckpoint] = None
+    ) -> AsyncIterator[str]:
+        checkpoint = checkpoint or ToolCheckpoint()
         handler = _create_stream_handler()
         if mode == "messages":
             payload = {"messages": [{"role": "user", "content": prompt}]}
@@ -245,6 +317,9 @@ def build_agent_streamer() -> Callable[[str], AsyncIterator[str]]:
 
         async def _run() -> None:
             nonlocal error
+            # The task runs in its own context copy, so this needs no reset.
+            checkpoint.rewind()
+            set_tool_checkpoint(checkpoint)
             try:
                 await _ainvoke_with_callbacks(agent, payload, handler)
             except Exception as exc:
@@ -258,14 +333,20 @@ def build_agent_streamer() -> Callable[[str], AsyncIterator[str]]:
                 if token:
                     emitted = True
                     yield token
-        finally:
-            await task
+        except BaseException:
+            # The consumer is gone (e.g. a detached run was cancelled): stop the
+            # agent's model and tool calls instead of letting them finish.
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            raise
+        await task
 
         if error is not None:
             if not emitted and isinstance(
                 error, (AttributeError, NotImplementedError, TypeError)
             ):
-                yield await asyncio.to_thread(fallback, prompt)
+                yield await asyncio.to_thread(_replay, fallback, prompt, checkpoint)
             else:
                 raise error
 
@@ -1,18 +1,155 @@
-import { mkdir, readFile, readdir, stat, writeFile } from "node:fs/promises";
+import { closeSync, mkdirSync, openSync, writeSync } from "node:fs";
+import { mkdir, readFile, readdir, rename, rm, stat, writeFile } from "node:fs/promises";
 import path from "node:path";
 import { loadPyodide } from "pyodide";
 
-const scriptPath = process.argv[2];
-const filesDir = process.argv[3];
-if (!scriptPath) {
+// `node pyodide_runner.mjs --make-snapshot [path]` warms an interpreter with
+// PYODIDE_PRELOAD_PACKAGES and writes a memory snapshot instead of running code.
+const makeSnapshot = process.argv[2] === "--make-snapshot";
+const snapshotPath = makeSnapshot
+  ? process.argv[3] || process.env.PYODIDE_SNAPSHOT_PATH
+  : process.env.PYODIDE_SNAPSHOT_PATH;
+const scriptPath = makeSnapshot ? null : process.argv[2];
+const filesDir = makeSnapshot ? null : process.argv[3];
+if (makeSnapshot && !snapshotPath) {
+  console.error("Missing snapshot path.");
+  process.exit(2);
+}
+if (!makeSnapshot && !scriptPath) {
   console.error("Missing script path.");
   process.exit(2);
 }
 
-const code = await readFile(scriptPath, "utf8");
+const code = scriptPath ? await readFile(scriptPath, "utf8") : "";
+
+// Output budgets (see sandbox_spawn.output_budget): keep a capped head and a
+// tail ring per stream, spill oversized streams to
+// <filesDir>/<SANDBOX_OUTPUT_SPILL_PREFIX>.<stream>.txt, and stop the run once
+// both streams together exceed SANDBOX_OUTPUT_MAX_BYTES.
+function budgetFromEnv(name, fallback) {
+  const value = Number.parseInt(process.env[name] || "", 10);
+  return Number.isFinite(value) ? value : fallback;
+}
+const outputBudget = {
+  head: budgetFromEnv("SANDBOX_OUTPUT_HEAD_BYTES", 16 * 1024),
+  tail: budgetFromEnv("SANDBOX_OUTPUT_TAIL_BYTES", 16 * 1024),
+  max: budgetFromEnv("SANDBOX_OUTPUT_MAX_BYTES", 64 * 1024 * 1024),
+  spill: budgetFromEnv("SANDBOX_OUTPUT_SPILL_BYTES", 8 * 1024 * 1024),
+};
+const spillPrefix = process.env.SANDBOX_OUTPUT_SPILL_PREFIX;
+// Profile mode (see sandbox_profile.py): the tool passes the helper's path and
+// where to write the hotspot summary.
+const profileHelper = process.env.SANDBOX_PROFILE_HELPER;
+const profileOutput = process.env.SANDBOX_PROFILE_OUTPUT;
+let outputTotal = 0;
+
+class BoundedOutput {
+  constructor(name) {
+    this.name = name;
+    this.head = [];
+    this.headBytes = 0;
+    this.tail = [];
+    this.tailBytes = 0;
+    this.total = 0;
+    this.spillFd = null;
+    this.spilled = 0;
+    this.spillLimit = filesDir && spillPrefix ? outputBudget.spill : 0;
+  }
+
+  writeSpill(buf) {
+    if (this.spillFd === null || this.spilled >= this.spillLimit) {
+      return;
+    }
+    const part = buf.subarray(0, this.spillLimit - this.spilled);
+    try {
+      writeSync(this.spillFd, part);
+      this.spilled += part.length;
+    } catch {
+      this.spilled = this.spillLimit;
+    }
+  }
+
+  push(text) {
+    let buf = Buffer.from(String(text), "utf8");
+    const size = buf.length;
+    if (
+      this.spillLimit > 0 &&
+      this.spillFd === null &&
+      this.total + buf.length > outputBudget.head + outputBudget.tail
+    ) {
+      try {
+        const spillPath = path.join(filesDir, `${spillPrefix}.${this.name}.txt`);
+        mkdirSync(path.dirname(spillPath), { recursive: true });
+        this.spillFd = openSync(spillPath, "w");
+        // Nothing has been dropped yet: head + tail is the output so far.
+        this.writeSpill(Buffer.concat([...this.head, ...this.tail]));
+      } catch {
+        this.spillLimit = 0;
+      }
+    }
+    this.writeSpill(buf);
+    this.total += buf.length;
+    if (this.headBytes < outputBudget.head) {
+      const room = outputBudget.head - this.headBytes;
+      this.head.push(buf.subarray(0, room));
+      this.headBytes += Math.min(room, buf.length);
+      buf = buf.subarray(room);
+    }
+    if (buf.length > 0 && outputBudget.tail > 0) {
+      this.tail.push(buf);
+      this.tailBytes += buf.length;
+      while (this.tail.length > 1 && this.tailBytes - this.tail[0].length >= outputBudget.tail) {
+        this.tailBytes -= this.tail.shift().length;
+      }
+    }
+    outputTotal += size;
+    if (outputBudget.max > 0 && outputTotal > outputBudget.max) {
+      abortForOutput();
+    }
+  }
+
+  text() {
+    const head = Buffer.concat(this.head).toString("utf8");
+    let tailBuf = Buffer.concat(this.tail);
+    if (tailBuf.length > outputBudget.tail) {
+      tailBuf = tailBuf.subarray(tailBuf.length - outputBudget.tail);
+    }
+    const skipped = this.total - this.headBytes - tailBuf.length;
+    const tail = tailBuf.toString("utf8");
+    return skipped > 0 ? `${head}\n...<${skipped} bytes truncated>...\n${tail}` : head + tail;
+  }
+
+  close() {
+    if (this.spillFd !== null) {
+      closeSync(this.spillFd);
+      this.spillFd = null;
+    }
+  }
+}
+
+function abortForOutput() {
+  flushOutput();
+  process.stderr.write(
+    `\nOutput limit exceeded (${outputBudget.max} bytes); run stopped.\n`
+  );
+  process.exit(3);
+}
 
-const stdoutChunks = [];
-const stderrChunks = [];
+const stdoutBuffer = new BoundedOutput("stdout");
+const stderrBuffer = new BoundedOutput("stderr");
+
+function flushOutput() {
+  stdoutBuffer.close();
+  stderrBuffer.close();
+  const stdout = stdoutBuffer.text();
+  const stderr = stderrBuffer.text();
+  if (stdout) {
+    process.stdout.write(stdout);
+  }
+  if (stderr) {
+    process.stderr.write(stderr);
+  }
+}
 
 const options = {};
 const indexURL = process.env.PYODIDE_INDEX_URL;
@@ -20,9 +157,61 @@ if (indexURL) {
   options.indexURL = indexURL.endsWith("/") ? indexURL : `${indexURL}/`;
 }
 
+const preloadPackages = (process.env.PYODIDE_PRELOAD_PACKAGES || "")
+  .split(",")
+  .map((name) => name.trim())
+  .filter(Boolean)
+  .sort();
+
+async function readSnapshot() {
+  // The sidecar records which packages were preloaded and the snapshot's
+  // size; a snapshot built for a different package set, or one the sidecar
+  // does not describe (e.g. an interrupted build), is ignored.
+  if (!snapshotPath) {
+    return null;
+  }
+  try {
+    const meta = JSON.parse(await readFile(`${snapshotPath}.json`, "utf8"));
+    if (JSON.stringify(meta.packages || []) !== JSON.stringify(preloadPackages)) {
+      return null;
+    }
+    const snapshot = await readFile(snapshotPath);
+    return snapshot.length === meta.size ? snapshot : null;
+  } catch {
+    return null;
+  }
+}
+
+async function loadRuntime() {
+  if (!makeSnapshot) {
+    const snapshot = await readSnapshot();
+    if (snapshot) {
+      try {
+        return await loadPyodide({ ...options, _loadSnapshot: snapshot });
+      } catch {
+        // Fall back to a cold start below.
+      }
+    }
+  }
+  const runtime = await loadPyodide(
+    makeSnapshot ? { ...options, _makeSnapshot: true } : options
+  );
+  if (preloadPackages.length > 0) {
+    const loadErrors = [];
+    await runtime.loadPackage(preloadPackages, {
+      messageCallback: () => {},
+      errorCallback: (msg) => loadErrors.push(msg),
+    });
+    if (loadErrors.length > 0) {
+      throw new Error(`Failed to preload packages: ${loadErrors.join("; ")}`);
+    }
+  }
+  return runtime;
+}
+
 let pyodide;
 try {
-  pyodide = await loadPyodide(options);
+  pyodide = await loadRuntime();
 } catch (err) {
   if (indexURL) {
     console.error(`Failed to load Pyodide from ${options.indexURL}.`);
@@ -33,11 +222,38 @@ try {
   process.exit(1);
 }
 
+if (makeSnapshot) {
+  try {
+    const snapshot = pyodide.makeMemorySnapshot();
+    const tempPath = `${snapshotPath}.${process.pid}.tmp`;
+    const metaTempPath = `${snapshotPath}.json.${process.pid}.tmp`;
+    await mkdir(path.dirname(snapshotPath), { recursive: true });
+    await writeFile(tempPath, snapshot);
+    await writeFile(
+      metaTempPath,
+      JSON.stringify({
+        packages: preloadPackages,
+        version: pyodide.version,
+        size: snapshot.length,
+      })
+    );
+    // Sidecar first, then the snapshot: a crash in between leaves a sidecar
+    // whose size does not match, so the old or missing snapshot is rebuilt.
+    await rename(metaTempPath, `${snapshotPath}.json`);
+    await rename(tempPath, snapshotPath);
+  } catch (err) {
+    console.error(`Failed to write Pyodide snapshot to ${snapshotPath}.`);
+    console.error(err?.stack || String(err));
+    process.exit(1);
+  }
+  process.exit(0);
+}
+
 pyodide.setStdout({
-  batched: (msg) => stdoutChunks.push(msg),
+  batched: (msg) => stdoutBuffer.push(msg),
 });
 pyodide.setStderr({
-  batched: (msg) => stderrChunks.push(msg),
+  batched: (msg) => stderrBuffer.push(msg),
 });
 
 async function ensureDir(dirPath) {
@@ -67,6 +283,10 @@ async function copyTree(srcDir, destDir) {
   for (const entry of entries) {
     const srcPath = path.join(srcDir, entry.name);
     const destPath = path.posix.join(destDir, entry.name);
+    // Columnar upload caches are only readable from the CPython sandbox.
+    if (entry.isDirectory() && srcDir === filesDir && entry.name === ".cache") {
+      continue;
+    }
     if (entry.isDirectory()) {
       await copyTree(srcPath, destPath);
     } else if (entry.isFile()) {
@@ -89,11 +309,60 @@ async function exportTree(srcDir, destDir) {
     } else {
       const data = pyodide.FS.readFile(srcPath);
       await mkdir(path.dirname(destPath), { recursive: true });
+      let existing = null;
+      try {
+        existing = await stat(destPath);
+      } catch {
+        existing = null;
+      }
+      if (existing) {
+        if (existing.size === data.length) {
+          const current = await readFile(destPath);
+          if (Buffer.from(data.buffer, data.byteOffset, data.length).equals(current)) {
+            continue;
+          }
+        }
+        // Session uploads may be hardlinks into the shared blob store; replace
+        // the link instead of writing through it.
+        await rm(destPath, { force: true });
+      }
       await writeFile(destPath, data);
     }
   }
 }
 
+async function runCode() {
+  if (!profileHelper || !profileOutput) {
+    await pyodide.runPythonAsync(code);
+    return;
+  }
+  // Profiled snippets run synchronously, so top-level await is not available.
+  pyodide.FS.mkdirTree("/sandbox");
+  pyodide.FS.writeFile("/sandbox/sandbox_profile.py", await readFile(profileHelper, "utf8"));
+  pyodide.runPython(
+    "import sys\nif '/sandbox' not in sys.path:\n    sys.path.append('/sandbox')"
+  );
+  const sandboxProfile = pyodide.pyimport("sandbox_profile");
+  const top = Number.parseInt(process.env.SANDBOX_PROFILE_TOP || "", 10) || 12;
+  try {
+    sandboxProfile.profile_source(
+      code,
+      "snippet.py",
+      "/sandbox/profile.json",
+      0,
+      pyodide.globals,
+      top
+    );
+  } finally {
+    try {
+      await writeFile(profileOutput, pyodide.FS.readFile("/sandbox/profile.json"));
+    } catch {
+      // The profiler failed before writing a summary; the run's error is reported.
+    }
+    sandboxProfile.destroy();
+  }
+}
+
 try {
   await ensureDir("/data");
   await ensureDir("/data/outputs");
@@ -112,36 +381,26 @@ try {
           detail = String(err);
         }
       }
-      stderrChunks.push(
+      stderrBuffer.push(
         `Failed to load session files from ${filesDir}: ${detail}`
       );
     }
   }
-  await pyodide.runPythonAsync(code);
+  await runCode();
   if (filesDir) {
     try {
       await exportTree("/data", filesDir);
     } catch (err) {
       const detail = err?.stack || err?.message || String(err);
-      stderrChunks.push(
+      stderrBuffer.push(
         `Failed to export session files to ${filesDir}: ${detail}`
       );
     }
   }
 } catch (err) {
-  stderrChunks.push(err?.stack || String(err));
-  const stderr = stderrChunks.join("");
-  if (stderr) {
-    process.stderr.write(stderr);
-  }
+  stderrBuffer.push(err?.stack || String(err));
+  flushOutput();
   process.exit(1);
 }
 
-const stdout = stdoutChunks.join("");
-const stderr = stderrChunks.join("");
-if (stdout) {
-  process.stdout.write(stdout);
-}
-if (stderr) {
-  process.stderr.write(stderr);
-}
+flushOutput();
@@ -0,0 +1,127 @@
+import contextlib
+import os
+import time
+import uuid
+from typing import Iterator, Optional
+
+CGROUP_CONTROLLERS = ("memory", "cpu", "pids")
+CPU_PERIOD_US = 100000
+CPU_STAT_FIELDS = {"usage_usec", "user_usec", "system_usec", "nr_throttled"}
+
+
+def _cgroup_root() -> Optional[str]:
+    root = os.environ.get("SANDBOX_CGROUP_ROOT", "").strip()
+    if not root:
+        return None
+    if not os.path.exists(os.path.join(root, "cgroup.controllers")):
+        return None
+    return root
+
+
+def cgroup_enabled() -> bool:
+    return _cgroup_root() is not None
+
+
+def _write(path: str, value: str) -> bool:
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(value)
+        return True
+    except OSError:
+        return False
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _enable_controllers(root: str) -> None:
+    available = (_read(os.path.join(root, "cgroup.controllers")) or "").split()
+    enabled = (_read(os.path.join(root, "cgroup.subtree_control")) or "").split()
+    missing = [name for name in CGROUP_CONTROLLERS if name in available and name not in enabled]
+    if missing:
+        _write(
+            os.path.join(root, "cgroup.subtree_control"),
+            " ".join(f"+{name}" for name in missing),
+        )
+
+
+class SandboxCgroup:
+    # One transient cgroup v2 directory per sandbox run. The child joins it
+    # through sandbox_spawn's exec wrapper; limits and accounting come from the
+    # cgroup interface files.
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.procs_path = os.path.join(path, "cgroup.procs")
+
+    def apply_limits(self, memory_mb: int, cpus: float, pids: int) -> None:
+        if memory_mb > 0:
+            _write(os.path.join(self.path, "memory.max"), str(memory_mb * 1024 * 1024))
+            _write(os.path.join(self.path, "memory.swap.max"), "0")
+        if cpus > 0:
+            quota = max(1000, int(cpus * CPU_PERIOD_US))
+            _write(os.path.join(self.path, "cpu.max"), f"{quota} {CPU_PERIOD_US}")
+        if pids > 0:
+            _write(os.path.join(self.path, "pids.max"), str(pids))
+
+    def usage(self) -> dict[str, object]:
+        usage: dict[str, object] = {}
+        peak = _read(os.path.join(self.path, "memory.peak"))
+        if peak is None:
+            peak = _read(os.path.join(self.path, "memory.current"))
+        if peak and peak.isdigit():
+            usage["memory_peak_bytes"] = int(peak)
+        for line in (_read(os.path.join(self.path, "cpu.stat")) or "").splitlines():
+            name, _, value = line.partition(" ")
+            if name in CPU_STAT_FIELDS and value.isdigit():
+                usage[f"cpu_{name}"] = int(value)
+        for line in (_read(os.path.join(self.path, "memory.events")) or "").splitlines():
+            name, _, value = line.partition(" ")
+            if name == "oom_kill" and value.isdigit():
+                usage["oom_killed"] = int(value) > 0
+        pids_peak = _read(os.path.join(self.path, "pids.peak"))
+        if pids_peak and pids_peak.isdigit():
+            usage["pids_peak"] = int(pids_peak)
+        return usage
+
+    def destroy(self) -> None:
+        # cgroup.kill (5.14+) reaps stragglers such as orphaned grandchildren.
+        _write(os.path.join(self.path, "cgroup.kill"), "1")
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)
+
+
+@contextlib.contextmanager
+def sandbox_cgroup(memory_mb: int, cpus: float = 1.0) -> Iterator[Optional[SandboxCgroup]]:
+    root = _cgroup_root()
+    if root is None:
+        yield None
+        return
+    _enable_controllers(root)
+    path = os.path.join(root, f"run-{uuid.uuid4().hex[:12]}")
+    try:
+        os.mkdir(path)
+    except OSError:
+        yield None
+        return
+    cgroup = SandboxCgroup(path)
+    try:
+        pids = int(os.environ.get("SANDBOX_CGROUP_PIDS", "128"))
+    except ValueError:
+        pids = 128
+    cgroup.apply_limits(memory_mb, cpus, pids)
+    try:
+        yield cgroup
+    finally:
+        cgroup.destroy()
@@ -0,0 +1,92 @@
+import json
+import os
+
+DATA_ROOT = os.environ.get("CPYTHON_DATA_ROOT", "/data")
+CACHE_DIRNAME = ".cache"
+
+
+def _cached_feather(path: str):
+    abs_path = os.path.abspath(path)
+    root = os.path.abspath(DATA_ROOT)
+    if not abs_path.startswith(root + os.sep):
+        return None
+    rel = os.path.relpath(abs_path, root)
+    base = os.path.join(root, CACHE_DIRNAME, rel)
+    try:
+        with open(f"{base}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        stats = os.stat(abs_path)
+    except (OSError, ValueError):
+        return None
+    if meta.get("size") != stats.st_size or meta.get("mtime_ns") != stats.st_mtime_ns:
+        return None
+    feather_path = f"{base}.feather"
+    return feather_path if os.path.exists(feather_path) else None
+
+
+def _like_read_csv(table):
+    # Arrow round-trips differ from pd.read_csv in two ways: missing values in
+    # object columns come back as None instead of NaN, and string columns
+    # follow pyarrow's choice of dtype instead of pandas' future.infer_string.
+    import pandas as pd
+    import pyarrow as pa
+
+    infer_string = pd.get_option("future.infer_string")
+    frame = table.to_pandas(ignore_metadata=True)
+    for index, field in enumerate(table.schema):
+        column = frame.iloc[:, index]
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            column = column.astype("str" if infer_string else object)
+        if column.dtype == object:
+            column = column.where(column.notna(), float("nan"))
+        frame.isetitem(index, column)
+    return frame
+
+
+def read_csv(path, **kwargs):
+    # Extra keyword arguments bypass the upload cache and go straight to pandas.
+    import pandas as pd
+
+    cached = None if kwargs else _cached_feather(str(path))
+    if cached is not None:
+        try:
+            import pyarrow.feather as feather
+
+            # Read into memory: frames built on a memory map (or split blocks)
+            # are read-only, so .loc assignment fails.
+            return _like_read_csv(feather.read_table(cached, memory_map=False))
+        except Exception:
+            pass
+    if not kwargs and str(path).lower().endswith(".tsv"):
+        kwargs["sep"] = "\t"
+    return pd.read_csv(path, **kwargs)
+
+
+def append_frame(frame, other, ignore_index=False, verify_integrity=False, sort=False):
+    # DataFrame.append (removed in pandas 2.0) on top of pd.concat, with the
+    # old semantics; the CPython tool rewrites frame.append(...) calls to this.
+    import pandas as pd
+
+    if isinstance(frame, pd.Series):
+        pieces = [frame, *other] if isinstance(other, (list, tuple)) else [frame, other]
+        return pd.concat(pieces, ignore_index=ignore_index, verify_integrity=verify_integrity)
+    if isinstance(other, (pd.Series, dict)):
+        if isinstance(other, dict):
+            if not ignore_index:
+                raise TypeError("Can only append a dict if ignore_index=True")
+            other = pd.Series(other)
+        if other.name is None and not ignore_index:
+            raise TypeError(
+                "Can only append a Series if ignore_index=True or if the Series has a name"
+            )
+        index = pd.Index([other.name], name=frame.index.name)
+        other = other.to_frame().T.infer_objects().set_axis(index)
+    elif isinstance(other, list):
+        if other and not isinstance(other[0], pd.DataFrame):
+            other = pd.DataFrame(other)
+            if frame.index.name is not None and not ignore_index:
+                other.index.name = frame.index.name
+    pieces = [frame, *other] if isinstance(other, (list, tuple)) else [frame, other]
+    return pd.concat(
+        pieces, ignore_index=ignore_index, verify_integrity=verify_integrity, sort=sort
+    )
@@ -0,0 +1,263 @@
+import ast
+from typing import Optional
+
+# Static pre-execution checks for slow pandas/numpy patterns in generated
+# snippets. analyze() returns hints for the agent ({"rule", "line", "message"});
+# rewrite() additionally applies the few rewrites that keep semantics
+# (CPYTHON_REWRITE=1). Rewrites are byte-range edits of the original source,
+# so line numbers in tracebacks still match the agent's code.
+
+_SANDBOX_DATA = '__import__("sandbox_data")'
+_ROW_INDEXERS = {"iloc", "loc", "at", "iat"}
+_NP_GROWERS = {"append", "concatenate", "vstack", "hstack", "row_stack"}
+_APPEND_KEYWORDS = {"ignore_index", "verify_integrity", "sort"}
+
+_MESSAGES = {
+    "iterrows": (
+        "DataFrame.iterrows() builds a Series per row. Use vectorized column "
+        "expressions (df['a'] * df['b']), groupby/agg, or .to_numpy(); if a loop "
+        "is unavoidable, itertuples() is much faster."
+    ),
+    "apply_axis1": (
+        "apply(axis=1) calls Python once per row. Prefer column expressions, "
+        "np.where/np.select for conditionals, or .map on a single column."
+    ),
+    "row_index_loop": (
+        "Looping over range(len(df)) with .iloc/.loc/.at per row is slow. "
+        "Operate on whole columns instead."
+    ),
+    "frame_append": (
+        "DataFrame.append was removed in pandas 2.0 and copies the frame on every "
+        "call. Collect rows in a list and build the frame once with pd.DataFrame "
+        "or pd.concat."
+    ),
+    "concat_in_loop": (
+        "pd.concat inside a loop copies the growing frame each iteration. Collect "
+        "the pieces in a list and concat once after the loop."
+    ),
+    "np_grow_in_loop": (
+        "Growing a numpy array inside a loop reallocates it every iteration. "
+        "Preallocate with np.empty/np.zeros or collect in a list and convert once."
+    ),
+    "read_csv": (
+        "Use `from sandbox_data import read_csv` for files in /data; it loads the "
+        "cached columnar copy of uploads."
+    ),
+}
+
+
+def _imported_aliases(tree: ast.AST, module: str, default: str) -> set[str]:
+    aliases = {default}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == module:
+                    aliases.add(alias.asname or alias.name)
+    return aliases
+
+
+def _is_module_call(node: ast.Call, aliases: set[str], names: set[str]) -> bool:
+    func = node.func
+    return (
+        isinstance(func, ast.Attribute)
+        and func.attr in names
+        and isinstance(func.value, ast.Name)
+        and func.value.id in aliases
+    )
+
+
+def _is_range_len(node: ast.AST) -> bool:
+    # range(len(x)) or range(x.shape[0])
+    if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+        return False
+    if node.func.id != "range" or len(node.args) != 1:
+        return False
+    arg = node.args[0]
+    if isinstance(arg, ast.Call) and isinstance(arg.func, ast.Name) and arg.func.id == "len":
+        return True
+    return (
+        isinstance(arg, ast.Subscript)
+        and isinstance(arg.value, ast.Attribute)
+        and arg.value.attr == "shape"
+    )
+
+
+def _has_row_indexing(nodes: list[ast.stmt]) -> bool:
+    for statement in nodes:
+        for node in ast.walk(statement):
+            if (
+                isinstance(node, ast.Subscript)
+                and isinstance(node.value, ast.Attribute)
+                and node.value.attr in _ROW_INDEXERS
+            ):
+                return True
+    return False
+
+
+def _is_data_path(node: ast.Call, data_root: str) -> bool:
+    if node.keywords or len(node.args) != 1:
+        return False
+    arg = node.args[0]
+    return isinstance(arg, ast.Constant) and str(arg.value).startswith(data_root.rstrip("/") + "/")
+
+
+class _Analyzer(ast.NodeVisitor):
+    def __init__(self, pandas_aliases: set[str], numpy_aliases: set[str], data_root: str) -> None:
+        self.pandas_aliases = pandas_aliases
+        self.numpy_aliases = numpy_aliases
+        self.data_root = data_root
+        self.loop_depth = 0
+        # (rule, node) in source order; rewrite() picks the rewritable ones.
+        self.findings: list[tuple[str, ast.AST]] = []
+
+    def _loop(self, node: ast.AST) -> None:
+        self.loop_depth += 1
+        self.generic_visit(node)
+        self.loop_depth -= 1
+
+    def visit_For(self, node: ast.For) -> None:
+        if _is_range_len(node.iter) and _has_row_indexing(node.body):
+            self.findings.append(("row_index_loop", node))
+        self._loop(node)
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node: ast.While) -> None:
+        self._loop(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        # A loop around a function definition does not run its body repeatedly.
+        depth, self.loop_depth = self.loop_depth, 0
+        self.generic_visit(node)
+        self.loop_depth = depth
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        if isinstance(func, ast.Attribute):
+            keywords = {keyword.arg for keyword in node.keywords}
+            if func.attr == "iterrows" and not node.args:
+                self.findings.append(("iterrows", node))
+            elif func.attr == "apply" and any(
+                keyword.arg == "axis"
+                and isinstance(keyword.value, ast.Constant)
+                and keyword.value.value in (1, "columns")
+                for keyword in node.keywords
+            ):
+                self.findings.append(("apply_axis1", node))
+            elif func.attr == "append" and keywords & _APPEND_KEYWORDS:
+                # list.append takes no keywords, so this is DataFrame/Series.append.
+                self.findings.append(("frame_append", node))
+            elif self.loop_depth and _is_module_call(node, self.pandas_aliases, {"concat"}):
+                self.findings.append(("concat_in_loop", node))
+            elif self.loop_depth and _is_module_call(node, self.numpy_aliases, _NP_GROWERS):
+                self.findings.append(("np_grow_in_loop", node))
+            elif _is_module_call(node, self.pandas_aliases, {"read_csv"}) and _is_data_path(
+                node, self.data_root
+            ):
+                self.findings.append(("read_csv", node))
+        self.generic_visit(node)
+
+
+def _findings(code: str, data_root: str) -> list[tuple[str, ast.AST]]:
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+    analyzer = _Analyzer(
+        _imported_aliases(tree, "pandas", "pd"),
+        _imported_aliases(tree, "numpy", "np"),
+        data_root,
+    )
+    analyzer.visit(tree)
+    return analyzer.findings
+
+
+def analyze(code: str, data_root: str = "/data") -> list[dict[str, object]]:
+    hints = []
+    seen = set()
+    for rule, node in _findings(code, data_root):
+        line = getattr(node, "lineno", 0)
+        if (rule, line) in seen:
+            continue
+        seen.add((rule, line))
+        hints.append({"rule": rule, "line": line, "message": _MESSAGES[rule]})
+    return hints
+
+
+def _offsets(code: bytes) -> list[int]:
+    starts = [0]
+    for index, byte in enumerate(code):
+        if byte == 0x0A:
+            starts.append(index + 1)
+    return starts
+
+
+def _span(node: ast.AST, starts: list[int]) -> tuple[int, int]:
+    # Byte range of a node (AST column offsets are UTF-8 byte offsets).
+    return (
+        starts[node.lineno - 1] + node.col_offset,
+        starts[node.end_lineno - 1] + node.end_col_offset,
+    )
+
+
+def _edit_for(
+    rule: str, node: ast.Call, source: bytes, starts: list[int]
+) -> Optional[tuple[int, int, bytes]]:
+    # Returns (start, end, replacement) over the UTF-8 source, or None.
+    func = node.func
+    if not isinstance(func, ast.Attribute) or func.end_lineno is None:
+        return None
+    start, end = _span(func, starts)
+    if rule == "read_csv":
+        # sandbox_data.read_csv reads .tsv with sep="\t"; pd.read_csv does not.
+        if str(node.args[0].value).lower().endswith(".tsv"):
+            return None
+        return start, end, f"{_SANDBOX_DATA}.read_csv".encode("utf-8")
+    if rule == "frame_append" and func.value.lineno == func.value.end_lineno:
+        receiver_start, receiver_end = _span(func.value, starts)
+        paren = source.find(b"(", end)
+        if paren < 0 or source[end:paren].strip():
+            return None
+        separator = b", " if node.args or node.keywords else b""
+        replacement = f"{_SANDBOX_DATA}.append_frame(".encode("utf-8")
+        return start, paren + 1, replacement + source[receiver_start:receiver_end] + separator
+    return None
+
+
+def rewrite(code: str, data_root: str = "/data") -> tuple[str, list[dict[str, object]]]:
+    # Applies the semantics-preserving rewrites; returns (code, applied).
+    findings = [
+        (rule, node)
+        for rule, node in _findings(code, data_root)
+        if rule in {"read_csv", "frame_append"}
+    ]
+    if not findings:
+        return code, []
+    source = code.encode("utf-8")
+    starts = _offsets(source)
+    edits = []
+    for rule, node in findings:
+        edit = _edit_for(rule, node, source, starts)
+        if edit is not None:
+            edits.append((edit, rule, node.lineno))
+    edits.sort(key=lambda item: (item[0][0], -item[0][1]))
+    applied = []
+    kept = []
+    last_end = -1
+    for (start, end, replacement), rule, line in edits:
+        if start < last_end:
+            # Nested match (e.g. a rewritten call inside another); keep the outer one.
+            continue
+        kept.append((start, end, replacement))
+        applied.append({"rule": rule, "line": line})
+        last_end = end
+    for start, end, replacement in reversed(kept):
+        source = source[:start] + replacement + source[end:]
+    rewritten = source.decode("utf-8")
+    try:
+        ast.parse(rewritten)
+    except SyntaxError:
+        return code, []
+    return rewritten, applied
@@ -0,0 +1,142 @@
+import json
+import os
+import pstats
+import signal
+import sys
+import time
+import traceback
+from typing import Optional
+
+try:
+    import cProfile as _profiler_module
+except ImportError:  # interpreters without _lsprof
+    import profile as _profiler_module
+
+# Runs a snippet under a deterministic profiler inside the sandbox and writes a
+# top-N hotspot summary as JSON. CPython runs
+# `python sandbox_profile.py snippet.py out.json`; the Pyodide runner calls
+# profile_source() directly. With a deadline, an interim summary is written
+# shortly before the timeout, so a killed run still reports where it was slow.
+
+PROFILE_TOP = int(os.environ.get("SANDBOX_PROFILE_TOP", "12"))
+
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages" + os.sep, "dist-packages" + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    prefix = os.path.dirname(os.__file__) + os.sep
+    if filename.startswith(prefix):
+        return filename[len(prefix) :]
+    return os.path.basename(filename)
+
+
+def summarize(profiler, elapsed_s: float, complete: bool, top: int = PROFILE_TOP) -> dict:
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, self_s, cum_s, _) in stats.stats.items():
+        if filename == __file__ or name == "<method 'disable' of '_lsprof.Profiler' objects>":
+            continue
+        if filename == "~":
+            label = name
+        else:
+            label = f"{_short_path(filename)}:{line}({name})"
+        rows.append((self_s, cum_s, calls, label))
+    rows.sort(reverse=True)
+    return {
+        "complete": complete,
+        "elapsed_s": round(elapsed_s, 4),
+        "profiled_s": round(stats.total_tt, 4),
+        "hotspots": [
+            {"function": label, "calls": calls, "self_s": round(self_s, 4), "cum_s": round(cum_s, 4)}
+            for self_s, cum_s, calls, label in rows[: max(1, top)]
+        ],
+    }
+
+
+def _write(path: str, summary: dict) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    os.replace(temp_path, path)
+
+
+def profile_source(
+    source: str,
+    filename: str,
+    out_path: str,
+    deadline_s: float = 0.0,
+    namespace: Optional[dict] = None,
+    top: int = PROFILE_TOP,
+) -> None:
+    code = compile(source, filename, "exec")
+    if namespace is None:
+        namespace = {"__name__": "__main__", "__file__": filename}
+    profiler = _profiler_module.Profile()
+    started = time.perf_counter()
+    timer = deadline_s > 0 and hasattr(signal, "setitimer")
+    if timer:
+
+        def _snapshot(signum, frame) -> None:
+            profiler.disable()
+            try:
+                _write(out_path, summarize(profiler, time.perf_counter() - started, False, top))
+            finally:
+                profiler.enable()
+
+        signal.signal(signal.SIGALRM, _snapshot)
+        signal.setitimer(signal.ITIMER_REAL, deadline_s)
+    profiler.enable()
+    try:
+        exec(code, namespace)
+    finally:
+        profiler.disable()
+        if timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        _write(out_path, summarize(profiler, time.perf_counter() - started, True, top))
+
+
+def profiling_requested(requested: bool = False) -> bool:
+    # SANDBOX_PROFILE=1 profiles every run; otherwise only runs that ask for it.
+    return requested or os.environ.get("SANDBOX_PROFILE", "").lower() in {"1", "true", "yes"}
+
+
+def profile_deadline(timeout_s: float) -> float:
+    # When to write the interim summary: a second before the timeout, at most
+    # halfway through.
+    return max(timeout_s - 1.0, timeout_s / 2)
+
+
+def read_summary(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return summary if isinstance(summary, dict) else None
+
+
+def main(argv: list[str]) -> None:
+    script_path, out_path = argv[1], argv[2]
+    with open(script_path, "r", encoding="utf-8") as f:
+        source = f.read()
+    sys.argv = [script_path]
+    try:
+        deadline_s = float(os.environ.get("SANDBOX_PROFILE_DEADLINE_S", "0"))
+    except ValueError:
+        deadline_s = 0.0
+    try:
+        profile_source(source, script_path, out_path, deadline_s)
+    except SystemExit:
+        raise
+    except BaseException as exc:
+        # Report the snippet's traceback without this wrapper's frames.
+        tb = exc.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename == __file__:
+            tb = tb.tb_next
+        traceback.print_exception(type(exc), exc, tb)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,237 @@
+import contextlib
+import itertools
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+from sandbox_session import get_session_files_dir
+from sandbox_trace import span
+
+MB = 1024 * 1024
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path: str) -> Optional[int]:
+    text = _read_text(path)
+    if text is None or not text.isdigit():
+        return None
+    return int(text)
+
+
+def read_meminfo() -> dict[str, int]:
+    values: dict[str, int] = {}
+    text = _read_text("/proc/meminfo") or ""
+    for line in text.splitlines():
+        name, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts and parts[0].isdigit():
+            values[name] = int(parts[0]) * 1024
+    return values
+
+
+def read_cgroup_memory() -> tuple[Optional[int], Optional[int]]:
+    # cgroup v2 first, then v1. Returns (limit, current usage) in bytes.
+    limit = _read_int("/sys/fs/cgroup/memory.max")
+    if limit is not None or _read_text("/sys/fs/cgroup/memory.max") == "max":
+        return limit, _read_int("/sys/fs/cgroup/memory.current")
+    limit = _read_int("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if limit is not None and limit >= 1 << 60:
+        limit = None
+    return limit, _read_int("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+
+
+def read_cpu_capacity() -> float:
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        cpus = float(os.cpu_count() or 1)
+    quota_text = _read_text("/sys/fs/cgroup/cpu.max")
+    if quota_text:
+        quota, _, period = quota_text.partition(" ")
+        if quota.isdigit() and period.isdigit() and int(period) > 0:
+            cpus = min(cpus, int(quota) / int(period))
+    else:
+        quota = _read_text("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_int("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota and quota.isdigit() and period:
+            cpus = min(cpus, int(quota) / period)
+    return max(1.0, cpus)
+
+
+def available_memory() -> int:
+    meminfo = read_meminfo()
+    available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+    limit, current = read_cgroup_memory()
+    if limit is not None and current is not None:
+        available = min(available, max(0, limit - current)) if available else limit - current
+    return max(0, available)
+
+
+def total_memory() -> int:
+    total = read_meminfo().get("MemTotal", 0)
+    limit, _ = read_cgroup_memory()
+    if limit is not None:
+        total = min(total, limit) if total else limit
+    return total
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self, seq: int, session: str, memory: int, cpus: float) -> None:
+        self.seq = seq
+        self.session = session
+        self.memory = memory
+        self.cpus = cpus
+
+
+class SandboxScheduler:
+    def __init__(
+        self,
+        memory_capacity: Optional[int] = None,
+        cpu_capacity: Optional[float] = None,
+        headroom: float = 0.8,
+        queue_timeout_s: float = 30.0,
+    ) -> None:
+        self.memory_capacity = int((memory_capacity or total_memory() or 1024 * MB) * headroom)
+        self.cpu_capacity = cpu_capacity or read_cpu_capacity()
+        self.queue_timeout_s = queue_timeout_s
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: list[_Waiter] = []
+        self._running: dict[str, int] = {}
+        self._reserved_memory = 0
+        self._reserved_cpus = 0.0
+        self._in_flight = 0
+        self._stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "wait_s_total": 0.0,
+            "wait_s_max": 0.0,
+        }
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        # Sessions with fewer runs in flight go first; FIFO within a tie.
+        if not self._waiting:
+            return None
+        return min(self._waiting, key=lambda w: (self._running.get(w.session, 0), w.seq))
+
+    def _fits(self, waiter: _Waiter) -> bool:
+        if self._in_flight == 0:
+            return True
+        if self._reserved_memory + waiter.memory > self.memory_capacity:
+            return False
+        if self._reserved_cpus + waiter.cpus > self.cpu_capacity:
+            return False
+        return available_memory() >= waiter.memory
+
+    @contextlib.contextmanager
+    def admit(self, memory: int, cpus: float = 1.0, session: str = "") -> Iterator[float]:
+        waiter = _Waiter(next(self._seq), session, memory, cpus)
+        started = time.monotonic()
+        deadline = started + self.queue_timeout_s
+        with self._cond:
+            self._waiting.append(waiter)
+            while not (self._next_waiter() is waiter and self._fits(waiter)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(waiter)
+                    self._stats["rejected"] += 1
+                    self._cond.notify_all()
+                    raise SchedulerBusy("Sandbox capacity is busy. Please retry shortly.")
+                # Re-check periodically: host memory can free up without a release.
+                self._cond.wait(timeout=min(remaining, 0.5))
+            self._waiting.remove(waiter)
+            waited = time.monotonic() - started
+            self._reserved_memory += memory
+            self._reserved_cpus += cpus
+            self._in_flight += 1
+            self._running[session] = self._running.get(session, 0) + 1
+            self._stats["admitted"] += 1
+            self._stats["wait_s_total"] += waited
+            self._stats["wait_s_max"] = max(self._stats["wait_s_max"], waited)
+            self._cond.notify_all()
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._reserved_memory -= memory
+                self._reserved_cpus -= cpus
+                self._in_flight -= 1
+                self._running[session] -= 1
+                if not self._running[session]:
+                    del self._running[session]
+                self._cond.notify_all()
+
+    def stats(self) -> dict[str, float]:
+        with self._cond:
+            payload = dict(self._stats)
+            payload.update(
+                {
+                    "queue_depth": len(self._waiting),
+                    "in_flight": self._in_flight,
+                    "reserved_memory_bytes": self._reserved_memory,
+                    "reserved_cpus": self._reserved_cpus,
+                    "memory_capacity_bytes": self.memory_capacity,
+                    "cpu_capacity": self.cpu_capacity,
+                    "available_memory_bytes": available_memory(),
+                }
+            )
+        admitted = payload["admitted"]
+        payload["wait_s_mean"] = payload["wait_s_total"] / admitted if admitted else 0.0
+        return payload
+
+
+_scheduler: Optional[SandboxScheduler] = None
+_scheduler_guard = threading.Lock()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def get_scheduler() -> SandboxScheduler:
+    global _scheduler
+    with _scheduler_guard:
+        if _scheduler is None:
+            capacity_mb = _env_float("SANDBOX_CAPACITY_MB", 0)
+            capacity_cpus = _env_float("SANDBOX_CAPACITY_CPUS", 0)
+            _scheduler = SandboxScheduler(
+                memory_capacity=int(capacity_mb * MB) or None,
+                cpu_capacity=capacity_cpus or None,
+                headroom=_env_float("SANDBOX_MEMORY_HEADROOM", 0.8),
+                queue_timeout_s=_env_float("SANDBOX_QUEUE_TIMEOUT_S", 30.0),
+            )
+        return _scheduler
+
+
+def scheduler_enabled() -> bool:
+    return os.environ.get("SANDBOX_SCHEDULER", "1").lower() not in {"0", "false", "no"}
+
+
+@contextlib.contextmanager
+def admit_sandbox(memory_mb: int, cpus: float = 1.0) -> Iterator[float]:
+    if not scheduler_enabled():
+        yield 0.0
+        return
+    session = get_session_files_dir() or ""
+    with contextlib.ExitStack() as stack:
+        # The span covers only the queueing, not the admitted run.
+        with span("sandbox.queue", memory_mb=memory_mb, cpus=cpus):
+            waited = stack.enter_context(
+                get_scheduler().admit(max(1, memory_mb) * MB, cpus, session)
+            )
+        yield waited
@@ -1,5 +1,10 @@
 import contextvars
-from typing import Optional
+import json
+import threading
+from typing import Callable, Optional
+
+# The tools' async entry points run in asyncio.to_thread, which copies the
+# current context, so these variables reach the sandbox code unchanged.
 
 _session_files_dir: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
     "sandbox_session_files_dir", default=None
@@ -16,3 +21,120 @@ def reset_session_files_dir(token: contextvars.Token) -> None:
 
 def get_session_files_dir() -> Optional[str]:
     return _session_files_dir.get()
+
+
+class ToolCheckpoint:
+    # Tool results of one agent run. A retry of the same run (streaming
+    # fallback, client reconnect) rewinds and replays the recorded results
+    # instead of executing the sandboxes again. The n-th call with given
+    # arguments maps to the n-th recorded result, so deliberate reruns of the
+    # same code within a run still line up.
+
+    def __init__(self) -> None:
+        self._results: dict[tuple[str, int], str] = {}
+        self._cursor: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.replayed = 0
+
+    def rewind(self) -> None:
+        with self._lock:
+            self._cursor.clear()
+
+    def run(self, tool: str, args: dict, execute: Callable[[], str]) -> str:
+        key = json.dumps([tool, args], sort_keys=True, ensure_ascii=True)
+        with self._lock:
+            occurrence = self._cursor.get(key, 0)
+            self._cursor[key] = occurrence + 1
+            recorded = self._results.get((key, occurrence))
+            if recorded is not None:
+                self.replayed += 1
+                return recorded
+        result = execute()
+        with self._lock:
+            self._results[(key, occurrence)] = result
+            self.executed += 1
+        return result
+
+
+_tool_checkpoint: contextvars.ContextVar[Optional[ToolCheckpoint]] = contextvars.ContextVar(
+    "sandbox_tool_checkpoint", default=None
+)
+
+
+def set_tool_checkpoint(checkpoint: Optional[ToolCheckpoint]) -> contextvars.Token:
+    return _tool_checkpoint.set(checkpoint)
+
+
+def reset_tool_checkpoint(token: contextvars.Token) -> None:
+    _tool_checkpoint.reset(token)
+
+
+def get_tool_checkpoint() -> Optional[ToolCheckpoint]:
+    return _tool_checkpoint.get()
+
+
+def checkpointed(tool: str, args: dict, execute: Callable[[], str]) -> str:
+    checkpoint = _tool_checkpoint.get()
+    if checkpoint is None:
+        return execute()
+    return checkpoint.run(tool, args, execute)
+
+
+# Current tracing span (see sandbox_trace). Kept next to the session so tool
+# threads and sandbox subprocesses attach their timings to the right request.
+_trace_span: contextvars.ContextVar[Optional[object]] = contextvars.ContextVar(
+    "sandbox_trace_span", default=None
+)
+
+
+def set_trace_span(span: Optional[object]) -> contextvars.Token:
+    return _trace_span.set(span)
+
+
+def reset_trace_span(token: contextvars.Token) -> None:
+    _trace_span.reset(token)
+
+
+def get_trace_span() -> Optional[object]:
+    return _trace_span.get()
+
+
+# Cancellation flag for the current sandbox run (see sandbox_speculate and
+# backend/run_buffer). When set, run_limited kills its child and raises
+# SandboxCancelled.
+_cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar(
+    "sandbox_cancel_event", default=None
+)
+
+
+def set_cancel_event(event: Optional[threading.Event]) -> contextvars.Token:
+    return _cancel_event.set(event)
+
+
+def reset_cancel_event(token: contextvars.Token) -> None:
+    _cancel_event.reset(token)
+
+
+def get_cancel_event() -> Optional[threading.Event]:
+    return _cancel_event.get()
+
+
+# Session quota for files the sandbox writes besides the snippet's own (output
+# spills). Called with a file's size, returns how many of those bytes the
+# session can hold; the rest of the file is dropped (see sandbox_spawn).
+_output_quota: contextvars.ContextVar[Optional[Callable[[int], int]]] = contextvars.ContextVar(
+    "sandbox_output_quota", default=None
+)
+
+
+def set_output_quota(quota: Optional[Callable[[int], int]]) -> contextvars.Token:
+    return _output_quota.set(quota)
+
+
+def reset_output_quota(token: contextvars.Token) -> None:
+    _output_quota.reset(token)
+
+
+def get_output_quota() -> Optional[Callable[[int], int]]:
+    return _output_quota.get()
@@ -0,0 +1,416 @@
+import functools
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import IO, Optional
+
+from sandbox_session import get_cancel_event, get_output_quota
+from sandbox_trace import set_span_attribute, span, trace_env
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Resource limits are passed around as {"cpu": s, "fsize": bytes, "nofile": n, "as": bytes}.
+_RLIMITS = {
+    "cpu": "RLIMIT_CPU",
+    "fsize": "RLIMIT_FSIZE",
+    "nofile": "RLIMIT_NOFILE",
+    "as": "RLIMIT_AS",
+}
+
+# Joins the cgroup whose cgroup.procs path is $0, then execs the real command
+# under the same PID. Fails closed so a run never escapes its memory.max.
+_CGROUP_WRAPPER = 'echo $$ > "$0" || exit 125; exec "$@"'
+
+
+OUTPUT_READ_BYTES = 64 * 1024
+# How often a cancellable run checks its cancel event.
+CANCEL_POLL_S = 0.05
+
+
+class SandboxCancelled(Exception):
+    # The run was cancelled through the sandbox_session cancel event.
+    pass
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def output_budget() -> dict[str, int]:
+    # Per-stream head/tail kept in memory, total bytes after which the child
+    # is killed, and how much of each stream may be spilled to a file.
+    return {
+        "head": _env_int("SANDBOX_OUTPUT_HEAD_BYTES", 16 * 1024),
+        "tail": _env_int("SANDBOX_OUTPUT_TAIL_BYTES", 16 * 1024),
+        "max": _env_int("SANDBOX_OUTPUT_MAX_BYTES", 64 * 1024 * 1024),
+        "spill": _env_int("SANDBOX_OUTPUT_SPILL_BYTES", 8 * 1024 * 1024),
+    }
+
+
+class OutputCapture:
+    # Keeps the first `head` and last `tail` bytes of a stream. Once the
+    # stream outgrows both, everything (up to `spill` bytes) also goes to
+    # spill_path, so the full output is still available as a file.
+
+    def __init__(
+        self, head: int, tail: int, spill: int = 0, spill_path: Optional[str] = None
+    ) -> None:
+        self.head_limit = max(0, head)
+        self.tail_limit = max(0, tail)
+        self.spill_limit = spill if spill_path else 0
+        self.spill_path = spill_path
+        self.total = 0
+        self.head = bytearray()
+        self.tail = bytearray()
+        self._spill: Optional[IO[bytes]] = None
+        self._spilled = 0
+        # A reader that outlives its join (a grandchild holds the pipe) may
+        # still feed after close; close and feed are serialized.
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + len(self.tail)
+
+    def _write_spill(self, data: bytes) -> None:
+        if self._spill is None or self._spilled >= self.spill_limit:
+            return
+        data = data[: self.spill_limit - self._spilled]
+        try:
+            self._spill.write(data)
+            self._spilled += len(data)
+        except (OSError, ValueError):
+            self._spilled = self.spill_limit
+
+    def feed(self, chunk: bytes) -> None:
+        with self._lock:
+            if not self._closed:
+                self._feed(chunk)
+
+    def _feed(self, chunk: bytes) -> None:
+        if (
+            self.spill_limit
+            and self._spill is None
+            and self.total + len(chunk) > self.head_limit + self.tail_limit
+        ):
+            try:
+                self._spill = open(self.spill_path, "wb")
+            except OSError:
+                self.spill_limit = 0
+            else:
+                # Nothing has been dropped yet: head + tail is the output so far.
+                self._write_spill(bytes(self.head) + bytes(self.tail))
+        if self._spill is not None:
+            self._write_spill(chunk)
+        self.total += len(chunk)
+        if len(self.head) < self.head_limit:
+            room = self.head_limit - len(self.head)
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if self.tail_limit and chunk:
+            self.tail += chunk[-self.tail_limit :]
+            if len(self.tail) > self.tail_limit:
+                del self.tail[: len(self.tail) - self.tail_limit]
+
+    def close(self) -> Optional[str]:
+        # Returns the spill path if one was written. Later output is dropped.
+        with self._lock:
+            self._closed = True
+            if self._spill is None:
+                return None
+            self._spill.close()
+            return self.spill_path
+
+    def text(self) -> str:
+        head = bytes(self.head).decode("utf-8", errors="replace")
+        tail = bytes(self.tail).decode("utf-8", errors="replace")
+        if self.truncated:
+            skipped = self.total - len(self.head) - len(self.tail)
+            text = f"{head}\n...<{skipped} bytes truncated>...\n{tail}"
+        else:
+            text = head + tail
+        return text.replace("\r\n", "\n")
+
+
+def charge_spill_files(files: dict[str, Optional[str]]) -> dict[str, Optional[str]]:
+    # Charges spill files ({stream: path}) to the session quota (see
+    # sandbox_session.get_output_quota). A file that does not fit is cut to
+    # the bytes granted, or removed (its path becomes None) when none are.
+    quota = get_output_quota()
+    if quota is None:
+        return files
+    charged = dict(files)
+    for name, path in files.items():
+        if not path:
+            continue
+        try:
+            size = os.path.getsize(path)
+            granted = quota(size)
+            if granted <= 0:
+                os.remove(path)
+                charged[name] = None
+            elif granted < size:
+                os.truncate(path, granted)
+        except OSError:
+            continue
+    return charged
+
+
+def output_fields(output: dict, root: Optional[str] = None) -> dict[str, object]:
+    # Extra result-payload fields for truncated, spilled or runaway output;
+    # spill paths are reported relative to root (the sandbox's /data view).
+    fields: dict[str, object] = {}
+    for name in ("stdout", "stderr"):
+        if output.get(f"{name}_truncated"):
+            fields[f"{name}_bytes"] = output.get(f"{name}_bytes")
+        path = output.get(f"{name}_file")
+        if path:
+            fields[f"{name}_file"] = os.path.relpath(path, root) if root else path
+    if output.get("killed"):
+        fields["output_limit_exceeded"] = True
+    return fields
+
+
+class LimitedProcess(subprocess.CompletedProcess):
+    # CompletedProcess plus output accounting: per-stream byte totals,
+    # truncation flags, spill files, and whether the output budget killed it.
+    def __init__(self, args, returncode, stdout, stderr, output: dict) -> None:
+        super().__init__(args, returncode, stdout, stderr)
+        self.output = output
+
+
+@functools.lru_cache(maxsize=1)
+def _prlimit_bin() -> Optional[str]:
+    return shutil.which("prlimit")
+
+
+def _spawn_mode() -> str:
+    mode = os.environ.get("SANDBOX_SPAWN_MODE", "").lower()
+    if mode in {"prlimit", "post", "preexec"}:
+        return mode
+    if _prlimit_bin():
+        return "prlimit"
+    if hasattr(resource, "prlimit"):
+        return "post"
+    return "preexec"
+
+
+def _prlimit_args(limits: dict[str, int]) -> list[str]:
+    args = [_prlimit_bin() or "prlimit"]
+    for name, value in limits.items():
+        args.append(f"--{name}={value}:{value}")
+    args.append("--")
+    return args
+
+
+def _set_limits(limits: dict[str, int], pid: int = 0) -> None:
+    if resource is None:
+        return
+    for name, value in limits.items():
+        rlimit = getattr(resource, _RLIMITS[name], None)
+        if rlimit is None:
+            continue
+        try:
+            if pid:
+                resource.prlimit(pid, rlimit, (value, value))
+            else:
+                resource.setrlimit(rlimit, (value, value))
+        except (OSError, ValueError):
+            continue
+
+
+def build_command(
+    cmd: list[str], limits: dict[str, int], cgroup_procs: Optional[str] = None
+) -> list[str]:
+    wrapped = list(cmd)
+    if limits and resource is not None and _spawn_mode() == "prlimit":
+        wrapped = _prlimit_args(limits) + wrapped
+    if cgroup_procs:
+        wrapped = ["/bin/sh", "-c", _CGROUP_WRAPPER, cgroup_procs] + wrapped
+    return wrapped
+
+
+def _pump(
+    stream: IO[bytes],
+    capture: OutputCapture,
+    process: subprocess.Popen,
+    counter: dict,
+    guard: threading.Lock,
+    max_bytes: int,
+) -> None:
+    # Drain one pipe into its capture; kill the child once both streams
+    # together exceed max_bytes, so a print loop cannot run to the timeout.
+    with stream:
+        for chunk in iter(lambda: stream.read1(OUTPUT_READ_BYTES), b""):
+            capture.feed(chunk)
+            with guard:
+                counter["total"] += len(chunk)
+                over = max_bytes > 0 and counter["total"] > max_bytes and not counter["killed"]
+                if over:
+                    counter["killed"] = True
+            if over:
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+
+
+def _wait(
+    process: subprocess.Popen, timeout: float, cancel: Optional[threading.Event]
+) -> None:
+    if cancel is None:
+        process.wait(timeout=timeout)
+        return
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            process.wait(timeout=max(0.0, min(CANCEL_POLL_S, remaining)))
+            return
+        except subprocess.TimeoutExpired:
+            if cancel.is_set():
+                raise SandboxCancelled("Sandbox run cancelled.") from None
+            if remaining <= CANCEL_POLL_S:
+                raise subprocess.TimeoutExpired(process.args, timeout) from None
+
+
+def run_limited(
+    cmd: list[str],
+    *,
+    cwd: str,
+    env: dict[str, str],
+    timeout: float,
+    limits: dict[str, int],
+    cgroup_procs: Optional[str] = None,
+    spill_prefix: Optional[str] = None,
+    budget: Optional[dict[str, int]] = None,
+) -> LimitedProcess:
+    # Traced as "sandbox.process"; the child gets TRACEPARENT in its env.
+    with span("sandbox.process", command=os.path.basename(cmd[0]), timeout_s=timeout) as current:
+        if current is not None:
+            env = {**env, **trace_env()}
+        completed = _run_limited(
+            cmd,
+            cwd=cwd,
+            env=env,
+            timeout=timeout,
+            limits=limits,
+            cgroup_procs=cgroup_procs,
+            spill_prefix=spill_prefix,
+            budget=budget,
+        )
+        if current is not None:
+            current.set_attribute("exit_code", completed.returncode)
+            current.set_attribute("killed", completed.output["killed"])
+            current.set_attribute("stdout_bytes", completed.output["stdout_bytes"])
+            current.set_attribute("stderr_bytes", completed.output["stderr_bytes"])
+        return completed
+
+
+def _run_limited(
+    cmd: list[str],
+    *,
+    cwd: str,
+    env: dict[str, str],
+    timeout: float,
+    limits: dict[str, int],
+    cgroup_procs: Optional[str] = None,
+    spill_prefix: Optional[str] = None,
+    budget: Optional[dict[str, int]] = None,
+) -> LimitedProcess:
+    # Same contract as subprocess.run(text=True, capture_output=True), but
+    # without preexec_fn, so the child is started via vfork/posix_spawn and
+    # is safe to call from the server's worker threads. Limits are applied
+    # by the prlimit(1) exec wrapper, or by resource.prlimit right after spawn.
+    # Output is bounded by output_budget(); with spill_prefix, oversized
+    # streams are also written to "<spill_prefix>.stdout.txt"/".stderr.txt".
+    # Raises SandboxCancelled if the context's cancel event is set.
+    cancel = get_cancel_event()
+    if cancel is not None and cancel.is_set():
+        raise SandboxCancelled("Sandbox run cancelled.")
+    executable = shutil.which(cmd[0], path=env.get("PATH"))
+    if executable is None:
+        raise FileNotFoundError(cmd[0])
+    cmd = [executable] + list(cmd[1:])
+    limits = {name: int(value) for name, value in limits.items() if value and value > 0}
+    mode = _spawn_mode()
+    preexec_fn = None
+    if mode == "preexec" and limits and resource is not None:
+        preexec_fn = functools.partial(_set_limits, limits)
+    budget = budget or output_budget()
+    captures = {
+        name: OutputCapture(
+            budget["head"],
+            budget["tail"],
+            budget["spill"],
+            f"{spill_prefix}.{name}.txt" if spill_prefix else None,
+        )
+        for name in ("stdout", "stderr")
+    }
+    spawn_started = time.monotonic()
+    process = subprocess.Popen(
+        build_command(cmd, limits, cgroup_procs),
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        preexec_fn=preexec_fn,
+    )
+    set_span_attribute("spawn_ms", round((time.monotonic() - spawn_started) * 1000, 3))
+    if mode == "post" and limits:
+        # Best effort: the child may run briefly before its limits land.
+        _set_limits(limits, process.pid)
+    counter = {"total": 0, "killed": False}
+    guard = threading.Lock()
+    readers = [
+        threading.Thread(
+            target=_pump,
+            args=(stream, captures[name], process, counter, guard, budget["max"]),
+            daemon=True,
+        )
+        for name, stream in (("stdout", process.stdout), ("stderr", process.stderr))
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        _wait(process, timeout, cancel)
+    except (subprocess.TimeoutExpired, SandboxCancelled):
+        process.kill()
+        process.wait()
+        raise
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        # Grandchildren may still hold the pipes open; do not wait for them forever.
+        for reader in readers:
+            reader.join(timeout=1)
+        spill_files = charge_spill_files(
+            {name: capture.close() for name, capture in captures.items()}
+        )
+    output = {
+        "killed": counter["killed"],
+        "stdout_bytes": captures["stdout"].total,
+        "stderr_bytes": captures["stderr"].total,
+        "stdout_truncated": captures["stdout"].truncated,
+        "stderr_truncated": captures["stderr"].truncated,
+        "stdout_file": spill_files["stdout"],
+        "stderr_file": spill_files["stderr"],
+    }
+    return LimitedProcess(
+        process.args,
+        process.returncode,
+        captures["stdout"].text(),
+        captures["stderr"].text(),
+        output,
+    )
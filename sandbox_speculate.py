@@ -0,0 +1,222 @@
+import ast
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from sandbox_scheduler import get_scheduler, scheduler_enabled
+from sandbox_session import get_cancel_event, reset_cancel_event, set_cancel_event
+from sandbox_spawn import CANCEL_POLL_S, SandboxCancelled
+from sandbox_trace import span
+
+# Speculative execution (SANDBOX_SPECULATIVE=1). Snippets that would run the
+# same in Pyodide and CPython start in both; the requested runner's result is
+# returned as soon as it finishes, and the other one wins only by succeeding
+# first. The loser is killed. Only pure computation qualifies: imports from an
+# allowlist of side-effect-free stdlib modules (plus SANDBOX_SPECULATIVE_MODULES),
+# no open/exec/eval/getattr, no dunder names or attributes, and no file-writing
+# methods. A run already waiting for capacity is not doubled.
+
+# Available in both runners; no file, process, network or platform access.
+_PURE_MODULES = {
+    "array",
+    "bisect",
+    "calendar",
+    "cmath",
+    "collections",
+    "copy",
+    "dataclasses",
+    "datetime",
+    "decimal",
+    "difflib",
+    "enum",
+    "fractions",
+    "functools",
+    "heapq",
+    "itertools",
+    "json",
+    "math",
+    "numbers",
+    "operator",
+    "random",
+    "re",
+    "statistics",
+    "string",
+    "textwrap",
+    "typing",
+    "unicodedata",
+}
+# Builtins that reach files, input or arbitrary attributes.
+_BLOCKED_NAMES = {
+    "breakpoint",
+    "compile",
+    "delattr",
+    "eval",
+    "exec",
+    "getattr",
+    "globals",
+    "input",
+    "locals",
+    "open",
+    "setattr",
+    "vars",
+}
+# Methods that write files when given a path (pandas, matplotlib, numpy).
+_WRITE_METHODS = {
+    "dump",
+    "save",
+    "savefig",
+    "savetxt",
+    "savez",
+    "savez_compressed",
+    "to_csv",
+    "to_excel",
+    "to_feather",
+    "to_hdf",
+    "to_json",
+    "to_parquet",
+    "to_pickle",
+    "to_sql",
+    "to_stata",
+    "tofile",
+}
+
+
+def speculative_enabled() -> bool:
+    return os.environ.get("SANDBOX_SPECULATIVE", "").lower() in {"1", "true", "yes"}
+
+
+def _allowed_modules() -> set[str]:
+    extra = os.environ.get("SANDBOX_SPECULATIVE_MODULES", "")
+    allowed = set(_PURE_MODULES)
+    allowed.update(name.strip() for name in extra.split(",") if name.strip())
+    return allowed
+
+
+def is_ambiguous(code: str) -> bool:
+    # True when the snippet can run in either sandbox with the same result.
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    allowed = _allowed_modules()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names = [node.module or ""] if not node.level else [""]
+        elif isinstance(node, ast.Attribute):
+            if node.attr.startswith("__") or node.attr in _WRITE_METHODS:
+                return False
+            continue
+        elif isinstance(node, ast.Name):
+            if node.id in _BLOCKED_NAMES or node.id.startswith("__"):
+                return False
+            continue
+        else:
+            continue
+        if any(name.split(".")[0] not in allowed for name in names):
+            return False
+    return True
+
+
+def should_speculate(code: str) -> bool:
+    if not speculative_enabled() or not is_ambiguous(code):
+        return False
+    return not scheduler_enabled() or not get_scheduler().stats()["queue_depth"]
+
+
+def _cancellable(event: threading.Event, run: Callable[[], str]) -> str:
+    token = set_cancel_event(event)
+    try:
+        return run()
+    finally:
+        reset_cancel_event(token)
+
+
+def _decode(raw: str) -> Optional[dict]:
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def race(runners: list[tuple[str, Callable[[], str]]]) -> str:
+    # Runs [(tool, run), ...] concurrently. The first runner is the requested
+    # one: its result (or exception) is returned as soon as it finishes. The
+    # others win only with an ok/warning result that arrives first. The result
+    # is marked with the sandbox it came from; losers are cancelled and finish
+    # in the background, as are all runners if the caller's run is cancelled.
+    parent = get_cancel_event()
+    events = [threading.Event() for _ in runners]
+    pool = ThreadPoolExecutor(max_workers=len(runners), thread_name_prefix="sandbox-speculate")
+    results: dict[int, str] = {}
+    winner = None
+    with span("sandbox.speculative", tools=",".join(name for name, _ in runners)) as current:
+        try:
+            # Pool threads do not inherit contextvars (session, trace span).
+            futures = {
+                pool.submit(contextvars.copy_context().run, _cancellable, events[index], run): index
+                for index, (_, run) in enumerate(runners)
+            }
+            pending = set(futures)
+            while winner is None and pending:
+                if parent is not None and parent.is_set():
+                    raise SandboxCancelled("Sandbox run cancelled.")
+                done, pending = wait(pending, timeout=CANCEL_POLL_S, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    try:
+                        results[index] = future.result()
+                    except SandboxCancelled:
+                        continue
+                    except Exception:
+                        if index == 0:
+                            raise
+                        continue
+                    payload = _decode(results[index])
+                    if index == 0 or (
+                        payload is not None and payload.get("status") in {"ok", "warning"}
+                    ):
+                        winner = index
+                        break
+        finally:
+            for index, event in enumerate(events):
+                if index != winner:
+                    event.set()
+            pool.shutdown(wait=False)
+        if winner is None:
+            # The requested run was cancelled from inside; fall back to any result.
+            if not results:
+                raise SandboxCancelled("Sandbox run cancelled.")
+            winner = min(results)
+        if current is not None:
+            current.set_attribute("winner", runners[winner][0])
+    payload = _decode(results[winner])
+    if payload is None:
+        return results[winner]
+    payload["sandbox"] = runners[winner][0]
+    payload["speculative"] = True
+    return json.dumps(payload, ensure_ascii=True)
+
+
+def speculate(tool: str, code: str, timeout_s: Optional[int], run: Callable[[], str]) -> str:
+    # Runs the snippet in `tool` alone, or races it against the other sandbox.
+    if not should_speculate(code):
+        return run()
+    # Imported here: both tool modules import this one.
+    if tool == "cpython_python":
+        from sandbox_tool import SandboxedPythonTool
+
+        other = ("sandboxed_python", lambda: SandboxedPythonTool()._execute(code, timeout_s))
+    else:
+        from cpython_tool import CpythonSandboxTool
+
+        other = (
+            "cpython_python",
+            lambda: CpythonSandboxTool()._run_snippet({"code": code, "timeout_s": timeout_s}),
+        )
+    return race([(tool, run), other])
@@ -0,0 +1,101 @@
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+
+from sandbox_session import get_session_files_dir
+
+# Per-session adaptive timeouts. SANDBOX_TIMEOUT_S / CPYTHON_TIMEOUT_S, when
+# set, force the timeout as before. Otherwise a timeout the model passes is
+# honoured up to the tool's cap (SANDBOX_TIMEOUT_CAP_S / CPYTHON_TIMEOUT_CAP_S).
+# When it is omitted, the timeout follows the session's recent run times, but never
+# drops below the runner default: sessions with slow runs get more room, and
+# a run that timed out doubles the next timeout up to the cap, so a long job
+# succeeds on retry instead of failing the same way again. History is kept
+# per worker process, and only for requests with a session.
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def adaptive_enabled() -> bool:
+    return os.environ.get("SANDBOX_ADAPTIVE_TIMEOUTS", "1").lower() not in {"0", "false", "no"}
+
+
+def timeout_cap(env_name: str, default_cap: int) -> int:
+    return max(1, int(_env_float(env_name, default_cap)))
+
+
+def forced_timeout(env_name: str) -> Optional[int]:
+    # The fixed timeout set by the operator, if any.
+    value = os.environ.get(env_name, "").strip()
+    if not value:
+        return None
+    try:
+        return max(1, int(float(value)))
+    except ValueError:
+        return None
+
+
+_history: "OrderedDict[tuple[str, str], deque]" = OrderedDict()
+_history_lock = threading.Lock()
+
+
+def _key(tool: str) -> Optional[tuple[str, str]]:
+    # Runs without a session are unrelated to each other; they keep no history.
+    session_dir = get_session_files_dir()
+    return (session_dir, tool) if session_dir else None
+
+
+def record_run(tool: str, elapsed_s: float, timed_out: bool, timeout_s: int) -> None:
+    window = max(1, int(_env_float("SANDBOX_ADAPTIVE_WINDOW", 20)))
+    max_sessions = max(1, int(_env_float("SANDBOX_ADAPTIVE_SESSIONS", 1024)))
+    key = _key(tool)
+    if key is None:
+        return
+    with _history_lock:
+        runs = _history.get(key)
+        if runs is None or runs.maxlen != window:
+            runs = deque(runs or (), maxlen=window)
+            _history[key] = runs
+        runs.append((elapsed_s, timed_out, timeout_s))
+        _history.move_to_end(key)
+        while len(_history) > max_sessions:
+            _history.popitem(last=False)
+
+
+def resolve_timeout(
+    tool: str, requested: Optional[int], default_s: int, cap_s: int, forced: Optional[int] = None
+) -> tuple[int, str]:
+    # Returns (timeout_s, source); source is "env", "requested", "adaptive" or
+    # "default".
+    if forced:
+        return forced, "env"
+    if requested:
+        return max(1, min(int(requested), cap_s)), "requested"
+    default_s = max(1, min(default_s, cap_s))
+    key = _key(tool)
+    if not adaptive_enabled() or key is None:
+        return default_s, "default"
+    with _history_lock:
+        runs = list(_history.get(key, ()))
+    if not runs:
+        return default_s, "default"
+    _, last_timed_out, last_timeout = runs[-1]
+    if last_timed_out:
+        return min(cap_s, max(default_s, last_timeout * 2)), "adaptive"
+    finished = sorted(elapsed for elapsed, timed_out, _ in runs if not timed_out)
+    if len(finished) < int(_env_float("SANDBOX_ADAPTIVE_MIN_RUNS", 3)):
+        return default_s, "default"
+    p90 = finished[min(len(finished) - 1, int(math.ceil(0.9 * len(finished))) - 1)]
+    value = math.ceil(
+        p90 * _env_float("SANDBOX_ADAPTIVE_FACTOR", 4) + _env_float("SANDBOX_ADAPTIVE_SLACK_S", 1)
+    )
+    if value <= default_s:
+        return default_s, "default"
+    return int(min(cap_s, value)), "adaptive"
@@ -1,22 +1,114 @@
+import asyncio
 import json
 import os
+import signal
 import subprocess
 import tempfile
-
-try:
-    import resource
-except ImportError:  # Windows
-    resource = None
+import threading
+import time
+import uuid
+from typing import Optional
 
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool
 
-from sandbox_session import get_session_files_dir
+from sandbox_cgroup import sandbox_cgroup
+from sandbox_scheduler import SchedulerBusy, admit_sandbox
+from sandbox_profile import profiling_requested, read_summary
+from sandbox_session import checkpointed, get_session_files_dir
+from sandbox_spawn import charge_spill_files, output_budget, output_fields, run_limited
+from sandbox_speculate import speculate
+from sandbox_timeouts import forced_timeout, record_run, resolve_timeout, timeout_cap
+from sandbox_trace import span
+
+
+def _reserve_mb() -> int:
+    # Memory the scheduler books per run: SANDBOX_RESERVE_MB, else the AS cap.
+    try:
+        reserve_mb = int(os.environ.get("SANDBOX_RESERVE_MB", "0"))
+        if reserve_mb <= 0:
+            reserve_mb = int(os.environ.get("SANDBOX_AS_MB", "768"))
+    except ValueError:
+        reserve_mb = 0
+    return reserve_mb if reserve_mb > 0 else 768
+
+
+_SNAPSHOT_LOCK = threading.Lock()
+_snapshot_attempted = False
+
+
+def _snapshot_ready(snapshot_path: str, env: dict[str, str]) -> bool:
+    # Same check as the runner: the sidecar must match both the preloaded
+    # packages and the snapshot file, or the snapshot is never restored.
+    preload = env.get("PYODIDE_PRELOAD_PACKAGES", "").split(",")
+    packages = sorted(name.strip() for name in preload if name.strip())
+    try:
+        with open(f"{snapshot_path}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        size = os.path.getsize(snapshot_path)
+    except (OSError, ValueError):
+        return False
+    return isinstance(meta, dict) and meta.get("packages") == packages and meta.get("size") == size
+
+
+def _build_snapshot(node_bin: str, runner_path: str, env: dict[str, str]) -> None:
+    # Runs outside the sandbox limits (the snapshot is larger than the run's
+    # RLIMIT_FSIZE), but still books capacity with the scheduler.
+    try:
+        with admit_sandbox(_reserve_mb()), span("pyodide.snapshot"):
+            subprocess.run(
+                [node_bin, runner_path, "--make-snapshot", env["PYODIDE_SNAPSHOT_PATH"]],
+                env=env,
+                capture_output=True,
+                timeout=int(os.environ.get("PYODIDE_SNAPSHOT_TIMEOUT_S", "120")),
+                check=False,
+            )
+    except (OSError, SchedulerBusy, subprocess.TimeoutExpired, ValueError):
+        pass
+
+
+def _ensure_snapshot(node_bin: str, runner_path: str, env: dict[str, str]) -> None:
+    # With PYODIDE_SNAPSHOT_BUILD=1, build a missing or stale snapshot once per
+    # process in the background; runs cold-start until it is ready.
+    global _snapshot_attempted
+    snapshot_path = env.get("PYODIDE_SNAPSHOT_PATH")
+    if not snapshot_path or _snapshot_attempted:
+        return
+    if os.environ.get("PYODIDE_SNAPSHOT_BUILD", "").lower() not in {"1", "true", "yes"}:
+        return
+    with _SNAPSHOT_LOCK:
+        if _snapshot_attempted:
+            return
+        _snapshot_attempted = True
+    if _snapshot_ready(snapshot_path, env):
+        return
+    threading.Thread(
+        target=_build_snapshot,
+        args=(node_bin, runner_path, dict(env)),
+        name="pyodide-snapshot",
+        daemon=True,
+    ).start()
+
+
+def _cgroup_cpus() -> float:
+    try:
+        return float(os.environ.get("SANDBOX_CGROUP_CPUS", "1"))
+    except ValueError:
+        return 1.0
 
 
 class SandboxedPythonInput(BaseModel):
     code: str = Field(..., description="Python code to execute")
-    timeout_s: int = Field(6, ge=1, le=10, description="Wall-clock timeout in seconds")
+    timeout_s: Optional[int] = Field(
+        None,
+        ge=1,
+        le=10,
+        description="Wall-clock timeout in seconds; omit to use the session's adaptive timeout",
+    )
+    profile: bool = Field(
+        False,
+        description="Profile the run and return the top hotspots; use when code is slow or timed out",
+    )
 
 
 class SandboxedPythonTool(BaseTool):
@@ -37,8 +129,28 @@ class SandboxedPythonTool(BaseTool):
             return text, False
         return "...<truncated>...\n" + text[-limit:], True
 
-    def _run(self, code: str, timeout_s: int = 6) -> str:
-        timeout_s = int(os.environ.get("SANDBOX_TIMEOUT_S", str(timeout_s)))
+    def _run(self, code: str, timeout_s: Optional[int] = None, profile: bool = False) -> str:
+        def _execute() -> str:
+            if profiling_requested(profile):
+                return self._execute(code, timeout_s, True)
+            # SANDBOX_SPECULATIVE=1 may race the snippet against CPython.
+            return speculate(self.name, code, timeout_s, lambda: self._execute(code, timeout_s))
+
+        # Replays the recorded result when the agent run is being retried.
+        return checkpointed(
+            self.name, {"code": code, "timeout_s": timeout_s, "profile": profile}, _execute
+        )
+
+    def _execute(self, code: str, timeout_s: Optional[int], profile: bool = False) -> str:
+        # SANDBOX_TIMEOUT_S forces the timeout; otherwise SANDBOX_TIMEOUT_CAP_S
+        # caps it and, without a requested one, it adapts to the session.
+        timeout_s, timeout_source = resolve_timeout(
+            self.name,
+            timeout_s,
+            6,
+            timeout_cap("SANDBOX_TIMEOUT_CAP_S", 10),
+            forced_timeout("SANDBOX_TIMEOUT_S"),
+        )
         with tempfile.TemporaryDirectory(prefix="sandbox-") as tmpdir:
             script_path = os.path.join(tmpdir, "snippet.py")
             with open(script_path, "w", encoding="utf-8") as f:
@@ -50,48 +162,110 @@ class SandboxedPythonTool(BaseTool):
                 "yes",
             }
             env = {"PATH": os.environ.get("PATH", "")}
-            index_url = os.environ.get("PYODIDE_INDEX_URL")
-            if index_url:
-                env["PYODIDE_INDEX_URL"] = index_url
-
-            def _limit_resources() -> None:
-                if resource is None:
-                    return
-                # CPU seconds
-                resource.setrlimit(resource.RLIMIT_CPU, (timeout_s, timeout_s))
-                # Limit file size to 1MB
-                resource.setrlimit(resource.RLIMIT_FSIZE, (10 * 1024 * 1024, 10 * 1024 * 1024))
-                # Limit number of open files
-                resource.setrlimit(resource.RLIMIT_NOFILE, (32, 32))
+            for name in (
+                "PYODIDE_INDEX_URL",
+                "PYODIDE_PRELOAD_PACKAGES",
+                "PYODIDE_SNAPSHOT_PATH",
+                "SANDBOX_OUTPUT_HEAD_BYTES",
+                "SANDBOX_OUTPUT_TAIL_BYTES",
+                "SANDBOX_OUTPUT_MAX_BYTES",
+                "SANDBOX_OUTPUT_SPILL_BYTES",
+            ):
+                value = os.environ.get(name)
+                if value:
+                    env[name] = value
+            # The runner bounds its own output and spills into the session.
+            spill_prefix = f"outputs/run-{uuid.uuid4().hex[:8]}"
+            env["SANDBOX_OUTPUT_SPILL_PREFIX"] = spill_prefix
+            # The runner profiles with the same helper as the CPython tool. No
+            # interim summary here: the runner is killed outright on timeout.
+            profile_path = os.path.join(tmpdir, "snippet.py.profile.json") if profile else None
+            if profile_path:
+                env["SANDBOX_PROFILE_HELPER"] = os.path.join(
+                    os.path.dirname(__file__), "sandbox_profile.py"
+                )
+                env["SANDBOX_PROFILE_OUTPUT"] = profile_path
+                if os.environ.get("SANDBOX_PROFILE_TOP"):
+                    env["SANDBOX_PROFILE_TOP"] = os.environ["SANDBOX_PROFILE_TOP"]
+            # Leave room for the runner's truncation marker and error notes.
+            budget = output_budget()
+            budget["head"] += 1024
+            budget["tail"] += 1024
+
+            resources = None
+
+            def _limits(cgroup_active: bool) -> dict[str, int]:
+                limits = {
+                    # CPU seconds
+                    "cpu": timeout_s,
+                    # Limit file size to 10MB
+                    "fsize": 10 * 1024 * 1024,
+                    # Limit number of open files
+                    "nofile": 32,
+                }
+                # memory.max already bounds the run precisely; RLIMIT_AS overcounts.
+                if cgroup_active:
+                    return limits
                 # Address space limit (best-effort; may be ignored on some OSes)
                 try:
-                    as_mb_raw = os.environ.get("SANDBOX_AS_MB", "768")
-                    as_mb = int(as_mb_raw)
+                    as_mb = int(os.environ.get("SANDBOX_AS_MB", "768"))
                     if as_mb > 0:
-                        as_bytes = max(64, as_mb) * 1024 * 1024
-                        resource.setrlimit(resource.RLIMIT_AS, (as_bytes, as_bytes))
-                except Exception:
+                        limits["as"] = max(64, as_mb) * 1024 * 1024
+                except ValueError:
                     pass
+                return limits
 
             runner_path = os.path.join(os.path.dirname(__file__), "pyodide_runner.mjs")
             node_bin = os.environ.get("NODE_BIN", "node")
             if not os.path.exists(runner_path):
                 return f"Pyodide runner not found at {runner_path}."
+            _ensure_snapshot(node_bin, runner_path, env)
             cmd = [node_bin, runner_path, script_path]
             session_dir = get_session_files_dir()
             if session_dir and os.path.isdir(session_dir):
                 cmd.append(session_dir)
+            reserve_mb = _reserve_mb()
             try:
-                completed = subprocess.run(
-                    cmd,
-                    cwd=tmpdir,
-                    env=env,
-                    text=True,
-                    capture_output=True,
-                    timeout=timeout_s,
-                    check=False,
-                    preexec_fn=_limit_resources if resource is not None else None,
-                )
+                with admit_sandbox(reserve_mb), sandbox_cgroup(
+                    reserve_mb, _cgroup_cpus()
+                ) as cgroup:
+                    started = time.monotonic()
+                    try:
+                        completed = run_limited(
+                            cmd,
+                            cwd=tmpdir,
+                            env=env,
+                            timeout=timeout_s,
+                            limits=_limits(cgroup is not None),
+                            cgroup_procs=cgroup.procs_path if cgroup is not None else None,
+                            budget=budget,
+                        )
+                    except subprocess.TimeoutExpired:
+                        record_run(self.name, time.monotonic() - started, True, timeout_s)
+                        raise
+                    finally:
+                        if cgroup is not None:
+                            resources = cgroup.usage()
+                    # RLIMIT_CPU (SIGXCPU) is the same timeout, hit on CPU time first.
+                    record_run(
+                        self.name,
+                        time.monotonic() - started,
+                        completed.returncode == -signal.SIGXCPU,
+                        timeout_s,
+                    )
+            except SchedulerBusy as exc:
+                payload = {
+                    "status": "error",
+                    "exit_code": None,
+                    "timed_out": False,
+                    "stdout": "",
+                    "stderr": str(exc),
+                    "stdout_truncated": False,
+                    "stderr_truncated": False,
+                }
+                if echo_code:
+                    payload["code"] = code
+                return json.dumps(payload, ensure_ascii=True)
             except FileNotFoundError:
                 payload = {
                     "status": "error",
@@ -111,20 +285,44 @@ class SandboxedPythonTool(BaseTool):
                     "exit_code": None,
                     "timed_out": True,
                     "stdout": "",
-                    "stderr": "Timed out while executing code.",
+                    "stderr": (
+                        f"Timed out after {timeout_s}s. Pass a larger timeout_s, or omit it "
+                        "to let the session's adaptive timeout grow."
+                    ),
                     "stdout_truncated": False,
                     "stderr_truncated": False,
+                    "timeout_s": timeout_s,
+                    "timeout_source": timeout_source,
                 }
+                if resources:
+                    payload["resources"] = resources
                 if echo_code:
                     payload["code"] = code
                 return json.dumps(payload, ensure_ascii=True)
+            finally:
+                # The runner spills into the session itself, also on timeout.
+                spill_files = {}
+                if session_dir:
+                    spill_paths = {
+                        name: os.path.join(session_dir, f"{spill_prefix}.{name}.txt")
+                        for name in ("stdout", "stderr")
+                    }
+                    spill_files = charge_spill_files(
+                        {name: path for name, path in spill_paths.items() if os.path.exists(path)}
+                    )
 
+            output = dict(completed.output)
+            for name, path in spill_files.items():
+                if path:
+                    output[f"{name}_file"] = path
             stdout = completed.stdout.strip()
             stderr = completed.stderr.strip()
+            if output["killed"]:
+                stderr = f"{stderr}\nOutput limit exceeded; process killed.".strip()
             stdout, stdout_truncated = self._truncate_head(stdout, 4000)
             stderr, stderr_truncated = self._truncate_tail(stderr, 4000)
             status = "ok"
-            if completed.returncode != 0:
+            if completed.returncode != 0 or output["killed"]:
                 status = "error"
             elif stderr:
                 status = "warning"
@@ -135,14 +333,28 @@ class SandboxedPythonTool(BaseTool):
                 "timed_out": False,
                 "stdout": stdout,
                 "stderr": stderr,
-                "stdout_truncated": stdout_truncated,
-                "stderr_truncated": stderr_truncated,
+                "stdout_truncated": stdout_truncated
+                or output["stdout_truncated"]
+                or bool(output.get("stdout_file")),
+                "stderr_truncated": stderr_truncated
+                or output["stderr_truncated"]
+                or bool(output.get("stderr_file")),
             }
+            payload.update(output_fields(output, session_dir))
+            payload["timeout_s"] = timeout_s
+            payload["timeout_source"] = timeout_source
+            summary = read_summary(profile_path) if profile_path else None
+            if summary:
+                payload["profile"] = summary
+            if resources:
+                payload["resources"] = resources
             if echo_code:
                 payload["code"] = code
             if not stdout and not stderr and completed.returncode == 0:
                 payload["stdout"] = "(no output)"
             return json.dumps(payload, ensure_ascii=True)
 
-    async def _arun(self, code: str, timeout_s: int = 2) -> str:
-        raise NotImplementedError("SandboxedPythonTool does not support async")
+    async def _arun(
+        self, code: str, timeout_s: Optional[int] = None, profile: bool = False
+    ) -> str:
+        return await asyncio.to_thread(self._run, code, timeout_s, profile)
@@ -0,0 +1,233 @@
+import atexit
+import contextlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from typing import Iterator, Optional
+
+from sandbox_session import get_trace_span, reset_trace_span, set_trace_span
+
+# Minimal OpenTelemetry-style tracing without the SDK. Spans nest through the
+# sandbox_session contextvar, so tool threads (asyncio.to_thread, the batch
+# pool) attach to the request that started them. Finished spans are exported
+# in the background, either as JSON lines (TRACE_EXPORT=jsonl) or as OTLP/HTTP
+# JSON to a collector (TRACE_EXPORT=otlp). Tracing is off by default, and
+# span() then costs one branch.
+
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "").strip().lower()
+# Relative to the app, not to wherever the server was started from.
+TRACE_FILE = os.getenv(
+    "TRACE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl")
+)
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "sandboxed-agent")
+TRACE_QUEUE_MAX = int(os.getenv("TRACE_QUEUE_MAX", "4096"))
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def tracing_enabled() -> bool:
+    return TRACE_EXPORT in {"jsonl", "otlp"}
+
+
+class Span:
+    def __init__(
+        self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: object) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, exc: BaseException) -> None:
+        self.error = f"{type(exc).__name__}: {exc}"[:500]
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            _exporter().submit(self)
+
+    def to_dict(self) -> dict[str, object]:
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": end_ns,
+            "duration_ms": round((end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple[str, str]]:
+    match = _TRACEPARENT_RE.match((value or "").strip().lower())
+    return (match.group(1), match.group(2)) if match else None
+
+
+def start_span(name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+    # Child of the current span, else of an incoming W3C traceparent, else a new trace.
+    if not tracing_enabled():
+        return None
+    parent = get_trace_span()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    remote = parse_traceparent(traceparent)
+    if remote is not None:
+        return Span(name, remote[0], remote[1], attributes)
+    return Span(name, os.urandom(16).hex(), None, attributes)
+
+
+@contextlib.contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+    current = start_span(name, traceparent, **attributes)
+    if current is None:
+        yield None
+        return
+    token = set_trace_span(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.record_error(exc)
+        raise
+    finally:
+        reset_trace_span(token)
+        current.end()
+
+
+def set_span_attribute(key: str, value: object) -> None:
+    current = get_trace_span()
+    if isinstance(current, Span):
+        current.set_attribute(key, value)
+
+
+def trace_env() -> dict[str, str]:
+    # W3C TRACEPARENT for subprocesses, so sandboxed code can join the trace.
+    current = get_trace_span()
+    return {"TRACEPARENT": current.traceparent()} if isinstance(current, Span) else {}
+
+
+def _otlp_value(value: object) -> dict[str, object]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_payload(spans: list[Span]) -> dict[str, object]:
+    items = []
+    for item in spans:
+        record = {
+            "traceId": item.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 1,
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns or item.start_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)} for key, value in item.attributes.items()
+            ],
+            "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+        }
+        if item.parent_id:
+            record["parentSpanId"] = item.parent_id
+        items.append(record)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "sandbox_trace"}, "spans": items}],
+            }
+        ]
+    }
+
+
+class _Exporter:
+    # Background writer; a full queue drops spans instead of slowing requests.
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=max(1, TRACE_QUEUE_MAX))
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._loop, name="trace-export", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, item: Span) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        try:
+            self._queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self._thread.join(timeout=5)
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < 512:
+                try:
+                    batch.append(self._queue.get(timeout=0.2))
+                except queue.Empty:
+                    break
+            spans = [item for item in batch if item is not None]
+            if spans:
+                try:
+                    self._write(spans)
+                except (OSError, ValueError):
+                    pass
+            if batch[-1] is None:
+                return
+
+    def _write(self, spans: list[Span]) -> None:
+        if TRACE_EXPORT == "otlp":
+            import urllib.request
+
+            request = urllib.request.Request(
+                TRACE_OTLP_ENDPOINT,
+                data=json.dumps(_otlp_payload(spans)).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                return
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            for item in spans:
+                f.write(json.dumps(item.to_dict(), ensure_ascii=True, default=str) + "\n")
+
+
+_exporter_instance: Optional[_Exporter] = None
+_exporter_guard = threading.Lock()
+
+
+def _exporter() -> _Exporter:
+    global _exporter_instance
+    with _exporter_guard:
+        if _exporter_instance is None:
+            _exporter_instance = _Exporter()
+        return _exporter_instance
@@ -0,0 +1,23 @@
+import os
+
+from bench.importtime import DEFAULT_BASELINE, DEFAULT_BUDGET_MS, DEFAULT_FORBIDDEN, measure
+
+# The server must start serving quickly: agents, LangChain and the data stack
+# are loaded after startup. Only what backend.server adds on top of fastapi is
+# budgeted (about 100ms today), and the best of N runs counts.
+RUNS = int(os.getenv("IMPORT_BUDGET_RUNS", "5"))
+
+
+def test_server_import_stays_within_budget():
+    best_us = None
+    modules: dict = {}
+    for _ in range(max(1, RUNS)):
+        total_us, measured = measure("backend.server", DEFAULT_BASELINE)
+        if best_us is None or total_us < best_us:
+            best_us, modules = total_us, measured
+    leaked = sorted({name.split(".")[0] for name in modules} & set(DEFAULT_FORBIDDEN))
+    assert not leaked, f"backend.server eagerly imports {', '.join(leaked)}"
+    assert best_us / 1000 <= DEFAULT_BUDGET_MS, (
+        f"import backend.server took {best_us / 1000:.1f}ms on top of {DEFAULT_BASELINE} "
+        f"(budget {DEFAULT_BUDGET_MS:.0f}ms)"
+    )
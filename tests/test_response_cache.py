@@ -0,0 +1,48 @@
+import pytest
+
+from backend.response_cache import ResponseCache
+
+FILES = "files-a"
+
+
+def _cache(similarity):
+    cache = ResponseCache(16, 600, similarity)
+    cache.put("Describe this dataset", FILES, "cached answer")
+    return cache
+
+
+def test_similarity_lookup_is_off_by_default():
+    cache = ResponseCache(16, 600)
+    cache.put("Describe this dataset", FILES, "cached answer")
+    assert cache.get("  describe THIS dataset?", FILES) == "cached answer"
+    assert cache.get("Can you describe this dataset", FILES) is None
+
+
+def test_similar_prompt_hits_only_above_the_threshold():
+    # "describe the dataset" scores ~0.72 against the cached prompt.
+    assert _cache(0.7).get("Describe the dataset", FILES) == "cached answer"
+    assert _cache(0.8).get("Describe the dataset", FILES) is None
+    cache = _cache(0.7)
+    assert cache.get("Can you describe this dataset", FILES) == "cached answer"
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_similar_prompt_needs_the_same_files():
+    assert _cache(0.5).get("Can you describe this dataset", "files-b") is None
+
+
+@pytest.mark.parametrize(
+    "cached, asked",
+    [
+        ("what is 2**100", "what is 2*100"),
+        ("what is 2**100", "what is 2**101"),
+        ("mean of the price column", "median of the price column"),
+        ("sort ascending by price", "sort descending by price"),
+        ("are price and qty correlated", "are price and qty not correlated"),
+        ("draw a histogram of price", "draw a line chart of price"),
+    ],
+)
+def test_prompts_that_change_the_answer_never_hit(cached, asked):
+    cache = ResponseCache(16, 600, 0.5)
+    cache.put(cached, FILES, "cached answer")
+    assert cache.get(asked, FILES) is None
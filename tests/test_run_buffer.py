@@ -0,0 +1,106 @@
+import asyncio
+
+import main
+from backend import run_buffer
+from backend.run_buffer import create_run, get_run, start_attempt
+
+
+def test_run_resumes_only_for_its_session():
+    run = create_run("session-a")
+    assert get_run(run.run_id, "session-a") is run
+    assert get_run(run.run_id, "session-b") is None
+    assert get_run(run.run_id) is None
+
+
+def test_detached_run_is_cancelled_after_grace(monkeypatch):
+    monkeypatch.setattr(run_buffer, "RUN_DETACH_GRACE_S", 0.05)
+
+    async def scenario():
+        run = create_run()
+
+        async def attempt():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                await run.fail("cancelled")
+                raise
+            finally:
+                await run.finish()
+
+        run.attempt = attempt
+        start_attempt(run)
+        # Nobody follows the run.
+        await asyncio.sleep(0.2)
+        return run
+
+    run = asyncio.run(scenario())
+    assert run.done and run.failed
+    assert run.cancel_event.is_set()
+
+
+def test_followed_run_is_not_cancelled(monkeypatch):
+    monkeypatch.setattr(run_buffer, "RUN_DETACH_GRACE_S", 0.05)
+
+    async def scenario():
+        run = create_run()
+
+        async def attempt():
+            try:
+                await asyncio.sleep(0.2)
+                await run.publish({"type": "token", "value": "hi"})
+            finally:
+                await run.finish()
+
+        run.attempt = attempt
+        start_attempt(run)
+        return run, [event async for _, event in run.follow()]
+
+    run, events = asyncio.run(scenario())
+    assert not run.failed
+    assert len(events) == 2
+
+
+class _FakeLLMAgent:
+    # Streams one token per model call until cancelled.
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def ainvoke(self, payload, config=None, **kwargs):
+        handler = config["callbacks"][0]
+        for _ in range(200):
+            self.calls += 1
+            await handler.on_llm_new_token("token ")
+            await asyncio.sleep(0.02)
+        return {"messages": []}
+
+
+def test_cancelled_detached_run_stops_the_agent(monkeypatch):
+    monkeypatch.setattr(run_buffer, "RUN_DETACH_GRACE_S", 0.05)
+    agent = _FakeLLMAgent()
+    monkeypatch.setattr(main, "_create_agent", lambda streaming=False: (agent, "messages"))
+
+    async def scenario():
+        streamer = main.build_agent_streamer()
+        run = create_run()
+
+        async def attempt():
+            try:
+                async for token in streamer("hi", run.checkpoint):
+                    await run.publish({"type": "token", "value": token})
+            except asyncio.CancelledError:
+                await run.fail("cancelled")
+                raise
+            finally:
+                await run.finish()
+
+        run.attempt = attempt
+        start_attempt(run)
+        await asyncio.sleep(0.3)
+        calls = agent.calls
+        await asyncio.sleep(0.3)
+        return run, calls
+
+    run, calls = asyncio.run(scenario())
+    assert run.done and run.failed
+    assert 0 < calls < 200
+    assert agent.calls == calls
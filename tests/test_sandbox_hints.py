@@ -0,0 +1,99 @@
+import pandas as pd
+import pytest
+
+import sandbox_data
+from backend.dataset_cache import ingest_file
+from sandbox_hints import analyze, rewrite
+
+SNIPPETS = [
+    # In-place edits must keep working on frames loaded from the upload cache.
+    """import pandas as pd
+df = pd.read_csv("{root}/sales.csv")
+df.loc[0, "qty"] = 100
+df.iloc[1, 2] = 9.5
+result = df
+""",
+    """import pandas as pd
+df = pd.read_csv("{root}/sales.csv")
+result = df.groupby("region", as_index=False)["qty"].sum()
+""",
+    """import pandas as pd
+df = pd.read_csv("{root}/sales.csv")
+df["revenue"] = df["price"] * df["qty"]
+result = df.sort_values("revenue", ascending=False)
+""",
+]
+
+
+@pytest.fixture
+def data_root(tmp_path, monkeypatch):
+    rows = ["order_id,region,price,qty,note"]
+    rows += [f"{i},{'nsew'[i % 4]},{(i % 7) * 1.25},{i % 5},n{i}" for i in range(50)]
+    (tmp_path / "sales.csv").write_text("\n".join(rows) + "\n", encoding="utf-8")
+    (tmp_path / "y.tsv").write_text("a\tb\n1\t2\n", encoding="utf-8")
+    # Nulls in bool, int, string and date columns, and a mixed-type column.
+    (tmp_path / "mixed.csv").write_text(
+        "a,flag,day,name,mixed,empty\n"
+        "1,True,2024-01-05,x,1,\n"
+        "2,,2024-02-01,,b,\n"
+        ",False,,z,2.5,\n",
+        encoding="utf-8",
+    )
+    assert ingest_file(str(tmp_path), "sales.csv") is not None
+    assert ingest_file(str(tmp_path), "mixed.csv") is not None
+    assert ingest_file(str(tmp_path), "y.tsv") is not None
+    monkeypatch.setattr(sandbox_data, "DATA_ROOT", str(tmp_path))
+    return str(tmp_path)
+
+
+def _run(code: str) -> pd.DataFrame:
+    namespace: dict = {"__name__": "__main__"}
+    exec(compile(code, "snippet.py", "exec"), namespace)
+    return namespace["result"]
+
+
+@pytest.mark.parametrize("snippet", SNIPPETS)
+def test_read_csv_rewrite_matches_original(data_root, snippet):
+    code = snippet.format(root=data_root)
+    rewritten, applied = rewrite(code, data_root)
+    assert [item["rule"] for item in applied] == ["read_csv"]
+    assert rewritten.count("\n") == code.count("\n")
+    pd.testing.assert_frame_equal(_run(rewritten), _run(code))
+
+
+@pytest.mark.parametrize("infer_string", [False, True])
+def test_read_csv_rewrite_keeps_nulls_and_dtypes(data_root, infer_string):
+    code = f'import pandas as pd\nresult = pd.read_csv("{data_root}/mixed.csv")\n'
+    rewritten, applied = rewrite(code, data_root)
+    assert [item["rule"] for item in applied] == ["read_csv"]
+    with pd.option_context("future.infer_string", infer_string):
+        expected = _run(code)
+        result = _run(rewritten)
+    pd.testing.assert_frame_equal(result, expected)
+    assert result["flag"].tolist()[1] is not None
+
+
+def test_tsv_read_is_not_rewritten(data_root):
+    code = f'import pandas as pd\nresult = pd.read_csv("{data_root}/y.tsv")\n'
+    rewritten, applied = rewrite(code, data_root)
+    assert applied == [] and rewritten == code
+    assert _run(code).shape == (1, 1)
+    assert [hint["rule"] for hint in analyze(code, data_root)] == ["read_csv"]
+
+
+def test_append_rewrite_matches_concat(data_root):
+    code = f"""import pandas as pd
+df = pd.read_csv("{data_root}/sales.csv")
+out = pd.DataFrame()
+for region, group in df.groupby("region"):
+    out = out.append({{"region": region, "qty": group["qty"].sum()}}, ignore_index=True)
+result = out
+"""
+    expected = f"""import pandas as pd
+df = pd.read_csv("{data_root}/sales.csv")
+rows = [{{"region": region, "qty": group["qty"].sum()}} for region, group in df.groupby("region")]
+result = pd.DataFrame(rows)
+"""
+    rewritten, applied = rewrite(code, data_root)
+    assert sorted(item["rule"] for item in applied) == ["frame_append", "read_csv"]
+    pd.testing.assert_frame_equal(_run(rewritten), _run(expected), check_dtype=False)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+from sandbox_session import reset_output_quota, set_output_quota
+from sandbox_spawn import OutputCapture, run_limited
+
+BUDGET = {"head": 64, "tail": 64, "max": 1024 * 1024, "spill": 64 * 1024}
+
+
+def test_capture_drops_output_after_close(tmp_path):
+    capture = OutputCapture(4, 4, 1024, str(tmp_path / "out.txt"))
+    capture.feed(b"x" * 32)
+    assert capture.close() == str(tmp_path / "out.txt")
+    # A reader that outlived its join must not write to the closed file.
+    capture.feed(b"y" * 32)
+    assert (tmp_path / "out.txt").read_bytes() == b"x" * 32
+
+
+def _run_with_quota(tmp_path, quota):
+    token = set_output_quota(quota)
+    try:
+        return run_limited(
+            [sys.executable, "-c", "print('x' * 10000)"],
+            cwd=str(tmp_path),
+            env={"PATH": os.environ.get("PATH", "")},
+            timeout=30,
+            limits={},
+            spill_prefix=str(tmp_path / "run"),
+            budget=BUDGET,
+        )
+    finally:
+        reset_output_quota(token)
+
+
+def test_spill_is_cut_to_the_session_quota(tmp_path):
+    charged = []
+
+    def quota(size):
+        charged.append(size)
+        return 100
+
+    completed = _run_with_quota(tmp_path, quota)
+    assert charged == [10001]
+    assert os.path.getsize(completed.output["stdout_file"]) == 100
+
+
+def test_spill_is_removed_when_the_quota_is_full(tmp_path):
+    completed = _run_with_quota(tmp_path, lambda size: 0)
+    assert completed.output["stdout_file"] is None
+    assert not (tmp_path / "run.stdout.txt").exists()
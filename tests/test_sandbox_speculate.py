@@ -0,0 +1,69 @@
+import json
+import time
+
+import pytest
+
+from sandbox_speculate import is_ambiguous, race
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "from os import remove; remove('/data/a.csv')",
+        "from pathlib import Path; Path('/data/a.csv').touch()",
+        "import io; io.open('/data/a.csv', 'w')",
+        "import os; fd = os.open('/data/a', os.O_WRONLY); os.write(fd, b'x')",
+        "import os; os.truncate('/data/a.csv', 0)",
+        "import sqlite3; sqlite3.connect('/data/db').execute('create table t (a)')",
+        "import zipfile; zipfile.ZipFile('/data/a.zip', 'w')",
+        "import urllib.request; urllib.request.urlopen('http://x', data=b'')",
+        "import sys; print(sys.platform)",
+        "print(open('/data/a.csv').read())",
+        "f = open; f('/data/a.csv', 'w')",
+        "().__class__.__base__.__subclasses__()",
+        "getattr(str, '__dict__')",
+        "import pandas as pd; pd.DataFrame().to_csv('/data/out.csv')",
+    ],
+)
+def test_runner_dependent_or_writing_snippets_are_not_raced(code):
+    assert not is_ambiguous(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import math; print(math.factorial(20))",
+        "from collections import Counter; print(Counter('abracadabra'))",
+        "import statistics; print(statistics.median([3, 1, 2]))",
+        "print('a-b'.replace('-', '+'), sum(range(10)))",
+    ],
+)
+def test_pure_computation_is_raced(code):
+    assert is_ambiguous(code)
+
+
+def test_extra_modules_are_allowed(monkeypatch):
+    monkeypatch.setenv("SANDBOX_SPECULATIVE_MODULES", "numpy")
+    assert is_ambiguous("import numpy as np; print(np.arange(3).sum())")
+
+
+def _runner(delay, status):
+    def run():
+        time.sleep(delay)
+        return json.dumps({"status": status})
+
+    return run
+
+
+def test_requested_runner_error_is_returned_without_waiting():
+    started = time.monotonic()
+    result = json.loads(race([("cpython", _runner(0.01, "error")), ("pyodide", _runner(2, "ok"))]))
+    assert result["status"] == "error" and result["sandbox"] == "cpython"
+    assert time.monotonic() - started < 1
+
+
+def test_other_runner_wins_only_by_succeeding_first():
+    fast_ok = race([("cpython", _runner(0.3, "ok")), ("pyodide", _runner(0.01, "ok"))])
+    assert json.loads(fast_ok)["sandbox"] == "pyodide"
+    fast_error = race([("cpython", _runner(0.3, "ok")), ("pyodide", _runner(0.01, "error"))])
+    assert json.loads(fast_error)["sandbox"] == "cpython"
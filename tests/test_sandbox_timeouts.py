@@ -0,0 +1,52 @@
+from sandbox_session import reset_session_files_dir, set_session_files_dir
+from sandbox_timeouts import forced_timeout, record_run, resolve_timeout, timeout_cap
+
+
+def _in_session(path, run):
+    token = set_session_files_dir(path)
+    try:
+        return run()
+    finally:
+        reset_session_files_dir(token)
+
+
+def test_fast_runs_do_not_shrink_below_the_default(tmp_path):
+    def scenario():
+        for _ in range(5):
+            record_run("tool-fast", 0.05, False, 15)
+        return resolve_timeout("tool-fast", None, 15, 60)
+
+    assert _in_session(str(tmp_path), scenario) == (15, "default")
+
+
+def test_slow_runs_and_timeouts_grow_the_timeout(tmp_path):
+    def scenario():
+        for _ in range(3):
+            record_run("tool-slow", 5.0, False, 15)
+        grown = resolve_timeout("tool-slow", None, 15, 60)
+        record_run("tool-slow", 21.0, True, 21)
+        return grown, resolve_timeout("tool-slow", None, 15, 60)
+
+    assert _in_session(str(tmp_path), scenario) == ((21, "adaptive"), (42, "adaptive"))
+
+
+def test_runs_without_a_session_keep_no_history():
+    record_run("tool-none", 30.0, True, 15)
+    assert resolve_timeout("tool-none", None, 15, 60) == (15, "default")
+
+
+def test_forced_timeout_overrides_requested_and_adaptive(tmp_path, monkeypatch):
+    monkeypatch.setenv("CPYTHON_TIMEOUT_S", "15")
+    monkeypatch.setenv("CPYTHON_TIMEOUT_CAP_S", "60")
+
+    def scenario():
+        record_run("tool-forced", 30.0, True, 30)
+        forced = forced_timeout("CPYTHON_TIMEOUT_S")
+        cap = timeout_cap("CPYTHON_TIMEOUT_CAP_S", 60)
+        return (
+            resolve_timeout("tool-forced", 45, 15, cap, forced),
+            resolve_timeout("tool-forced", None, 15, cap, forced),
+            resolve_timeout("tool-forced", 45, 15, cap),
+        )
+
+    assert _in_session(str(tmp_path), scenario) == ((15, "env"), (15, "env"), (45, "requested"))
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from backend import session_store
+from backend.session_store import (
+    UploadBusyError,
+    abort_upload,
+    commit_upload,
+    create_upload,
+    write_upload_chunk,
+)
+
+DATA = b"a,b\n1,2\n"
+
+
+@pytest.fixture
+def upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(session_store, "SESSION_BLOB_DIR", str(tmp_path / ".blobs"))
+    upload_id = create_upload("sess-027", "a.csv", len(DATA))["upload_id"]
+    write_upload_chunk("sess-027", upload_id, 0, DATA)
+    return upload_id
+
+
+def _commit_while_hashing(monkeypatch, upload_id, during):
+    # Runs `during` while the first commit is hashing the upload.
+    hashing, release = threading.Event(), threading.Event()
+    file_sha256 = session_store.file_sha256
+
+    def slow_sha256(path):
+        hashing.set()
+        release.wait(5)
+        return file_sha256(path)
+
+    monkeypatch.setattr(session_store, "file_sha256", slow_sha256)
+    results = []
+    first = threading.Thread(target=lambda: results.append(commit_upload("sess-027", upload_id)))
+    first.start()
+    assert hashing.wait(5)
+    try:
+        during()
+    finally:
+        release.set()
+        first.join(5)
+    return results
+
+
+def test_second_commit_fails_while_the_first_runs(upload, monkeypatch, tmp_path):
+    def second_commit():
+        with pytest.raises(UploadBusyError):
+            commit_upload("sess-027", upload)
+
+    results = _commit_while_hashing(monkeypatch, upload, second_commit)
+    assert results == [{"name": "a.csv", "size": len(DATA)}]
+    assert (tmp_path / "sess-027" / "files" / "a.csv").read_bytes() == DATA
+
+
+def test_abort_and_chunks_fail_while_committing(upload, monkeypatch):
+    def interfere():
+        with pytest.raises(UploadBusyError):
+            abort_upload("sess-027", upload)
+        with pytest.raises(UploadBusyError):
+            write_upload_chunk("sess-027", upload, 0, DATA)
+
+    assert len(_commit_while_hashing(monkeypatch, upload, interfere)) == 1
+
+
+def test_failed_commit_can_be_retried(upload):
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        commit_upload("sess-027", upload, sha256="0" * 64)
+    assert commit_upload("sess-027", upload)["name"] == "a.csv"